@@ -10,6 +10,7 @@
 # Guidelines for Computing Crop Water Requirements
 
 import math
+import numpy as np
 
 # [W m-2 K-4] Stefan-Boltzmann constant
 STEFAN_BOLTZMANN = 5.670373E-8
@@ -99,3 +100,34 @@ def computeHourlyET0(height, airTemperature, globalSWRadiation, airRelHumidity,
     secondTerm = (psychro * (37. / airTempKelvin) * windSpeed_2m * (satVapPressure - vaporPressure)) / denominator
 
     return max(firstTerm + secondTerm, 0.)
+
+
+# reference evapotranspiration (mm) of a series of hours (numpy arrays)
+# same arguments of computeHourlyET0
+def computeHourlyET0Array(height, airTemperature, globalSWRadiation, airRelHumidity,
+                          windSpeed_10m, normTransmissivity):
+    airTemperature = np.asarray(airTemperature, np.float64)
+    airTempKelvin = airTemperature + ZERO_CELSIUS
+    windSpeed_2m = np.asarray(windSpeed_10m, np.float64) * 0.748
+    pressure = pressureFromAltitude(height) / 1000.
+    satVapPressure = 611 * np.exp(17.502 * airTemperature / (airTemperature + 240.97)) / 1000.
+    vaporPressure = satVapPressure * (np.asarray(airRelHumidity, np.float64) / 100.)
+    emissivity = 0.34 - 0.14 * np.sqrt(vaporPressure)
+    cloudFactor = np.maximum(0, 1.35 * np.minimum(normTransmissivity, 1) - 0.35)
+    netLWRadiation = cloudFactor * emissivity * STEFAN_BOLTZMANN * np.power(airTempKelvin, 4.)
+    netRadiation = (1. - ALBEDO_CROP_REFERENCE) * np.asarray(globalSWRadiation, np.float64) - netLWRadiation
+    netRadiation = netRadiation * 3600.
+
+    isPositive = netRadiation > 0
+    g = np.where(isPositive, 0.1, 0.5) * netRadiation
+    Cd = np.where(isPositive, 0.24, 0.96)
+
+    slope = 4098. * satVapPressure / (airTempKelvin * airTempKelvin)
+    latentHeatVap = 2501000. - 2369.2 * airTemperature
+    psychro = CP * pressure / (RATIO_WATER_VD * latentHeatVap)
+
+    denominator = slope + psychro * (1. + Cd * windSpeed_2m)
+    firstTerm = slope * (netRadiation - g) / (latentHeatVap * denominator)
+    secondTerm = (psychro * (37. / airTempKelvin) * windSpeed_2m * (satVapPressure - vaporPressure)) / denominator
+
+    return np.maximum(firstTerm + secondTerm, 0.)
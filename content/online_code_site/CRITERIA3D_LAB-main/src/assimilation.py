@@ -3,74 +3,49 @@
 # This module is part of the CRITERIA3D_LAB distribution
 # https://github.com/ARPA-SIMC/CRITERIA3D_LAB
 # ---------------------------------------------------------
+#
+# assimilation of the observed water potential (DataFrame x, y, z [m], value [kPa]):
+# the residual of volumetric water content (observed - simulated) at the observed
+# points is interpolated on the cells of the observed domain, the other cells take
+# the value of the closest interpolated cell
 
 from dataStructures import *
 import rectangularMesh
 import criteria3D
 import soil
 import numpy as np
-from scipy.interpolate import interpn
 
 
 def buildDataStructuresForInterpolation(initialState):
-    # Select just the vertices that compose a hyper-plane
-    initialState = initialState.sort_values(by=['x', 'y', 'z'])
-    # Understand which interpolation to apply (1D, 2D, 3D)
-    x = initialState["x"].unique()
-    y = initialState["y"].unique()
-    z = initialState["z"].unique()
-    # Instantiate and populate the data structure where all the known coordinates are stored
-    points = []
-    if len(x) > 1:
-        points += [x]
-    if len(y) > 1:
-        points += [y]
-    if len(z) > 1:
-        points += [z]
-    # Instantiate the data structure where all the values of the known points are stored
-    if len(points) == 1:
-        values = np.zeros(len(points[0]))
-    if len(points) == 2:
-        values = np.zeros((len(points[0]), len(points[1])))
-    if len(points) == 3:
-        values = np.zeros((len(points[0]), len(points[1]), len(points[2])))
-    # Populate the data structure where all the values of the known points are stored
-
-    for i in range(x.shape[-1]):
-        for j in range(y.shape[-1]):
-            for k in range(z.shape[-1]):
-                psi = initialState[(initialState["x"] == x[i]) & (initialState["y"] == y[j])
-                                   & (initialState["z"] == z[k])]["value"]
-                # from kPa to meters
-                observedPsi = float(psi / 9.81)
-                curve = C3DParameters.waterRetentionCurve
-                horizonIndex = soil.getHorizonIndex(z[k])
-                theta = soil.thetaFromPsi(curve, observedPsi, soil.horizons[horizonIndex])
-                index = rectangularMesh.getCellIndex(x[i], y[j], z[k])
-                if index != NODATA:
-                    currentTheta = soil.getVolumetricWaterContent(index)
-                    # check validity range of sensors
-                    if (abs(theta) > 0.3) and (abs(currentTheta) > 0.3):
-                        value = 0
-                    else:
-                        value = theta - currentTheta
-                else:
-                    value = 0
-
-                if len(points) == 1:
-                    # Even though we do not know which is the coordinate that has not one unique value,
-                    # we can sum all of the coordinates because the index of the ones that has just one unique value would be 0
-                    values[i + j + k] = value
-                if len(points) == 2:
-                    # We understand which is the pair of coordinates to consider, based on the one to not consider (lenght = 1)
-                    if len(x) == 1:
-                        values[j, k] = value
-                    if len(y) == 1:
-                        values[i, k] = value
-                    if len(z) == 1:
-                        values[i, j] = value
-                if len(points) == 3:
-                    values[i, j, k] = value
+    # coordinates of the grid of observed points
+    x = np.unique(initialState["x"].values)
+    y = np.unique(initialState["y"].values)
+    z = np.unique(initialState["z"].values)
+    xIndex = np.searchsorted(x, initialState["x"].values)
+    yIndex = np.searchsorted(y, initialState["y"].values)
+    zIndex = np.searchsorted(z, initialState["z"].values)
+
+    # from kPa to meters
+    observedPsi = initialState["value"].values / 9.81
+    curve = C3DParameters.waterRetentionCurve
+    depth = initialState["z"].values
+    theta = soil.thetaFromPsiArray(curve, observedPsi, soil.getHorizonIndexArray(depth))
+
+    # residual of the cells at the observed points (0: out of the mesh)
+    residual = np.zeros(len(initialState))
+    cellIndices = rectangularMesh.getCellIndices(initialState["x"].values, initialState["y"].values, depth)
+    isInside = cellIndices != NODATA
+    currentTheta = soil.getVolumetricWaterContentArray(cellIndices[isInside])
+    residual[isInside] = theta[isInside] - currentTheta
+    # check validity range of sensors
+    residual[np.flatnonzero(isInside)[(np.abs(theta[isInside]) > 0.3) & (np.abs(currentTheta) > 0.3)]] = 0
+
+    # only the coordinates with more than one value (1D, 2D, 3D interpolation)
+    # missing points of the grid: residual = 0
+    values = np.zeros((len(x), len(y), len(z)))
+    values[xIndex, yIndex, zIndex] = residual
+    points = [axis for axis in [x, y, z] if len(axis) > 1]
+    values = values.reshape([len(axis) for axis in points])
     return points, values, [x, y, z]
 
 
@@ -84,80 +59,78 @@ def getVertices(domain):
     return origin, maxFirstCoordinate, maxSecondCoordinate, maxThirdCoordinate
 
 
+# -----------------------------------------------------------
+# interpolated residual of the cells of the observed domain
+# return the indices of the cells and the values
+# -----------------------------------------------------------
 def interpolate(initialState):
+    # imported here: scipy.interpolate is slow to import
+    from scipy.interpolate import interpn
     points, values, domain = buildDataStructuresForInterpolation(initialState)
-    origin, maxFirstCoordinate, maxSecondCoordinate, maxThirdCoordinate = getVertices(domain)
-
-    originIndex = rectangularMesh.getCellIndex(origin[0], origin[1], origin[2])
-    maxFirstCoordinateIndex = rectangularMesh.getCellIndex(maxFirstCoordinate[0], maxFirstCoordinate[1],
-                                                           maxFirstCoordinate[2])
-    maxSecondCoordinateIndex = rectangularMesh.getCellIndex(maxSecondCoordinate[0], maxSecondCoordinate[1],
-                                                            maxSecondCoordinate[2])
-    maxThirdCoordinateIndex = rectangularMesh.getCellIndex(maxThirdCoordinate[0], maxThirdCoordinate[1],
-                                                           maxThirdCoordinate[2])
-
-    interpolated_points = {}
-    for x_inc in range(0, maxFirstCoordinateIndex - originIndex + 1, 1):
-        for y_inc in range(0, maxSecondCoordinateIndex - originIndex + C3DStructure.nrRectanglesInXAxis,
-                           C3DStructure.nrRectanglesInXAxis):
-            for z_inc in range(0, maxThirdCoordinateIndex - originIndex + C3DStructure.nrRectangles,
-                               C3DStructure.nrRectangles):
-
-                index = originIndex + x_inc + y_inc + z_inc
-                coords = [round(num, 2) for num in rectangularMesh.getXYDepth(index)]
-                x, y, z = coords[0], coords[1], coords[2]
-
-                if len(points) == 1:
-                    point = np.array([x + y + z])
-                if len(points) == 2:
-                    if len(domain[0]) == 1:
-                        point = np.array([y, z])
-                    if len(domain[1]) == 1:
-                        point = np.array([x, z])
-                    if len(domain[2]) == 1:
-                        point = np.array([x, y])
-                if len(points) == 3:
-                    point = np.array([x, y, z])
-
-                value = interpn(points, values, point, bounds_error=False)
-                interpolated_points[index] = value[0]
-    return interpolated_points
-
-
-def getCloserIndex(i, indices):
-    min_index = float('inf')
-    min_distance = float('inf')
-    # x_i, y_i, z_i = rectangularMesh.getXYDepth(i)
-    for index in indices:
-        # x_index, y_index, z_index = rectangularMesh.getXYDepth(index)
-        distance = criteria3D.getCellDistance(i, index)
-        if distance < min_distance:
-            min_index = index
-            min_distance = distance
-    return min_index
+    noValues = np.zeros(0, np.int64), np.zeros(0, np.float64)
+    if len(points) == 0:
+        print("WARNING: one observed point, the water potential is not assimilated")
+        return noValues
+
+    vertexIndices = [rectangularMesh.getCellIndex(vertex[0], vertex[1], vertex[2]) for vertex in getVertices(domain)]
+    if NODATA in vertexIndices:
+        print("WARNING: the observed points are out of the mesh, the water potential is not assimilated")
+        return noValues
+    originIndex, maxFirstCoordinateIndex, maxSecondCoordinateIndex, maxThirdCoordinateIndex = vertexIndices
+
+    # cells of the observed domain
+    xSteps = np.arange(0, maxFirstCoordinateIndex - originIndex + 1, 1)
+    ySteps = np.arange(0, maxSecondCoordinateIndex - originIndex + C3DStructure.nrRectanglesInXAxis,
+                       C3DStructure.nrRectanglesInXAxis)
+    zSteps = np.arange(0, maxThirdCoordinateIndex - originIndex + C3DStructure.nrRectangles,
+                       C3DStructure.nrRectangles)
+    indices = (originIndex + xSteps[:, None, None] + ySteps[None, :, None] + zSteps[None, None, :]).ravel()
+
+    coordinates = np.round(np.column_stack(rectangularMesh.getXYDepthArray(indices)), 2)
+    if len(points) == 1:
+        interpolationPoints = coordinates.sum(axis=1)[:, None]
+    else:
+        interpolationPoints = coordinates[:, [len(axis) > 1 for axis in domain]]
+
+    return indices, interpn(points, values, interpolationPoints, bounds_error=False)
 
 
 def assimilate(initialState):
-    interpolated_points = interpolate(initialState)
+    indices, values = interpolate(initialState)
 
     if not ((initialState['x'] < 0).any()):
-        initialState[['x', 'y']] = -initialState[['x', 'y']]
-        new_interpolated_points = interpolate(initialState)
-        interpolated_points = {**interpolated_points, **new_interpolated_points}
-
-    indices = interpolated_points.keys()
-    for i in range(C3DStructure.nrCells):
-        x, y, depth = rectangularMesh.getXYDepth(i)
-        if depth != 0:
-            if i in indices:
-                value = interpolated_points[i]
-            else:
-                min_index = getCloserIndex(i, indices)
-                value = interpolated_points[min_index]
-            # assign residual of volumetric water content
-            currentTheta = soil.getVolumetricWaterContent(i)
-            theta = currentTheta + value
-            curve = C3DParameters.waterRetentionCurve
-            horizonIndex = soil.getHorizonIndex(depth)
-            psi = soil.psiFromTheta(curve, theta, soil.horizons[horizonIndex])
-            criteria3D.setMatricPotential(i, psi)
+        symmetricState = initialState.copy()
+        symmetricState[['x', 'y']] = -symmetricState[['x', 'y']]
+        symmetricIndices, symmetricValues = interpolate(symmetricState)
+        indices = np.concatenate((indices, symmetricIndices))
+        values = np.concatenate((values, symmetricValues))
+    if len(indices) == 0:
+        return
+
+    # the last value of each cell, in the order of the first one
+    interpolatedValues = np.zeros(C3DStructure.nrCells)
+    interpolatedValues[indices] = values
+    isInterpolated = np.zeros(C3DStructure.nrCells, bool)
+    isInterpolated[indices] = True
+    _, first = np.unique(indices, return_index=True)
+    indices = indices[np.sort(first)]
+
+    cellIndices = np.arange(C3DStructure.nrCells)
+    _, _, depth = rectangularMesh.getXYDepthArray(cellIndices)
+    cellIndices = cellIndices[depth != 0]
+
+    # closest interpolated cell of the other cells
+    residual = interpolatedValues[cellIndices]
+    otherCells = cellIndices[~isInterpolated[cellIndices]]
+    if len(otherCells) > 0:
+        cellTree = rectangularMesh.CCellTree(indices)
+        closestCells = cellTree.getClosestCells(np.column_stack((C3DCells.x[otherCells], C3DCells.y[otherCells],
+                                                                 C3DCells.z[otherCells])))
+        residual[~isInterpolated[cellIndices]] = interpolatedValues[closestCells]
+
+    # assign residual of volumetric water content
+    theta = soil.getVolumetricWaterContentArray(cellIndices) + residual
+    curve = C3DParameters.waterRetentionCurve
+    horizonIndex = soil.getHorizonIndexArray(depth[cellIndices])
+    psi = soil.psiFromThetaArray(curve, theta, horizonIndex)
+    criteria3D.setMatricPotentialArray(cellIndices, psi)
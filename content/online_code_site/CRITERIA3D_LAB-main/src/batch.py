@@ -0,0 +1,223 @@
+# batch.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# batch runner: each scenario runs in its own worker process
+# (the model state is in module globals), without visualization
+# run with:
+# python batch.py scenarios.csv [nrProcesses] [outputFolder]
+#
+# scenarios file, one row for each scenario:
+#   name        scenario name
+#   project     project folder (relative to the scenarios file)
+#   soil        [optional] soil properties file
+#   meteo       [optional] meteo folder (e.g. another irrigation schedule)
+#   hours       [optional] max number of simulated hours
+#   other columns: C3DParameters to override (e.g. conductivityHVRatio)
+# empty values are not used
+
+import os
+import sys
+import time
+import traceback
+from ast import literal_eval
+import multiprocessing
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+
+from dataStructures import *
+import outputWriter
+
+SCENARIO_FIELDS = ["name", "project", "soil", "meteo", "hours"]
+
+
+# -----------------------------------------------------------
+# read the scenarios file and return a list of scenarios (dict)
+# the output of each scenario is saved in outputFolder/name
+# -----------------------------------------------------------
+def readScenarios(fileName, outputFolder):
+    table = pd.read_csv(fileName)
+    basePath = os.path.dirname(os.path.abspath(fileName))
+    if "name" not in table.columns or "project" not in table.columns:
+        print("ERROR! Missing name or project in the scenarios file: " + fileName)
+        return []
+    if table["name"].duplicated().any():
+        print("ERROR! Duplicated scenario names in: " + fileName)
+        return []
+
+    scenarios = []
+    for _, row in table.iterrows():
+        scenario = {"name": str(row["name"]),
+                    "project": os.path.join(basePath, str(row["project"])),
+                    "soil": "", "meteo": "", "hours": NODATA,
+                    "outputFolder": os.path.join(os.path.abspath(outputFolder), str(row["name"])),
+                    "parameters": {}}
+        if "soil" in table.columns and not pd.isna(row["soil"]):
+            scenario["soil"] = os.path.join(basePath, str(row["soil"]))
+        if "meteo" in table.columns and not pd.isna(row["meteo"]):
+            scenario["meteo"] = os.path.join(basePath, str(row["meteo"]))
+        if "hours" in table.columns and not pd.isna(row["hours"]):
+            scenario["hours"] = int(row["hours"])
+
+        for name in [column for column in table.columns if column not in SCENARIO_FIELDS]:
+            if not pd.isna(row[name]):
+                scenario["parameters"][name] = getParameterValue(name, row[name])
+        scenarios.append(scenario)
+    return scenarios
+
+
+# value of a parameter override: the value keeps its own type (as in main.py)
+# text: python literal or string, numbers: python int or float
+def getParameterValue(name, value):
+    if isinstance(value, str):
+        if isinstance(getattr(C3DParameters, name, None), bool):
+            return value.strip().lower() in ("true", "1")
+        try:
+            return literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            return value
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(getattr(C3DParameters, name, None), bool):
+        return bool(value)
+    # pandas reads integer columns as float: whole values of int parameters are int
+    if type(getattr(C3DParameters, name, None)) == int and isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# -----------------------------------------------------------
+# run one scenario (worker process)
+# the model output is written in outputFolder/log.txt
+# errors are returned in the result, they don't stop the batch
+# -----------------------------------------------------------
+def runScenario(scenario):
+    result = {"name": scenario["name"], "status": "FAILED", "error": "", "elapsedTime": 0.0,
+              "nrCells": NODATA, "initialStorage": NODATA, "finalStorage": NODATA,
+              "waterFlow": NODATA, "MBE": NODATA, "outputFolder": scenario["outputFolder"],
+              "exportFormat": NODATA}
+    startTime = time.perf_counter()
+    try:
+        os.makedirs(scenario["outputFolder"], exist_ok=True)
+        logFileName = os.path.join(scenario["outputFolder"], "log.txt")
+        with open(logFileName, "w") as logFile, redirect_stdout(logFile):
+            try:
+                simulate(scenario, result)
+            except Exception:
+                traceback.print_exc(file=logFile)
+                raise
+    except Exception as e:
+        result["error"] = type(e).__name__ + ": " + str(e)
+    result["elapsedTime"] = time.perf_counter() - startTime
+    return result
+
+
+def simulate(scenario, result):
+    # imported here: the model modules are initialized in the worker process
+    import main
+    import waterBalance
+    import exportUtils
+
+    parameters = dict(scenario["parameters"])
+    parameters["isVisual"] = False
+    project = main.loadProject(scenario["project"], parameters, scenario["soil"],
+                               scenario["meteo"], scenario["outputFolder"])
+    if project is None:
+        raise RuntimeError("project loading failed (see log.txt)")
+    result["nrCells"] = C3DStructure.nrCells
+
+    if not main.runProject(project, scenario["hours"]):
+        raise RuntimeError("simulation failed (see log.txt)")
+
+    result["initialStorage"] = waterBalance.allSimulation.waterStorage
+    result["finalStorage"] = waterBalance.currentStep.waterStorage
+    result["waterFlow"] = waterBalance.allSimulation.waterFlow
+    result["MBE"] = waterBalance.allSimulation.MBE
+    # format of the exports written (PARQUET_FORMAT falls back to NPY_FORMAT)
+    if exportUtils.writerWP is not None:
+        result["exportFormat"] = exportUtils.writerWP.outputFormat
+    result["status"] = "OK"
+
+
+# -----------------------------------------------------------
+# run all scenarios with a pool of nrProcesses workers
+# each worker runs one scenario and exits (no shared state)
+# return the results table (one row for each scenario)
+# -----------------------------------------------------------
+def runBatch(scenarios, nrProcesses):
+    nrScenarios = len(scenarios)
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=nrProcesses, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(runScenario, scenarios):
+            results.append(result)
+            message = "[" + str(len(results)) + "/" + str(nrScenarios) + "] " + result["name"] + ": " \
+                      + result["status"] + " (" + format(result["elapsedTime"], ".1f") + " s)"
+            if result["status"] == "OK":
+                message += " MBE [m3]: " + format(result["MBE"], ".3e")
+            else:
+                message += " " + result["error"]
+            print(message)
+
+    # same order of the scenarios, with the overridden parameters
+    resultsTable = pd.DataFrame(results).set_index("name")
+    parameters = pd.DataFrame([scenario["parameters"] for scenario in scenarios],
+                              index=[scenario["name"] for scenario in scenarios])
+    resultsTable = parameters.join(resultsTable)
+    resultsTable.index.name = "name"
+    return resultsTable.reset_index()
+
+
+# -----------------------------------------------------------
+# join the exports of the scenarios (e.g. waterPotential)
+# in one table with a scenario column
+# exportName: file name without extension (format written by the scenario)
+# -----------------------------------------------------------
+def collectExports(resultsTable, exportName):
+    tables = []
+    for _, result in resultsTable[resultsTable["status"] == "OK"].iterrows():
+        table = outputWriter.readOutput(os.path.join(result["outputFolder"], exportName),
+                                        int(result["exportFormat"]))
+        if table is not None:
+            table.insert(0, "scenario", result["name"])
+            tables.append(table)
+    if len(tables) == 0:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python batch.py scenarios.csv [nrProcesses] [outputFolder]")
+        return
+
+    scenariosFileName = sys.argv[1]
+    nrProcesses = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    if len(sys.argv) > 3:
+        outputFolder = sys.argv[3]
+    else:
+        outputFolder = os.path.join(os.path.dirname(os.path.abspath(scenariosFileName)), "batch_output")
+
+    scenarios = readScenarios(scenariosFileName, outputFolder)
+    if len(scenarios) == 0:
+        return
+    print("Nr. of scenarios:", len(scenarios), " processes:", nrProcesses)
+
+    resultsTable = runBatch(scenarios, nrProcesses)
+    os.makedirs(outputFolder, exist_ok=True)
+    resultsTable.to_csv(os.path.join(outputFolder, "results.csv"), index=False)
+    for exportName in ["waterPotential", "waterContent"]:
+        exports = collectExports(resultsTable, exportName)
+        if not exports.empty:
+            exports.to_csv(os.path.join(outputFolder, exportName + ".csv"), index=False)
+
+    nrFailed = int((resultsTable["status"] != "OK").sum())
+    print("\nEnd batch. Failed scenarios:", nrFailed)
+    print("Results:", os.path.join(outputFolder, "results.csv"))
+
+
+if __name__ == "__main__":
+    main()
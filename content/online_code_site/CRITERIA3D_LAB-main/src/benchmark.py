@@ -0,0 +1,475 @@
+# benchmark.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# numerical benchmarks, run with:
+# python benchmark.py gaussSeidel [nrLayers nrRows nrColumns nrSweeps threads...]
+# python benchmark.py newton [nrHours projects...]
+# python benchmark.py timeStep [nrHours projects...]
+# python benchmark.py soilTables [soilFile curve maxError]
+# python benchmark.py export [project nrScreenshots]
+# python benchmark.py meteo [project nrYears chunkSize]
+# python benchmark.py surfaceFlow [nrHours rain projects...]
+# python benchmark.py restart [project nrHours crashHour checkpointInterval]
+
+import os
+import sys
+import time
+import tempfile
+import importlib.util
+import numpy as np
+from commonConst import *
+
+
+# -----------------------------------------------------------
+# synthetic system on a structured grid (layers x rows x columns)
+# with the same form of the Criteria3D system:
+#   x[i] + sum_k A[i][k] * x[indices[i][k]] = b[i]
+# links: up, lateral (4), down
+# -----------------------------------------------------------
+def getSyntheticSystem(nrLayers, nrRows, nrColumns, seed=1):
+    rng = np.random.default_rng(seed)
+    nrCells = nrLayers * nrRows * nrColumns
+    layer, row, column = np.unravel_index(np.arange(nrCells), (nrLayers, nrRows, nrColumns))
+
+    indices = np.full((nrCells, 6), NOLINK, np.int32)
+    offsets = [(-1, 0, 0), (0, 0, 1), (0, 1, 0), (0, 0, -1), (0, -1, 0), (1, 0, 0)]
+    for k, (dl, dr, dc) in enumerate(offsets):
+        l2, r2, c2 = layer + dl, row + dr, column + dc
+        isValid = (l2 >= 0) & (l2 < nrLayers) & (r2 >= 0) & (r2 < nrRows) & (c2 >= 0) & (c2 < nrColumns)
+        indices[isValid, k] = np.ravel_multi_index((l2[isValid], r2[isValid], c2[isValid]),
+                                                   (nrLayers, nrRows, nrColumns))
+
+    # move NOLINK at the end of the rows
+    order = np.argsort(indices == NOLINK, axis=1, kind='stable')
+    indices = np.take_along_axis(indices, order, axis=1)
+    isLink = indices != NOLINK
+
+    # symmetric conductances (lognormal), small capacity: slow convergence as in saturated soils
+    logK = rng.normal(0.0, 1.0, nrCells)
+    j = np.where(isLink, indices, 0)
+    values = np.where(isLink, np.exp(0.5 * (logK[:, np.newaxis] + logK[j])), 0.0)
+    capacity = 1E-3 * np.exp(logK)
+    D = capacity + values.sum(axis=1)
+    A = -values / D[:, np.newaxis]
+    b = (capacity * rng.uniform(0.0, 1.0, nrCells)) / D
+    colors = (layer + row + column) % 2
+    return A, indices, b, colors
+
+
+def runSweeps(sweep, nrSweeps, x0, set_x_array):
+    set_x_array(x0)
+    norms = np.zeros(nrSweeps)
+    startTime = time.perf_counter()
+    for i in range(nrSweeps):
+        norms[i] = sweep()
+    return norms, time.perf_counter() - startTime
+
+
+# -----------------------------------------------------------
+# serial Gauss-Seidel and multicolor Gauss-Seidel (solverC)
+# convergence per sweep = geometric mean of norm[i+1] / norm[i]
+# -----------------------------------------------------------
+def benchmarkGaussSeidel(nrLayers=40, nrRows=51, nrColumns=51, nrSweeps=100, threadsList=(1, 2, 4)):
+    from solverC import setArraysC, set_system, set_x_array, setColors, GaussSeidel, GaussSeidelColored
+
+    A, indices, b, colors = getSyntheticSystem(nrLayers, nrRows, nrColumns)
+    nrCells = len(b)
+    setArraysC(nrCells, A.shape[1])
+    set_system(A, indices, b)
+    cells = np.argsort(colors, kind='stable').astype(np.int32)
+    setColors(cells, np.searchsorted(colors[cells], np.arange(3)).astype(np.int32))
+    x0 = np.zeros(nrCells)
+
+    print("grid:", nrLayers, "x", nrRows, "x", nrColumns, " cells:", nrCells, " sweeps:", nrSweeps)
+    print(format("solver", "<22") + format("last norm", ">12") + format("rate/sweep", ">12")
+          + format("ms/sweep", ">10") + format("speedup", ">9"))
+
+    results = [("serial", GaussSeidel)]
+    for nrThreads in threadsList:
+        results.append(("multicolor " + str(nrThreads) + " threads",
+                        lambda n=nrThreads: GaussSeidelColored(n)))
+
+    serialTime = NODATA
+    for name, sweep in results:
+        norms, elapsed = runSweeps(sweep, nrSweeps, x0, set_x_array)
+        rate = (norms[-1] / norms[0]) ** (1.0 / (nrSweeps - 1))
+        if serialTime == NODATA:
+            serialTime = elapsed
+        print(format(name, "<22") + format(norms[-1], ">12.3e") + format(rate, ">12.5f")
+              + format(elapsed / nrSweeps * 1000., ">10.3f") + format(serialTime / elapsed, ">9.2f"))
+
+
+# -----------------------------------------------------------
+# run the projects with each value of a parameter (C3DParameters)
+# options: list of (name, value)
+# parameters: other parameters of all the simulations
+# steps: accepted and rejected time steps
+# approx/step: approximations for each accepted step
+# -----------------------------------------------------------
+def compareSimulations(parameterName, options, nrHours, projects, parameters=None, weatherFolder=""):
+    from contextlib import redirect_stdout
+    from simulation import Simulation
+    import waterBalance
+
+    print("hours:", nrHours)
+    print(format("project", "<10") + format(parameterName, "<20") + format("accepted", ">10")
+          + format("rejected", ">10") + format("approx/step", ">13") + format("time [s]", ">10")
+          + format("MBE [m3]", ">12"))
+
+    outputFolder = tempfile.mkdtemp()
+    for project in projects:
+        projectPath = os.path.join("..", "data", project)
+        for name, value in options:
+            simulationFolder = os.path.join(outputFolder, project + "_" + name)
+            os.makedirs(simulationFolder)
+            simulation = Simulation()
+            with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+                simulationParameters = dict(parameters) if parameters is not None else {}
+                simulationParameters[parameterName] = value
+                isLoaded = simulation.load(projectPath, simulationParameters, weatherFolder=weatherFolder,
+                                           outputFolder=simulationFolder)
+                startTime = time.perf_counter()
+                isValid = isLoaded and simulation.run(nrHours)
+                elapsed = time.perf_counter() - startTime
+            if not isValid:
+                print(format(project, "<10") + format(name, "<20") + "  FAILED")
+                simulation.close()
+                continue
+
+            with simulation:
+                nrAccepted = waterBalance.nrAcceptedSteps
+                nrRejected = waterBalance.nrRejectedSteps
+                nrApproximations = waterBalance.nrApproximations
+                MBE = waterBalance.allSimulation.MBE
+            simulation.close()
+            print(format(project, "<10") + format(name, "<20") + format(nrAccepted, ">10")
+                  + format(nrRejected, ">10") + format(nrApproximations / max(nrAccepted, 1), ">13.2f")
+                  + format(elapsed, ">10.2f") + format(MBE, ">12.2e"))
+
+
+# Picard and Newton iterations on the same projects
+def benchmarkNewton(nrHours=24, projects=("test1D", "test2D", "test3D")):
+    compareSimulations("nonlinearSolver", [("picard", PICARD), ("newton", NEWTON)], nrHours, projects)
+
+
+# heuristic (halve/double) and PI time step controller
+def benchmarkTimeStep(nrHours=24, projects=("test1D", "test2D", "test3D")):
+    compareSimulations("timeStepController", [("heuristic", HEURISTIC), ("PI", PI_CONTROLLER)],
+                       nrHours, projects)
+
+
+# -----------------------------------------------------------
+# surface flow in the 3D system (Courant limit on the time step) and split
+# from the 3D system (explicit substeps) on a high-rain event:
+# the meteo data of each project with rain [mm hour-1] in the first nrHours
+# -----------------------------------------------------------
+def benchmarkSurfaceFlow(nrHours=6, rain=40.0, projects=("test3D",)):
+    import importUtils
+
+    print("rain [mm hour-1]:", rain)
+    for project in projects:
+        data = importUtils.readMeteoData(os.path.join("..", "data", project, "meteo"))
+        data.loc[data.index[:nrHours], "precipitation"] = rain
+        weatherFolder = tempfile.mkdtemp()
+        data.to_csv(os.path.join(weatherFolder, "meteo.csv"), index=False)
+        compareSimulations("surfaceFlowSolver", [("coupled", COUPLED_SURFACE_FLOW), ("split", SPLIT_SURFACE_FLOW)],
+                           nrHours, [project], {"computeSurfaceFlow": True}, weatherFolder)
+
+
+# -----------------------------------------------------------
+# soil lookup tables against the analytic functions
+# values: water potentials log-spaced from -0.01 to -TABLE_PSI_MAX [m]
+# error: max relative error on the values
+# -----------------------------------------------------------
+def benchmarkSoilTables(soilFileName=os.path.join("..", "data", "test2D", "settings", "soil.csv"),
+                        curve=IPPISCH_VG, maxError=1E-4, nrValues=1000000, nrRepetitions=10):
+    from dataStructures import C3DParameters
+    import soil
+
+    C3DParameters.waterRetentionCurve = curve
+    C3DParameters.isLookupTable = False
+    if not soil.readHorizon(soilFileName):
+        return
+    rng = np.random.default_rng(1)
+    horizonIndex = rng.integers(0, len(soil.horizons), nrValues)
+    signPsi = -np.exp(rng.uniform(np.log(0.01), np.log(TABLE_PSI_MAX), nrValues))
+    Se = soil.degreeOfSaturationArray(curve, signPsi, horizonIndex)
+
+    startTime = time.perf_counter()
+    tables = soil.CHydraulicTables(curve, maxError)
+    buildTime = time.perf_counter() - startTime
+    print("horizons:", len(soil.horizons), " values:", nrValues, " build time [s]:", format(buildTime, ".3f"))
+    print(format("function", "<24") + format("points", ">8") + format("max error", ">12")
+          + format("analytic [ns]", ">15") + format("table [ns]", ">12") + format("speedup", ">9"))
+
+    functions = [("degreeOfSaturation", tables.Se.nrPoints, signPsi,
+                  soil.degreeOfSaturationArray, tables.degreeOfSaturation),
+                 ("hydraulicConductivity", tables.k.nrPoints, Se,
+                  soil.hydraulicConductivityArray, tables.hydraulicConductivity),
+                 ("dTheta_dPsi", tables.dTheta.nrPoints, signPsi,
+                  soil.dTheta_dPsiArray, tables.dTheta_dPsi)]
+    for name, nrPoints, values, analytic, table in functions:
+        startTime = time.perf_counter()
+        for i in range(nrRepetitions):
+            y = analytic(curve, values, horizonIndex)
+        analyticTime = (time.perf_counter() - startTime) / nrRepetitions
+        startTime = time.perf_counter()
+        for i in range(nrRepetitions):
+            yTable = table(values, horizonIndex)
+        tableTime = (time.perf_counter() - startTime) / nrRepetitions
+
+        isValid = y > 0
+        error = float(np.max(np.fabs(yTable[isValid] / y[isValid] - 1.)))
+        print(format(name, "<24") + format(nrPoints, ">8") + format(error, ">12.2e")
+              + format(analyticTime / nrValues * 1E9, ">15.1f") + format(tableTime / nrValues * 1E9, ">12.1f")
+              + format(analyticTime / tableTime, ">9.2f"))
+
+
+# -----------------------------------------------------------
+# export of all cells (exportUtils.takeAll) with each output format
+# -----------------------------------------------------------
+def benchmarkExport(project="test3D", nrScreenshots=100):
+    from contextlib import redirect_stdout
+    from simulation import Simulation
+    from dataStructures import C3DStructure
+    import exportUtils
+
+    outputFolder = tempfile.mkdtemp()
+    print("project:", project, " screenshots:", nrScreenshots)
+    print(format("format", "<10") + format("ms/screenshot", ">15") + format("size [MB]", ">12"))
+    formats = [("csv", CSV_FORMAT), ("npy", NPY_FORMAT)]
+    if importlib.util.find_spec("pyarrow") is not None:
+        formats.append(("parquet", PARQUET_FORMAT))
+    for name, outputFormat in formats:
+        simulationFolder = os.path.join(outputFolder, name)
+        os.makedirs(simulationFolder)
+        simulation = Simulation()
+        with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+            if not simulation.load(os.path.join("..", "data", project), {"outputFormat": outputFormat},
+                                   outputFolder=simulationFolder):
+                print(format(name, "<10") + "  FAILED")
+                continue
+        with simulation:
+            exportUtils.oneTimestampPerRow = False
+            exportUtils.heightSlice = 0
+            with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+                exportUtils.createExportFile(simulationFolder)
+            startTime = time.perf_counter()
+            for i in range(nrScreenshots):
+                exportUtils.takeScreenshot(i * 3600)
+            exportUtils.closeExportFiles()
+            elapsed = time.perf_counter() - startTime
+        simulation.close()
+
+        size = sum(os.path.getsize(os.path.join(path, fileName))
+                   for path, _, fileNames in os.walk(simulationFolder) for fileName in fileNames)
+        print(format(name, "<10") + format(elapsed / nrScreenshots * 1000., ">15.2f")
+              + format(size / 1E6, ">12.2f"))
+
+
+# simulation stopped as by a crash after crashHour hours: the buffered outputs are not written
+def runUntilCrash(projectPath, parameters, outputFolder, crashHour):
+    from contextlib import redirect_stdout
+    import main
+    import exportUtils
+
+    takeScreenshot = exportUtils.takeScreenshot
+    nrScreenshots = [0]
+
+    def takeScreenshotAndCrash(timestamp):
+        takeScreenshot(timestamp)
+        nrScreenshots[0] += 1
+        if nrScreenshots[0] == crashHour:
+            os._exit(1)
+
+    exportUtils.takeScreenshot = takeScreenshotAndCrash
+    parameters = dict(parameters, isVisual=False)
+    with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+        project = main.loadProject(projectPath, parameters, outputFolder=outputFolder)
+        if project is not None:
+            main.runProject(project, crashHour)
+
+
+# -----------------------------------------------------------
+# restart after a crash (see runUntilCrash) with each output format:
+# the simulation is restarted from the last checkpoint up to nrHours
+# and compared with the same simulation without crash
+# rows: water potential output rows on disk after the crash,
+# after the restart and of the simulation without crash
+# max difference: outputs after the restart [m]
+# -----------------------------------------------------------
+def benchmarkRestart(project="test1D", nrHours=10, crashHour=8, checkpointInterval=5):
+    import multiprocessing
+    from contextlib import redirect_stdout
+    from simulation import Simulation
+    import outputWriter
+
+    projectPath = os.path.join("..", "data", project)
+    restartHour = crashHour // checkpointInterval * checkpointInterval
+    outputFolder = tempfile.mkdtemp()
+    print("project:", project, " hours:", nrHours, " crash:", crashHour, " restart:", restartHour)
+    print(format("format", "<10") + format("crash rows", ">12") + format("restart rows", ">14")
+          + format("rows", ">8") + format("max difference", ">16"))
+    formats = [("csv", CSV_FORMAT), ("npy", NPY_FORMAT)]
+    if importlib.util.find_spec("pyarrow") is not None:
+        formats.append(("parquet", PARQUET_FORMAT))
+    for name, outputFormat in formats:
+        parameters = {"outputFormat": outputFormat, "isSaveFields": True, "checkpointInterval": checkpointInterval}
+        wholeFolder = os.path.join(outputFolder, name + "_whole")
+        crashFolder = os.path.join(outputFolder, name + "_crash")
+        os.makedirs(wholeFolder)
+        os.makedirs(crashFolder)
+
+        process = multiprocessing.Process(target=runUntilCrash, args=(projectPath, parameters, crashFolder, crashHour))
+        process.start()
+        process.join()
+        try:
+            crashTable = outputWriter.readOutput(os.path.join(crashFolder, "waterPotential"), outputFormat)
+        except (OSError, ValueError, EOFError):
+            crashTable = None
+
+        whole = Simulation()
+        restart = Simulation()
+        with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+            isValid = (whole.load(projectPath, parameters, outputFolder=wholeFolder) and whole.run(nrHours)
+                       and restart.load(projectPath, parameters, outputFolder=crashFolder)
+                       and restart.run(nrHours - restartHour, os.path.join(crashFolder, "checkpoint.c3d")))
+        whole.close()
+        restart.close()
+        if not isValid:
+            print(format(name, "<10") + "  FAILED")
+            continue
+
+        wholeTable = outputWriter.readOutput(os.path.join(wholeFolder, "waterPotential"), outputFormat)
+        restartTable = outputWriter.readOutput(os.path.join(crashFolder, "waterPotential"), outputFormat)
+        if restartTable.shape == wholeTable.shape:
+            difference = format(float(np.max(np.fabs(restartTable.values - wholeTable.values))), ">16.2e")
+        else:
+            difference = format("different rows", ">16")
+        print(format(name, "<10") + format(len(crashTable) if crashTable is not None else 0, ">12d")
+              + format(len(restartTable), ">14d") + format(len(wholeTable), ">8d") + difference)
+
+
+# -----------------------------------------------------------
+# transmissivity and ET0 computed hour by hour (as in the previous versions),
+# for the whole series (meteoData.loadMeteoRecords) and in chunks (meteoData.CMeteoReader)
+# series of nrYears hourly data built from the meteo of the project
+# -----------------------------------------------------------
+def benchmarkMeteo(project="test1D", nrYears=10, chunkSize=8760, nrSampleHours=1000):
+    import tracemalloc
+    from contextlib import redirect_stdout
+    from dataStructures import C3DStructure
+    import importUtils
+    import meteoData
+    from transmissivity import computeNormTransmissivity
+    from PenmanMonteith import computeHourlyET0
+
+    projectPath = os.path.join("..", "data", project)
+    with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+        if not importUtils.readFieldParameters(os.path.join(projectPath, "settings", "field.ini")):
+            print("Wrong project: " + project)
+            return
+    data = importUtils.readMeteoData(os.path.join(projectPath, "meteo"))
+    nrHours = nrYears * 365 * 24
+    series = data.iloc[np.arange(nrHours) % len(data)].reset_index(drop=True)
+    series["timestamp"] = series["timestamp"].iloc[0] + np.arange(nrHours) * 3600
+    meteoFileName = os.path.join(tempfile.mkdtemp(), "meteo.csv")
+    series.to_csv(meteoFileName, index=False)
+    print("project:", project, " hours:", nrHours)
+
+    startTime = time.perf_counter()
+    for i in range(nrSampleHours):
+        transmissivity = computeNormTransmissivity(series, i, C3DStructure.latitude, C3DStructure.longitude)
+        computeHourlyET0(C3DStructure.elevation, series["air_temperature"].iloc[i], series["solar_radiation"].iloc[i],
+                         series["air_humidity"].iloc[i], series["wind_speed"].iloc[i], transmissivity)
+    hourlyTime = (time.perf_counter() - startTime) / nrSampleHours * nrHours
+    print(format("hour by hour (estimated)", "<28") + format(hourlyTime, ">10.3f") + " s")
+
+    readers = [("whole series + cache save", lambda: [meteoData.loadMeteoRecords(meteoFileName)]),
+               ("whole series, cache read", lambda: [meteoData.loadMeteoRecords(meteoFileName)]),
+               ("streaming", lambda: meteoData.CMeteoReader(meteoFileName, chunkSize))]
+    for name, reader in readers:
+        tracemalloc.start()
+        startTime = time.perf_counter()
+        with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+            nrRecords = sum(len(chunk) for chunk in reader())
+        elapsed = time.perf_counter() - startTime
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(format(name, "<28") + format(elapsed, ">10.3f") + " s" + format(peakMemory / 1E6, ">10.1f") + " MB"
+              + format(nrRecords, ">10d") + " hours")
+
+
+def main():
+    usage = "usage: python benchmark.py gaussSeidel [nrLayers nrRows nrColumns nrSweeps threads...]\n" \
+            "       python benchmark.py newton [nrHours projects...]\n" \
+            "       python benchmark.py timeStep [nrHours projects...]\n" \
+            "       python benchmark.py soilTables [soilFile curve maxError]\n" \
+            "       python benchmark.py export [project nrScreenshots]\n" \
+            "       python benchmark.py meteo [project nrYears chunkSize]\n" \
+            "       python benchmark.py surfaceFlow [nrHours rain projects...]\n" \
+            "       python benchmark.py restart [project nrHours crashHour checkpointInterval]"
+    if len(sys.argv) < 2 or sys.argv[1] not in ("gaussSeidel", "newton", "timeStep", "soilTables", "export",
+                                                "meteo", "surfaceFlow", "restart"):
+        print(usage)
+        return
+
+    if sys.argv[1] == "meteo":
+        args = sys.argv[2:]
+        args[1:3] = [int(value) for value in args[1:3]]
+        benchmarkMeteo(*args[:3])
+        return
+
+    if sys.argv[1] == "surfaceFlow":
+        args = sys.argv[2:]
+        if len(args) > 0:
+            args[0] = int(args[0])
+        if len(args) > 1:
+            args[1] = float(args[1])
+        if len(args) > 2:
+            args[2:] = [args[2:]]
+        benchmarkSurfaceFlow(*args)
+        return
+
+    if sys.argv[1] == "restart":
+        args = sys.argv[2:]
+        args[1:4] = [int(value) for value in args[1:4]]
+        benchmarkRestart(*args[:4])
+        return
+
+    if sys.argv[1] == "export":
+        args = sys.argv[2:]
+        if len(args) > 1:
+            args[1] = int(args[1])
+        benchmarkExport(*args[:2])
+        return
+
+    if sys.argv[1] == "soilTables":
+        args = sys.argv[2:]
+        if len(args) > 1:
+            args[1] = int(args[1])
+        if len(args) > 2:
+            args[2] = float(args[2])
+        benchmarkSoilTables(*args[:3])
+        return
+
+    if sys.argv[1] in ("newton", "timeStep"):
+        benchmark = benchmarkNewton if sys.argv[1] == "newton" else benchmarkTimeStep
+        if len(sys.argv) > 3:
+            benchmark(int(sys.argv[2]), sys.argv[3:])
+        else:
+            benchmark(*[int(value) for value in sys.argv[2:]])
+        return
+
+    args = [int(value) for value in sys.argv[2:]]
+    if len(args) > 4:
+        benchmarkGaussSeidel(*args[:4], threadsList=args[4:])
+    else:
+        benchmarkGaussSeidel(*args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,52 +4,100 @@
 # https://github.com/ARPA-SIMC/CRITERIA3D_LAB
 # ---------------------------------------------------------
 
-from math import sqrt
+import numpy as np
 from dataStructures import *
 
 
+# cells of each boundary type (see initializeBoundary)
+runoffCells = np.array([], np.int64)
+lateralDrainageCells = np.array([], np.int64)
+freeDrainageCells = np.array([], np.int64)
+prescribedPotentialCells = np.array([], np.int64)
+# all boundary cells and the surface ones
+boundaryCells = np.array([], np.int64)
+surfaceBoundaryCells = np.array([], np.int64)
+# [m3 s-1] runoff of the surface flow split from the 3D system (see waterProcesses.routeSurfaceWater)
+splitRunoffFlow = np.array([], np.float64)
+
+
+# the boundary types are set by criteria3D.initializeMesh
+def initializeBoundary():
+    global runoffCells, lateralDrainageCells, freeDrainageCells, prescribedPotentialCells
+    global boundaryCells, surfaceBoundaryCells, splitRunoffFlow
+    runoffCells = np.flatnonzero(C3DCells.boundaryType == BOUNDARY_RUNOFF)
+    lateralDrainageCells = np.flatnonzero(C3DCells.boundaryType == BOUNDARY_FREELATERALDRAINAGE)
+    freeDrainageCells = np.flatnonzero(C3DCells.boundaryType == BOUNDARY_FREEDRAINAGE)
+    prescribedPotentialCells = np.flatnonzero(C3DCells.boundaryType == BOUNDARY_PRESCRIBEDTOTALPOTENTIAL)
+    boundaryCells = np.flatnonzero(C3DCells.boundaryType != BOUNDARY_NONE)
+    surfaceBoundaryCells = boundaryCells[C3DCells.isSurface[boundaryCells]]
+    splitRunoffFlow = np.zeros(len(runoffCells), np.float64)
+
+
 def updateBoundary(deltaT):
-    for i in range(C3DStructure.nrCells):
-        # Initialize
-        C3DCells[i].flow = 0.0
-        C3DCells[i].boundary.flow = 0.0
-
-        # sink/source: precipitation, irrigation, evapotranspiration
-        if (C3DCells[i].sinkSource != NODATA) and (C3DCells[i].sinkSource != 0.0):
-            # [m3 s-1]
-            C3DCells[i].flow = C3DCells[i].sinkSource
-
-        if C3DCells[i].boundary.type != BOUNDARY_NONE:
-            slope = C3DCells[i].boundary.slope
-            meanH = (C3DCells[i].H + C3DCells[i].H0) * 0.5
-
-            if C3DCells[i].boundary.type == BOUNDARY_RUNOFF:
-                Hs = meanH - (C3DCells[i].z + C3DParameters.pond)
-                if Hs > EPSILON_METER and slope > 0:
-                    boundaryArea = C3DCells[i].boundary.area * Hs
-                    maxFlow = (Hs * C3DCells[i].area) / deltaT
-                    # Manning equation [m3 s-1]
-                    flow = ((boundaryArea / C3DParameters.roughness) * (Hs ** (2./3.)) * sqrt(slope))
-                    C3DCells[i].boundary.flow = -min(flow, maxFlow)
-
-            elif C3DCells[i].boundary.type == BOUNDARY_FREELATERALDRAINAGE:
-                k = C3DCells[i].k * C3DParameters.conductivityHVRatio
-                C3DCells[i].boundary.flow = -k * C3DCells[i].boundary.area * slope
-
-            elif C3DCells[i].boundary.type == BOUNDARY_FREEDRAINAGE:
-                C3DCells[i].boundary.flow = -C3DCells[i].k * C3DCells[i].upLink.area
-
-            elif C3DCells[i].boundary.type == BOUNDARY_PRESCRIBEDTOTALPOTENTIAL:
-                dzy = C3DStructure.slopeY * C3DCells[i].y
-                prescribedH = C3DStructure.elevation - dzy + C3DParameters.waterTableDepth
-                dH = prescribedH - C3DCells[i].H
-                C3DCells[i].boundary.flow = C3DCells[i].k * dH/0.1 * C3DCells[i].area
-
-            C3DCells[i].flow += C3DCells[i].boundary.flow
-
-            # check on water surface
-            if C3DCells[i].isSurface and C3DCells[i].flow < 0:
-                Hs = C3DCells[i].H - C3DCells[i].z
-                maxFlow = (Hs * C3DCells[i].area) / deltaT
-                if abs(C3DCells[i].flow) > maxFlow:
-                    C3DCells[i].flow = -maxFlow
+    # Initialize
+    C3DCells.boundaryFlow.fill(0.0)
+
+    # sink/source: precipitation, irrigation, evapotranspiration [m3 s-1]
+    C3DCells.flow[:] = np.where(C3DCells.sinkSource != NODATA, C3DCells.sinkSource, 0.0)
+
+    # surface runoff
+    cells = runoffCells
+    if C3DParameters.computeSurfaceFlow and C3DParameters.surfaceFlowSolver == SPLIT_SURFACE_FLOW:
+        C3DCells.boundaryFlow[cells] = splitRunoffFlow
+    else:
+        Hs = (C3DCells.H[cells] + C3DCells.H0[cells]) * 0.5 - (C3DCells.z[cells] + C3DParameters.pond)
+        slope = C3DCells.boundarySlope[cells]
+        isRunoff = (Hs > EPSILON_METER) & (slope > 0)
+        cells, Hs, slope = cells[isRunoff], Hs[isRunoff], slope[isRunoff]
+        boundaryArea = C3DCells.boundaryArea[cells] * Hs
+        maxFlow = (Hs * C3DCells.area[cells]) / deltaT
+        # Manning equation [m3 s-1]
+        flow = ((boundaryArea / C3DParameters.roughness) * (Hs ** (2./3.)) * np.sqrt(slope))
+        C3DCells.boundaryFlow[cells] = -np.minimum(flow, maxFlow)
+
+    # free lateral drainage
+    cells = lateralDrainageCells
+    k = C3DCells.k[cells] * C3DParameters.conductivityHVRatio
+    C3DCells.boundaryFlow[cells] = -k * C3DCells.boundaryArea[cells] * C3DCells.boundarySlope[cells]
+
+    # free drainage
+    cells = freeDrainageCells
+    C3DCells.boundaryFlow[cells] = -C3DCells.k[cells] * C3DCells.linkArea[cells, UP_LINK]
+
+    # prescribed total potential (water table)
+    cells = prescribedPotentialCells
+    dzy = C3DStructure.slopeY * C3DCells.y[cells]
+    prescribedH = C3DStructure.elevation - dzy + C3DParameters.waterTableDepth
+    dH = prescribedH - C3DCells.H[cells]
+    C3DCells.boundaryFlow[cells] = C3DCells.k[cells] * dH/0.1 * C3DCells.area[cells]
+
+    C3DCells.flow[boundaryCells] += C3DCells.boundaryFlow[boundaryCells]
+
+    # check on water surface
+    cells = surfaceBoundaryCells
+    flow = C3DCells.flow[cells]
+    maxFlow = ((C3DCells.H[cells] - C3DCells.z[cells]) * C3DCells.area[cells]) / deltaT
+    isOver = (flow < 0) & (np.abs(flow) > maxFlow)
+    C3DCells.flow[cells[isOver]] = -maxFlow[isOver]
+
+
+# -----------------------------------------------------------
+# [m^2 s^-1] derivative of the boundary flows with respect to H
+# dK_dH     derivative of the hydraulic conductivity (all cells)
+# runoff is not derived (lagged)
+# -----------------------------------------------------------
+def getBoundaryFlowDerivative(dK_dH):
+    dFlow = np.zeros(C3DStructure.nrCells, np.float64)
+
+    cells = lateralDrainageCells
+    dFlow[cells] = -dK_dH[cells] * C3DParameters.conductivityHVRatio \
+        * C3DCells.boundaryArea[cells] * C3DCells.boundarySlope[cells]
+
+    cells = freeDrainageCells
+    dFlow[cells] = -dK_dH[cells] * C3DCells.linkArea[cells, UP_LINK]
+
+    cells = prescribedPotentialCells
+    prescribedH = C3DStructure.elevation - C3DStructure.slopeY * C3DCells.y[cells] + C3DParameters.waterTableDepth
+    dH = prescribedH - C3DCells.H[cells]
+    dFlow[cells] = (dK_dH[cells] * dH - C3DCells.k[cells]) / 0.1 * C3DCells.area[cells]
+    return dFlow
@@ -0,0 +1,162 @@
+# checkpoint.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# checkpoint/restart: the whole model state (cells, water balance,
+# time step control, crop, meteo cursor) in one versioned file
+# format: uncompressed npz (zip of .npy arrays) with a json header:
+#   version, mesh dimensions, hash of the soil horizons,
+#   C3DParameters snapshot, meteo cursor
+# the file is written in a temporary file and then renamed (atomic)
+
+import os
+import json
+import hashlib
+import zipfile
+import numpy as np
+from dataStructures import *
+import soil
+import crop
+import waterBalance
+
+CHECKPOINT_VERSION = 1
+
+# parameters changed by the model during the simulation: restored from the checkpoint
+DYNAMIC_PARAMETERS = ["currentDeltaT", "currentDeltaT_max", "MBRThreshold"]
+BALANCE_VARIABLES = ["totalTime", "currentPrec", "currentIrr", "MBRMultiply", "maxCourant", "bestMBR",
+                     "nrMBRWrong", "forceExit", "nrAcceptedSteps", "nrRejectedSteps", "nrApproximations",
+                     "nrSurfaceSteps"]
+BALANCE_STEPS = ["currentStep", "previousStep", "allSimulation"]
+BALANCE_STEP_VARIABLES = ["waterStorage", "waterFlow", "MBE", "MBR"]
+CROP_VARIABLES = ["currentLAI", "currentRootDepth", "currentRootLength"]
+
+
+# numpy scalars are saved as python values (json)
+def toValue(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def getHorizonsHash():
+    values = hashlib.sha256()
+    for name, array in sorted(vars(soil.horizonArrays).items()):
+        values.update(name.encode())
+        values.update(np.ascontiguousarray(array).tobytes())
+    return values.hexdigest()
+
+
+def getParameters():
+    return {name: toValue(value) for name, value in vars(C3DParameters).items()
+            if not name.startswith("__") and isinstance(value, (bool, int, float, str, np.generic))}
+
+
+def getController():
+    controller = waterBalance.controller
+    state = {"type": type(controller).__name__}
+    if isinstance(controller, waterBalance.CPIController):
+        state["previousError"] = toValue(controller.previousError)
+    return state
+
+
+def setController(state):
+    if state["type"] != type(waterBalance.controller).__name__:
+        return False
+    if isinstance(waterBalance.controller, waterBalance.CPIController):
+        waterBalance.controller.previousError = state["previousError"]
+    return True
+
+
+# -----------------------------------------------------------
+# weatherIndex:    index of the next hour in the meteo data (NODATA if unknown)
+# currentIndex:    number of the next hour from the start (periodic assimilation)
+# -----------------------------------------------------------
+def saveCheckpoint(fileName, weatherIndex=NODATA, currentIndex=NODATA):
+    header = {"version": CHECKPOINT_VERSION,
+              "nrLayers": int(C3DStructure.nrLayers), "nrRectangles": int(C3DStructure.nrRectangles),
+              "nrCells": int(C3DStructure.nrCells), "horizonsHash": getHorizonsHash(),
+              "parameters": getParameters(),
+              "weatherIndex": int(weatherIndex), "currentIndex": int(currentIndex),
+              "waterBalance": {name: toValue(getattr(waterBalance, name)) for name in BALANCE_VARIABLES},
+              "balanceSteps": {name: {variable: toValue(getattr(getattr(waterBalance, name), variable))
+                                      for variable in BALANCE_STEP_VARIABLES} for name in BALANCE_STEPS},
+              "controller": getController(),
+              "crop": {name: toValue(getattr(crop.currentCrop, name)) for name in CROP_VARIABLES},
+              "maxRootFactor": toValue(getattr(crop, "maxRootFactor", NODATA))}
+
+    arrays = {"header": np.frombuffer(json.dumps(header).encode(), np.uint8)}
+    for name, value in vars(C3DCells).items():
+        if isinstance(value, np.ndarray):
+            arrays["cells." + name] = value
+    arrays["crop.k_root"] = np.asarray(crop.k_root)
+    arrays["crop.rootDensity"] = crop.rootDensity
+
+    tmpFileName = fileName + ".tmp"
+    with open(tmpFileName, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpFileName, fileName)
+
+
+def isCheckpoint(fileName):
+    if not zipfile.is_zipfile(fileName):
+        return False
+    with zipfile.ZipFile(fileName) as f:
+        return "header.npy" in f.namelist()
+
+
+# -----------------------------------------------------------
+# restore the state saved by saveCheckpoint, after loading the same project
+# return the header, or None if the checkpoint is not compatible
+# -----------------------------------------------------------
+def loadCheckpoint(fileName):
+    # a damaged or incomplete file (e.g. a crash while it is copied) is not a checkpoint
+    try:
+        with np.load(fileName, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        header = json.loads(arrays["header"].tobytes().decode())
+        version = header["version"]
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+        print("ERROR! The checkpoint cannot be read: " + fileName + " (" + str(e) + ")")
+        return None
+    if version > CHECKPOINT_VERSION:
+        print("ERROR! Checkpoint version " + str(version) + " is not supported: " + fileName)
+        return None
+    if header["nrLayers"] != C3DStructure.nrLayers or header["nrRectangles"] != C3DStructure.nrRectangles:
+        print("ERROR! The mesh of the checkpoint is different: " + fileName)
+        return None
+    if header["horizonsHash"] != getHorizonsHash():
+        print("ERROR! The soil of the checkpoint is different: " + fileName)
+        return None
+    if header["controller"]["type"] != type(waterBalance.controller).__name__:
+        print("ERROR! The time step controller of the checkpoint is different: " + fileName)
+        return None
+
+    for name, value in header["parameters"].items():
+        if name not in DYNAMIC_PARAMETERS and getattr(C3DParameters, name, None) != value:
+            print("WARNING: the parameter " + name + " is different from the checkpoint: "
+                  + str(getattr(C3DParameters, name, None)) + " (checkpoint: " + str(value) + ")")
+
+    for name in [name for name in arrays if name.startswith("cells.")]:
+        getattr(C3DCells, name[len("cells."):])[...] = arrays[name]
+    crop.k_root = arrays["crop.k_root"].copy()
+    crop.rootDensity = arrays["crop.rootDensity"].copy()
+    # storage of the cells of the restored state (last accepted step)
+    waterBalance.initializeCellStorage()
+
+    for name in DYNAMIC_PARAMETERS:
+        setattr(C3DParameters, name, header["parameters"][name])
+    for name, value in header["waterBalance"].items():
+        setattr(waterBalance, name, value)
+    for name, values in header["balanceSteps"].items():
+        for variable, value in values.items():
+            setattr(getattr(waterBalance, name), variable, value)
+    setController(header["controller"])
+    for name, value in header["crop"].items():
+        setattr(crop.currentCrop, name, value)
+    if header["maxRootFactor"] != NODATA:
+        crop.maxRootFactor = header["maxRootFactor"]
+    return header
@@ -147,3 +147,41 @@ def getSurfaceWaterColor(waterHeight, maximum):
         # index = int(percentage * (len(colorRangeSE) - 1))
         # return colorRangeSE[index]
         return 0, 1 - percentage, percentage
+
+
+# -----------------------------------------------------------
+# colors of arrays of values (nr. values x 3): same colors of the functions above
+# -----------------------------------------------------------
+matricPotentialThresholds = np.array([-0.1, -1.0, -5.0, -10, -20, -33, -50, -100, -300])     # [kPa]
+matricPotentialColors = np.array([[0.5, 0, 1], [0, 0, 1], [0, 0.4, 1], [0, 0.8, 1], [0, 1, 0.8], [0, 1, 0],
+                                  [0.8, 1, 0], [1, 0.75, 0], [1, 0.25, 0], [1, 0, 0]])
+
+
+def getSEColorArray(degreeSaturation, minimum, maximum):
+    percentage = (degreeSaturation - minimum) / (maximum - minimum)
+    percentage = np.minimum(1.0, np.maximum(percentage, 0.0))
+    colors = colorRangeSE[(percentage * (len(colorRangeSE) - 1)).astype(np.int64)]
+    colors[degreeSaturation == 0] = 0.5
+    return colors
+
+
+def getRootColorArray(rootDensity, minimum, maximum):
+    value = (rootDensity - minimum) / (maximum - minimum)
+    value = np.minimum(1.0, np.maximum(value, 0.0))
+    return colorRangeRoot[(value * (len(colorRangeSE) - 1)).astype(np.int64)]
+
+
+# signPsi [m]
+def getMatricPotentialColorArray(signPsi):
+    signPsi = signPsi * 9.81     # [kPa]
+    # first threshold exceeded (the last color if none)
+    index = len(matricPotentialThresholds) - np.sum(signPsi[:, None] > matricPotentialThresholds, axis=1)
+    return matricPotentialColors[index]
+
+
+def getSurfaceWaterColorArray(waterHeight, maximum):
+    percentage = waterHeight / maximum
+    percentage = np.minimum(1.0, np.maximum(0.0, percentage))
+    colors = np.column_stack((np.zeros(len(percentage)), 1 - percentage, percentage))
+    colors[percentage < EPSILON] = (0, 1, 0)  # green
+    return colors
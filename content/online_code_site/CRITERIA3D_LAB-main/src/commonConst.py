@@ -13,6 +13,29 @@ LOGARITHMIC = 1
 HARMONIC = 2
 GEOMETRIC = 3
 
+GAUSS_SEIDEL = 1
+SUPERLU = 2
+CG = 3
+BICGSTAB = 4
+
+JACOBI = 1
+ILU = 2
+
+PICARD = 1
+NEWTON = 2
+
+HEURISTIC = 1
+PI_CONTROLLER = 2
+
+# surface flow: in the 3D system or explicit substeps (see waterProcesses.routeSurfaceWater)
+COUPLED_SURFACE_FLOW = 1
+SPLIT_SURFACE_FLOW = 2
+SURFACE_COURANT = 0.5           # max Courant number of the surface substeps
+
+CSV_FORMAT = 1
+NPY_FORMAT = 2
+PARQUET_FORMAT = 3
+
 NODATA = -9999.
 NOLINK = -1
 
@@ -26,6 +49,11 @@ BOUNDARY_FREELATERALDRAINAGE = 3
 BOUNDARY_PRESCRIBEDTOTALPOTENTIAL = 4
 BOUNDARY_NONE = 99
 
+LINK_SUBSURFACE = 1
+LINK_LATERAL = 2
+LINK_SURFACE_SUBSURFACE = 3
+LINK_SURFACE_SURFACE = 4
+
 OK = 1
 INDEX_ERROR = -1111
 LINK_ERROR = -5555
@@ -33,5 +61,19 @@ LINK_ERROR = -5555
 EPSILON = 1E-6
 EPSILON_METER = 1E-4  # [m]
 
+# soil lookup tables
+TABLE_PSI_MAX = 1E4  # [m] max water potential (absolute value)
+TABLE_MAX_POINTS = 65537
+
+# PI time step controller
+PI_KI = 0.3
+PI_KP = 0.2
+PI_SAFETY = 0.9
+PI_MIN_FACTOR = 0.2
+PI_MAX_FACTOR = 2.0
+PI_MIN_ERROR = 1E-3
+PI_COURANT = 0.8                # target Courant number
+PI_APPROXIMATIONS = 5           # target number of approximations
+
 ALL = 1
 ONLY_SURFACE = 2
@@ -4,18 +4,18 @@
 # https://github.com/ARPA-SIMC/CRITERIA3D_LAB
 # ---------------------------------------------------------
 
-from math import fabs
 import pandas as pd
 import numpy as np
-import time
 
 from dataStructures import *
 from PenmanMonteith import computeHourlyET0
 import rectangularMesh
 import waterBalance
-import visual3D
 import soil
 import crop
+import meteoData
+import boundaryConditions
+import waterProcesses
 
 if CYTHON:
     import solverCython as solver
@@ -35,180 +35,156 @@ def memoryAllocation(nrLayers, nrRectangles):
     C3DStructure.nrLayers = nrLayers
     C3DStructure.nrCells = nrLayers * nrRectangles
     solver.setCriteria3DArrays(C3DStructure.nrCells, C3DStructure.nrMaxLinks)
-    C3DCells.clear()
-    for i in range(C3DStructure.nrCells):
-        C3DCells.append(Ccell())
-
-
-def setCellGeometry(i, x, y, z, volume, area):
-    C3DCells[i].x = x
-    C3DCells[i].y = y
-    C3DCells[i].z = z
-    C3DCells[i].volume = volume
-    C3DCells[i].area = area
-
-
-def setCellProperties(i, isSurface, boundaryType):
-    C3DCells[i].isSurface = isSurface
-    C3DCells[i].boundary.type = boundaryType
-
-
-def setBoundaryProperties(i, area, slope):
-    C3DCells[i].boundary.area = area
-    C3DCells[i].boundary.slope = slope
-
-
-def getCellDistance(i, j):
-    v1 = [C3DCells[i].x, C3DCells[i].y, C3DCells[i].z]
-    v2 = [C3DCells[j].x, C3DCells[j].y, C3DCells[j].z]
-    return rectangularMesh.distance3D(v1, v2)
+    C3DCells.allocate(C3DStructure.nrCells)
+    C3DLinks.clear()
 
 
 # -----------------------------------------------------------
-# direction:         UP, DOWN, LATERAL
-# interfaceArea      [m^2]            
+# links from cells to linkCells (arrays) in a column of the link arrays
+# interfaceArea      [m^2] (side length [m] for surface lateral links)
 # -----------------------------------------------------------
-def SetCellLink(i, linkIndex, direction, interfaceArea):
-    if direction == UP:
-        C3DCells[i].upLink.index = linkIndex
-        C3DCells[i].upLink.area = interfaceArea
-        C3DCells[i].upLink.distance = fabs(C3DCells[i].z - C3DCells[linkIndex].z)
-        return OK
-    elif direction == DOWN:
-        C3DCells[i].downLink.index = linkIndex
-        C3DCells[i].downLink.area = interfaceArea
-        C3DCells[i].downLink.distance = fabs(C3DCells[i].z - C3DCells[linkIndex].z)
-        return OK
-    elif direction == LATERAL:
-        for j in range(C3DStructure.nrLateralLinks):
-            if C3DCells[i].lateralLink[j].index == NOLINK:
-                C3DCells[i].lateralLink[j].index = linkIndex
-                C3DCells[i].lateralLink[j].area = interfaceArea
-                C3DCells[i].lateralLink[j].distance = getCellDistance(i, linkIndex)
-                return OK
-    else:
-        return LINK_ERROR
+def setCellLinks(cells, linkCells, column, interfaceArea):
+    C3DCells.linkIndex[cells, column] = linkCells
+    C3DCells.linkArea[cells, column] = interfaceArea
+    dx = np.fabs(C3DCells.x[cells] - C3DCells.x[linkCells])
+    dy = np.fabs(C3DCells.y[cells] - C3DCells.y[linkCells])
+    dz = np.fabs(C3DCells.z[cells] - C3DCells.z[linkCells])
+    C3DCells.linkDistance[cells, column] = np.sqrt(dx * dx + dy * dy + dz * dz)
 
 
+# -----------------------------------------------------------
+# cell index = layer * nrRectangles + rectangle
+# the arrays (nrLayers x nrRectangles) are the cells in index order
+# -----------------------------------------------------------
 def initializeMesh():
     print("Set cell properties...")
-    waterTableDepth = NODATA
-
-    for i in range(C3DStructure.nrRectangles):
-        [x, y, z] = rectangularMesh.C3DRM[i].centroid
-        dzy = C3DStructure.slopeY * y
-        elevation = C3DStructure.elevation - dzy
-        totalPotential = elevation + C3DParameters.initialWaterPotential
-        if C3DParameters.isWaterTable:
-            waterTableDepth = elevation + C3DParameters.waterTableDepth
-
-        for layer in range(C3DStructure.nrLayers):
-            index = i + C3DStructure.nrRectangles * layer
-            elevation = z - soil.depth[layer]
-            volume = float(rectangularMesh.C3DRM[i].area * soil.thickness[layer])
-            setCellGeometry(index, x, y, elevation, volume, rectangularMesh.C3DRM[i].area)
-            C3DCells[index].horizonIndex = soil.getHorizonIndex(soil.depth[layer])
-            if layer == 0:
-                # surface
-                if rectangularMesh.C3DRM[i].isBoundary and C3DParameters.isSurfaceRunoff:
-                    setCellProperties(index, True, BOUNDARY_RUNOFF)
-                    setBoundaryProperties(index, rectangularMesh.C3DRM[i].boundarySide,
-                                          rectangularMesh.C3DRM[i].boundarySlope)
-                else:
-                    setCellProperties(index, True, BOUNDARY_NONE)
-
-                setMatricPotential(index, max(C3DParameters.initialWaterPotential, 0.0))
-
-            elif layer == (C3DStructure.nrLayers - 1):
-                # last layer
-                if C3DParameters.isWaterTable:
-                    setCellProperties(index, False, BOUNDARY_PRESCRIBEDTOTALPOTENTIAL)
-                elif C3DParameters.isFreeDrainage:
-                    setCellProperties(index, False, BOUNDARY_FREEDRAINAGE)
-                else:
-                    setCellProperties(index, False, BOUNDARY_NONE)
-
-                setTotalPotential(index, max(totalPotential, waterTableDepth))
-            else:
-                if rectangularMesh.C3DRM[i].isBoundary and C3DParameters.isFreeLateralDrainage:
-                    setCellProperties(index, False, BOUNDARY_FREELATERALDRAINAGE)
-                    setBoundaryProperties(index, rectangularMesh.C3DRM[i].boundarySide * soil.thickness[layer],
-                                          rectangularMesh.C3DRM[i].boundarySlope)
-                else:
-                    setCellProperties(index, False, BOUNDARY_NONE)
-
-                setTotalPotential(index, max(totalPotential, waterTableDepth))
+    nrLayers = C3DStructure.nrLayers
+    nrRectangles = C3DStructure.nrRectangles
+    rectangles = rectangularMesh.C3DRM
+    depth = np.asarray(soil.depth[:nrLayers], np.float64)
+    thickness = np.asarray(soil.thickness[:nrLayers], np.float64)
+    x, y, z = rectangles.centroid[:, 0], rectangles.centroid[:, 1], rectangles.centroid[:, 2]
+    area = rectangles.area
+
+    # geometry
+    C3DCells.x[:] = np.tile(x, nrLayers)
+    C3DCells.y[:] = np.tile(y, nrLayers)
+    C3DCells.z[:] = (z[np.newaxis, :] - depth[:, np.newaxis]).ravel()
+    C3DCells.volume[:] = (area[np.newaxis, :] * thickness[:, np.newaxis]).ravel()
+    C3DCells.area[:] = np.tile(area, nrLayers)
+    C3DCells.horizonIndex[:] = np.repeat(soil.getHorizonIndexArray(depth), nrRectangles)
+
+    # boundary
+    layer = np.repeat(np.arange(nrLayers), nrRectangles)
+    isBoundary = np.tile(rectangles.isBoundary, nrLayers)
+    C3DCells.isSurface[:] = (layer == 0)
+    C3DCells.boundaryType[:] = BOUNDARY_NONE
+    if C3DParameters.isSurfaceRunoff:
+        cells = np.flatnonzero((layer == 0) & isBoundary)
+        C3DCells.boundaryType[cells] = BOUNDARY_RUNOFF
+        C3DCells.boundaryArea[cells] = rectangles.boundarySide[cells]
+        C3DCells.boundarySlope[cells] = rectangles.boundarySlope[cells]
+    if C3DParameters.isWaterTable:
+        C3DCells.boundaryType[layer == nrLayers - 1] = BOUNDARY_PRESCRIBEDTOTALPOTENTIAL
+    elif C3DParameters.isFreeDrainage:
+        C3DCells.boundaryType[layer == nrLayers - 1] = BOUNDARY_FREEDRAINAGE
+    if C3DParameters.isFreeLateralDrainage:
+        cells = np.flatnonzero((layer > 0) & (layer < nrLayers - 1) & isBoundary)
+        rectangle = cells % nrRectangles
+        C3DCells.boundaryType[cells] = BOUNDARY_FREELATERALDRAINAGE
+        C3DCells.boundaryArea[cells] = rectangles.boundarySide[rectangle] * thickness[layer[cells]]
+        C3DCells.boundarySlope[cells] = rectangles.boundarySlope[rectangle]
+
+    # initial conditions
+    surfaceCells = np.arange(nrRectangles)
+    C3DCells.H[surfaceCells] = C3DCells.z[surfaceCells] + max(C3DParameters.initialWaterPotential, 0.0)
+    C3DCells.Se[surfaceCells] = 1.
+    C3DCells.k[surfaceCells] = soil.horizons[0].Ks
+
+    subSurfaceCells = np.arange(nrRectangles, C3DStructure.nrCells)
+    elevation = C3DStructure.elevation - C3DStructure.slopeY * y
+    totalPotential = elevation + C3DParameters.initialWaterPotential
+    if C3DParameters.isWaterTable:
+        totalPotential = np.maximum(totalPotential, elevation + C3DParameters.waterTableDepth)
+    C3DCells.H[subSurfaceCells] = np.tile(totalPotential, nrLayers - 1)
+    C3DCells.Se[subSurfaceCells] = soil.getDegreeOfSaturationArray(subSurfaceCells)
+    C3DCells.k[subSurfaceCells] = soil.getHydraulicConductivityArray(subSurfaceCells)
+    C3DCells.H0[:] = C3DCells.H
 
     print("Set links...")
-    for i in range(C3DStructure.nrRectangles):
-        # UP
-        for layer in range(1, C3DStructure.nrLayers):
-            exchangeArea = rectangularMesh.C3DRM[i].area
-            index = C3DStructure.nrRectangles * layer + i
-            linkIndex = index - C3DStructure.nrRectangles
-            SetCellLink(index, linkIndex, UP, exchangeArea)
-        # LATERAL
-        for neighbour in rectangularMesh.C3DRM[i].neighbours:
-            if neighbour != NOLINK:
-                linkSide = rectangularMesh.getAdjacentSide(i, neighbour)
-                for layer in range(C3DStructure.nrLayers):
-                    if layer == 0:
-                        # surface: boundary length [m]
-                        exchangeArea = linkSide
-                    else:
-                        # sub-surface: boundary area [m2]
-                        exchangeArea = soil.thickness[layer] * linkSide
-                    index = C3DStructure.nrRectangles * layer + i
-                    linkIndex = C3DStructure.nrRectangles * layer + neighbour
-                    SetCellLink(index, linkIndex, LATERAL, exchangeArea)
-        # DOWN
-        for layer in range(C3DStructure.nrLayers - 1):
-            exchangeArea = rectangularMesh.C3DRM[i].area
-            index = C3DStructure.nrRectangles * layer + i
-            linkIndex = index + C3DStructure.nrRectangles
-            SetCellLink(index, linkIndex, DOWN, exchangeArea)
+    # UP and DOWN
+    setCellLinks(subSurfaceCells, subSurfaceCells - nrRectangles, UP_LINK, C3DCells.area[subSurfaceCells])
+    cells = np.arange(C3DStructure.nrCells - nrRectangles)
+    setCellLinks(cells, cells + nrRectangles, DOWN_LINK, C3DCells.area[cells])
+
+    # LATERAL: the first free columns, in the order of the neighbours
+    sides = rectangularMesh.getAdjacentSides()
+    isNeighbour = rectangles.neighbours != NOLINK
+    columns = FIRST_LATERAL_LINK + np.cumsum(isNeighbour, axis=1) - 1
+    rectangle, k = np.nonzero(isNeighbour)
+    for layer in range(nrLayers):
+        if layer == 0:
+            # surface: boundary length [m]
+            exchangeArea = sides[rectangle, k]
+        else:
+            # sub-surface: boundary area [m2]
+            exchangeArea = thickness[layer] * sides[rectangle, k]
+        offset = nrRectangles * layer
+        setCellLinks(offset + rectangle, offset + rectangles.neighbours[rectangle, k], columns[rectangle, k],
+                     exchangeArea)
+
+    # edge arrays
+    C3DLinks.setLinks(C3DCells)
+    boundaryConditions.initializeBoundary()
 
 
 def setTotalPotential(i, totalPotential):
-    if C3DCells[i].isSurface:
-        C3DCells[i].H = max(totalPotential, 0.0)
-        C3DCells[i].Se = 1.
-        C3DCells[i].k = soil.horizons[0].Ks
+    if C3DCells.isSurface[i]:
+        C3DCells.H[i] = max(totalPotential, 0.0)
+        C3DCells.Se[i] = 1.
+        C3DCells.k[i] = soil.horizons[0].Ks
     else:
-        C3DCells[i].H = totalPotential
-        C3DCells[i].Se = soil.getDegreeOfSaturation(i)
-        C3DCells[i].k = soil.getHydraulicConductivity(i)
-    C3DCells[i].H0 = C3DCells[i].H
+        C3DCells.H[i] = totalPotential
+        C3DCells.Se[i] = soil.getDegreeOfSaturation(i)
+        C3DCells.k[i] = soil.getHydraulicConductivity(i)
+    C3DCells.H0[i] = C3DCells.H[i]
     return OK
 
 
 def setMatricPotential(i, signPsi):
-    if C3DCells[i].isSurface:
-        C3DCells[i].H = C3DCells[i].z + max(signPsi, 0.0)
-        C3DCells[i].Se = 1.
-        C3DCells[i].k = soil.horizons[0].Ks
+    if C3DCells.isSurface[i]:
+        C3DCells.H[i] = C3DCells.z[i] + max(signPsi, 0.0)
+        C3DCells.Se[i] = 1.
+        C3DCells.k[i] = soil.horizons[0].Ks
     else:
-        C3DCells[i].H = C3DCells[i].z + signPsi
-        C3DCells[i].Se = soil.getDegreeOfSaturation(i)
-        C3DCells[i].k = soil.getHydraulicConductivity(i)
-    C3DCells[i].H0 = C3DCells[i].H
+        C3DCells.H[i] = C3DCells.z[i] + signPsi
+        C3DCells.Se[i] = soil.getDegreeOfSaturation(i)
+        C3DCells.k[i] = soil.getHydraulicConductivity(i)
+    C3DCells.H0[i] = C3DCells.H[i]
+    return OK
+
+
+# sub-surface cells
+def setMatricPotentialArray(cellIndices, signPsi):
+    C3DCells.H[cellIndices] = C3DCells.z[cellIndices] + signPsi
+    C3DCells.Se[cellIndices] = soil.getDegreeOfSaturationArray(cellIndices)
+    C3DCells.k[cellIndices] = soil.getHydraulicConductivityArray(cellIndices)
+    C3DCells.H0[cellIndices] = C3DCells.H[cellIndices]
     return OK
 
 
 def getMatricPotential(i):
-    if C3DCells[i].isSurface:
-        return max(C3DCells[i].H - C3DCells[i].z, 0.0)
+    if C3DCells.isSurface[i]:
+        return max(C3DCells.H[i] - C3DCells.z[i], 0.0)
     else:
-        return C3DCells[i].H - C3DCells[i].z
+        return C3DCells.H[i] - C3DCells.z[i]
 
 
 def initializeSinkSource(cellType):
     if cellType == ONLY_SURFACE:
-        for i in range(C3DStructure.nrRectangles):
-            C3DCells[i].sinkSource = 0
+        C3DCells.sinkSource[:C3DStructure.nrRectangles] = 0
     else:
-        for i in range(C3DStructure.nrCells):
-            C3DCells[i].sinkSource = 0
+        C3DCells.sinkSource[:] = 0
 
 
 # -----------------------------------------------------------
@@ -218,9 +194,8 @@ def initializeSinkSource(cellType):
 # -----------------------------------------------------------
 def setRainfall(rain, duration):
     rate = (rain * 0.001) / duration  # [m s^-1]
-    for i in range(C3DStructure.nrRectangles):
-        area = C3DCells[i].area  # [m^2]
-        C3DCells[i].sinkSource += rate * area  # [m^3 s^-1]
+    surface = slice(0, C3DStructure.nrRectangles)
+    C3DCells.sinkSource[surface] += rate * C3DCells.area[surface]  # [m^3 s^-1]
 
 
 # -----------------------------------------------------------
@@ -232,7 +207,7 @@ def setDripIrrigation(irrigation, duration):
     rate = irrigation / duration  # [l s^-1]
 
     for index in dripperIndices:
-        C3DCells[index].sinkSource += rate * 0.001  # [m^3 s^-1]
+        C3DCells.sinkSource[index] += rate * 0.001  # [m^3 s^-1]
 
 
 # -----------------------------------------------------------
@@ -240,6 +215,10 @@ def setDripIrrigation(irrigation, duration):
 # timeLength        [s]
 # -----------------------------------------------------------
 def computeWaterFlow(timeLength):
+    if isRedraw:
+        # imported here: vpython is needed only for the visualization
+        import visual3D
+
     currentTime = 0
     while currentTime < timeLength:
         residualTime = timeLength - currentTime
@@ -249,22 +228,32 @@ def computeWaterFlow(timeLength):
         while not acceptedStep:
             if isRedraw:
                 if visual3D.isPause and not visual3D.isComputeEquilibrium:
+                    visual3D.redraw()
                     print("\nPress 'r' to run")
                     while visual3D.isPause:
-                        time.sleep(0.00001)
+                        visual3D.waitKeyInput()
 
             deltaT = min(C3DParameters.currentDeltaT, residualTime)
             # print("time step [s]: ", deltaT)
             # print("sink/source [l]:", format(waterBalance.sumSinkSource(deltaT) * 1000., ".5f"))
 
+            # surface flow split from the 3D system: before the step
+            isSurfaceSplit = C3DParameters.computeSurfaceFlow \
+                and C3DParameters.surfaceFlowSolver == SPLIT_SURFACE_FLOW
+            if isSurfaceSplit:
+                initialH = C3DCells.H.copy()
+                waterBalance.nrSurfaceSteps += waterProcesses.routeSurfaceWater(deltaT)
+
             acceptedStep = solver.computeStep(deltaT)
-            if not acceptedStep:
+            if acceptedStep:
+                waterBalance.nrAcceptedSteps += 1
+            else:
+                waterBalance.nrRejectedSteps += 1
                 # restoreWater
-                for i in range(C3DStructure.nrCells):
-                    C3DCells[i].H = C3DCells[i].H0
+                C3DCells.H[:] = initialH if isSurfaceSplit else C3DCells.H0
 
         if isRedraw:
-            visual3D.redraw()
+            visual3D.redraw(False)
         currentTime += deltaT
 
 
@@ -310,9 +299,12 @@ def computeOneHour(obsWeather, obsWater, transmissivity):
     else:
         precipitation = 0
 
-    # evapotranspiration [mm m-2]
-    ET0 = computeHourlyET0(C3DStructure.elevation, airTemperature, globalSWRadiation, airRelHumidity,
-                           windSpeed_10m, transmissivity)
+    # evapotranspiration [mm m-2] (precomputed in the meteo records, see meteoData)
+    if meteoData.hasVariable(obsWeather, "ET0"):
+        ET0 = obsWeather["ET0"]
+    else:
+        ET0 = computeHourlyET0(C3DStructure.elevation, airTemperature, globalSWRadiation, airRelHumidity,
+                               windSpeed_10m, transmissivity)
 
     initializeSinkSource(ALL)
     crop.setEvapotranspiration(currentDateTime, ET0)
@@ -332,12 +324,8 @@ def computeOneHour(obsWeather, obsWater, transmissivity):
         setDripIrrigation(irrigation, 3600)
 
     # reduce deltaT during water event
-    if (waterBalance.currentIrr > 0) or (waterBalance.currentPrec > 0):
-        if C3DParameters.currentDeltaT_max > 300:
-            C3DParameters.currentDeltaT_max = 300
-            C3DParameters.currentDeltaT = min(C3DParameters.currentDeltaT, C3DParameters.currentDeltaT_max)
-    else:
-        C3DParameters.currentDeltaT_max = C3DParameters.deltaT_max
+    isWaterEvent = (waterBalance.currentIrr > 0) or (waterBalance.currentPrec > 0)
+    waterBalance.controller.setWaterEvent(isWaterEvent)
 
     print(currentDateTime)
     computeWaterFlow(3600)
@@ -44,8 +44,11 @@ class CCrop:
 
 # global variables
 currentCrop = CCrop()
-rootDensity = []
+rootDensity = np.zeros((0, 0), np.float64)   # nrRectangles x nrLayers
 k_root = np.array([], np.float64)
+nrEvapLayers = 0
+evapCoefficient = np.array([], np.float64)
+evapWeight = np.array([], np.float64)
 global maxRootFactor, x, y
 
 
@@ -54,10 +57,9 @@ def setNoCrop():
     global k_root, rootDensity, maxRootFactor
 
     k_root = np.zeros(C3DStructure.nrRectangles)
-    rootDensity.clear()
-    for i in range(C3DStructure.nrRectangles):
-        rootDensity.append(np.zeros(C3DStructure.nrLayers, np.float64))
+    rootDensity = np.zeros((C3DStructure.nrRectangles, C3DStructure.nrLayers), np.float64)
     maxRootFactor = 1
+    initializeEvaporation()
 
 
 def initializeCrop():
@@ -82,25 +84,15 @@ def initializeCrop():
     c = y[0] * (x[1] - x[0]) - x[0] * (y[1] - y[0])
     denominator = math.sqrt(a * a + b * b)
 
-    for i in range(C3DStructure.nrRectangles):
-        [cx, cy, cz] = rectangularMesh.C3DRM[i].centroid
-        line_distance = math.fabs(a * cx + b * cy + c) / denominator
+    cx = rectangularMesh.C3DRM.centroid[:, 0]
+    cy = rectangularMesh.C3DRM.centroid[:, 1]
+    line_distance = np.fabs(a * cx + b * cy + c) / denominator
+    isRooted = (line_distance < max_distance) | (np.fabs(line_distance - max_distance) < EPSILON)
+    factor = 1.0 - line_distance[isRooted] / (max_distance * 0.5)
+    k_root[isRooted] = 1.0 + factor * currentCrop.rootXDeformation
 
-        if line_distance < max_distance or math.fabs(line_distance - max_distance) < EPSILON:
-            factor = 1.0 - line_distance / (max_distance * 0.5)
-            k_root[i] = 1.0 + factor * currentCrop.rootXDeformation
-        else:
-            k_root[i] = 0.0
-
-    # set root density
-    rootDensity.clear()
-    maxRootFactor = 0
-    for i in range(C3DStructure.nrRectangles):
-        rootDensity.append(computeRootDensity(currentCrop, C3DStructure.nrLayers, k_root[i]))
-        # update max root factor
-        for layer in range(1, C3DStructure.nrLayers):
-            root_factor = k_root[i] * rootDensity[i][layer] / soil.thickness[layer]
-            maxRootFactor = max(root_factor, maxRootFactor)
+    setRootDensity()
+    initializeEvaporation()
 
 
 # fraction of intercepted photosynthetically active radiation [-]
@@ -126,44 +118,43 @@ def getMaxTranspiration(currentLAI, kcMax, ET0):
         return ET0 * fPAR * TC
 
 
+# root density of the atoms (1 mm) of the rooted zone
 def cardioidDistribution(deformationFactor, nrLayersWithRoot):
-    # initialize
-    halfCircle = np.zeros(nrLayersWithRoot)
-    cardioid = np.zeros(nrLayersWithRoot * 2)
-
-    for i in range(nrLayersWithRoot):
-        sinAlfa = 1.0 - float(i + 1.0) / float(nrLayersWithRoot)
-        cosAlfa = max(math.sqrt(1.0 - math.pow(sinAlfa, 2.0)), EPSILON)
-        alfa = math.atan(sinAlfa / cosAlfa)
-        halfCircle[i] = ((math.pi / 2.0) - alfa - sinAlfa * cosAlfa) / math.pi
-
-    lastLayer = nrLayersWithRoot * 2 - 1
-    cardioid[0] = halfCircle[0]
-    cardioid[lastLayer] = cardioid[0]
-    for i in range(1, nrLayersWithRoot):
-        cardioid[i] = halfCircle[i] - halfCircle[i - 1]
-        cardioid[lastLayer - i] = cardioid[i]
+    sinAlfa = 1.0 - np.arange(1, nrLayersWithRoot + 1, dtype=np.float64) / float(nrLayersWithRoot)
+    cosAlfa = np.maximum(np.sqrt(1.0 - sinAlfa * sinAlfa), EPSILON)
+    alfa = np.arctan(sinAlfa / cosAlfa)
+    halfCircle = ((math.pi / 2.0) - alfa - sinAlfa * cosAlfa) / math.pi
+
+    # symmetric cardioid
+    halfCardioid = np.diff(halfCircle, prepend=0.0)
+    cardioid = np.concatenate((halfCardioid, halfCardioid[::-1]))
 
     # cardioid deformation
     LiMin = -math.log(0.2) / float(nrLayersWithRoot)
     LiMax = -math.log(0.05) / float(nrLayersWithRoot)
     k = LiMin + (LiMax - LiMin) * (deformationFactor - 1.0)
-
-    rootDensitySum = 0
-    for i in range(nrLayersWithRoot * 2):
-        cardioid[i] *= math.exp(-k * (i + 0.5))
-        rootDensitySum += cardioid[i]
+    cardioid *= np.exp(-k * (np.arange(nrLayersWithRoot * 2) + 0.5))
 
     # normalize
-    for i in range(nrLayersWithRoot * 2):
-        cardioid[i] /= rootDensitySum
+    cardioid /= np.cumsum(cardioid)[-1]
 
     # assign layer density
-    layerDensity = np.zeros(nrLayersWithRoot, np.float64)
-    for i in range(nrLayersWithRoot):
-        layerDensity[i] = cardioid[2 * i] + cardioid[2 * i + 1]
+    return cardioid[0::2] + cardioid[1::2]
+
+
+# -----------------------------------------------------------
+# cumulative root density of the atoms: value i = density of the first i atoms
+# (nrRootedAtoms + 1 values), cached for each root length and deformation
+# -----------------------------------------------------------
+rootDensityCache = {}
+
 
-    return layerDensity
+def getCumulativeRootDensity(nrRootedAtoms, deformationFactor):
+    key = (nrRootedAtoms, deformationFactor)
+    if key not in rootDensityCache:
+        densityAtoms = cardioidDistribution(deformationFactor, nrRootedAtoms)
+        rootDensityCache[key] = np.concatenate(([0.0], np.cumsum(densityAtoms)))
+    return rootDensityCache[key]
 
 
 def computeRootDensity(crop, nrLayers, rootFactor):
@@ -177,111 +168,173 @@ def computeRootDensity(crop, nrLayers, rootFactor):
     if rootLength < 0.001:
         return myRootDensity
 
-    # smallest unit of computation (1 mm)
-    atoms = np.zeros(nrLayers, np.int16)
-    for i in range(nrLayers):
-        atoms[i] = int(round(soil.thickness[i] * 1000))
+    # smallest unit of computation (1 mm): first and last atom of each layer
+    atoms = np.rint(np.asarray(soil.thickness[:nrLayers]) * 1000).astype(np.int64)
+    lastAtom = np.cumsum(atoms)
+    firstAtom = lastAtom - atoms
 
     nrUnrootedAtoms = int(round(rootZero * 1000))
     nrRootedAtoms = int(round(rootLength * 1000))
-    densityAtoms = cardioidDistribution(crop.rootZDeformation, nrRootedAtoms)
+    cumulativeDensity = getCumulativeRootDensity(nrRootedAtoms, crop.rootZDeformation)
 
-    # assign root density
-    counter = 0
-    for layer in range(nrLayers):
-        for i in range(atoms[layer]):
-            if (counter >= nrUnrootedAtoms) and (counter < nrUnrootedAtoms + nrRootedAtoms):
-                myRootDensity[layer] += densityAtoms[counter - nrUnrootedAtoms]
-            counter += 1
+    # assign root density: rooted atoms of each layer
+    first = np.clip(firstAtom - nrUnrootedAtoms, 0, nrRootedAtoms)
+    last = np.clip(lastAtom - nrUnrootedAtoms, 0, nrRootedAtoms)
+    myRootDensity[:] = cumulativeDensity[last] - cumulativeDensity[first]
 
     # check (rootDensitySum == 1)
-    rootDensitySum = 0.0
-    for i in range(nrLayers):
-        rootDensitySum += myRootDensity[i]
+    rootDensitySum = np.cumsum(myRootDensity)[-1]
     if abs(rootDensitySum - 1.0) > EPSILON:
         print("WARNING! Sum of root density:", rootDensitySum)
 
     return myRootDensity
 
 
-# assign hourly transpiration
-def setTranspiration(surfaceIndex, myRootDensity, maxTranspiration):
-    if maxTranspiration < EPSILON:
-        return 0.0
-
-    # Initialize
-    rootDensityWithoutStress = 0.0  # [-]
-    actualTranspiration = 0.0  # [mm]
-
-    nrLayers = len(myRootDensity)
-    isLayerStressed = np.zeros(nrLayers, dtype=bool)
-    layerTranspiration = np.zeros(nrLayers, np.float64)  # [mm]
-
-    for layer in range(nrLayers):
-        if myRootDensity[layer] > 0:
-            i = surfaceIndex + C3DStructure.nrRectangles * layer
-            theta = soil.getVolumetricWaterContent(i)
-            horizon = soil.horizons[C3DCells[i].horizonIndex]
-            # water surplus
-            if theta > horizon.FC:
-                fraction = 1.0 - (theta - horizon.FC) / (horizon.thetaS - horizon.FC)
-                fraction = fraction ** 3
-                layerTranspiration[layer] = maxTranspiration * fraction * myRootDensity[layer]
-                isLayerStressed[layer] = True
-            else:
-                # water scarcity
-                wsThreshold = horizon.FC - currentCrop.fRAW * (horizon.FC - horizon.WP)
-                if theta < wsThreshold:
-                    if theta <= horizon.WP:
-                        layerTranspiration[layer] = 0.0
-                    else:
-                        layerTranspiration[layer] = maxTranspiration * myRootDensity[layer] * (
-                                (theta - horizon.WP) / (wsThreshold - horizon.WP))
-                    isLayerStressed[layer] = True
-                else:
-                    # normal conditions
-                    layerTranspiration[layer] = maxTranspiration * myRootDensity[layer]
-
-                    # check stress
-                    theta_mm = theta * soil.thickness[layer] * 1000.
-                    WSThreshold_mm = wsThreshold * soil.thickness[layer] * 1000.
-
-                    if (theta_mm - layerTranspiration[layer]) > WSThreshold_mm:
-                        isLayerStressed[layer] = False
-                        rootDensityWithoutStress += myRootDensity[layer]
-                    else:
-                        isLayerStressed[layer] = True
-
-            actualTranspiration += layerTranspiration[layer]
+# -----------------------------------------------------------
+# root density of all rectangles and max root factor, for the current
+# root length of the crop: it can be called again when the roots grow
+# the rectangles with the same root factor (k_root) have the same density
+# -----------------------------------------------------------
+def setRootDensity():
+    global rootDensity, maxRootFactor
+
+    rootDensity = np.zeros((C3DStructure.nrRectangles, C3DStructure.nrLayers), np.float64)
+    rootFactors, rectangleFactor = np.unique(k_root, return_inverse=True)
+    for i in range(len(rootFactors)):
+        rootDensity[rectangleFactor == i] = computeRootDensity(currentCrop, C3DStructure.nrLayers, rootFactors[i])
+
+    # max root factor
+    maxRootFactor = 0
+    if C3DStructure.nrLayers > 1:
+        rootFactor = k_root[:, None] * rootDensity[:, 1:] / soil.thickness[1:C3DStructure.nrLayers]
+        maxRootFactor = max(float(np.max(rootFactor)), maxRootFactor)
+
+
+# -----------------------------------------------------------
+# water content of the cells of all rectangles (nrRectangles x nrLayers)
+# the surface layer (0) has no water content: NODATA
+# -----------------------------------------------------------
+def getSoilColumns(values):
+    return values.reshape(C3DStructure.nrLayers, C3DStructure.nrRectangles).T
+
+
+def getWaterContentColumns():
+    theta = np.full(C3DStructure.nrCells, NODATA)
+    subSurfaceCells = np.arange(C3DStructure.nrRectangles, C3DStructure.nrCells)
+    theta[subSurfaceCells] = soil.getVolumetricWaterContentArray(subSurfaceCells)
+    return getSoilColumns(theta)
+
+
+# sum on the layers in the same order of a loop (cumsum is sequential)
+def sumLayers(values):
+    return np.cumsum(values, axis=1)[:, -1]
+
+
+# flux of the layers [mm hour-1] (nrRectangles x nrLayers) subtracted from sinkSource [m3 s-1]
+def assignSinkSource(layerFlux, isActive):
+    rate = np.zeros((C3DStructure.nrRectangles, C3DStructure.nrLayers), np.float64)
+    rate[isActive] = (layerFlux[isActive] * 0.001) / 3600.     # [m s-1]
+    sinkSource = getSoilColumns(C3DCells.sinkSource)
+    area = getSoilColumns(C3DCells.area)
+    sinkSource[isActive] -= rate[isActive] * area[isActive]    # [m3 s-1]
+
+
+# -----------------------------------------------------------
+# assign hourly transpiration of all rectangles
+# maxTranspiration     [mm] array (nrRectangles)
+# return actual transpiration [mm] array (nrRectangles)
+# -----------------------------------------------------------
+def setTranspiration(maxTranspiration):
+    actualTranspiration = np.zeros(C3DStructure.nrRectangles, np.float64)
+    isTranspiration = maxTranspiration >= EPSILON
+    if not np.any(isTranspiration):
+        return actualTranspiration
+
+    maxT = maxTranspiration[:, None]
+    isRoot = (rootDensity > 0) & isTranspiration[:, None]
+    theta = getWaterContentColumns()
+    horizonIndex = getSoilColumns(C3DCells.horizonIndex)
+    FC = soil.horizonArrays.FC[horizonIndex]
+    WP = soil.horizonArrays.WP[horizonIndex]
+    thetaS = soil.horizonArrays.thetaS[horizonIndex]
+    wsThreshold = FC - currentCrop.fRAW * (FC - WP)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # water surplus
+        isSurplus = theta > FC
+        fraction = (1.0 - (theta - FC) / (thetaS - FC)) ** 3
+        surplusTranspiration = maxT * fraction * rootDensity
+        # water scarcity
+        isScarcity = ~isSurplus & (theta < wsThreshold)
+        scarcityTranspiration = np.where(theta <= WP, 0.0,
+                                         maxT * rootDensity * ((theta - WP) / (wsThreshold - WP)))
+        # normal conditions
+        normalTranspiration = maxT * rootDensity
+
+    layerTranspiration = np.where(isSurplus, surplusTranspiration,
+                                  np.where(isScarcity, scarcityTranspiration, normalTranspiration))
+    layerTranspiration[~isRoot] = 0.0
+
+    # check stress (normal conditions)
+    theta_mm = theta * soil.thickness * 1000.
+    WSThreshold_mm = wsThreshold * soil.thickness * 1000.
+    isNotStressed = isRoot & ~isSurplus & ~isScarcity & ((theta_mm - layerTranspiration) > WSThreshold_mm)
+
+    actualTranspiration = sumLayers(layerTranspiration)
+    rootDensityWithoutStress = sumLayers(np.where(isNotStressed, rootDensity, 0.0))
 
     # WATER STRESS [-]
-    waterStress = 1. - (actualTranspiration / maxTranspiration)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        waterStress = 1. - (actualTranspiration / maxTranspiration)
 
     # Hydraulic redistribution
     # the movement of water from moist to dry soil through plant roots
+    # redistribution acts on not stressed roots
     # TODO add numerical process
-    if waterStress > EPSILON and rootDensityWithoutStress > EPSILON:
-        redistribution = min(waterStress, rootDensityWithoutStress) * maxTranspiration
-
-        # redistribution acts on not stressed roots
-        for layer in range(nrLayers):
-            if (myRootDensity[layer] > 0) and (not isLayerStressed[layer]):
-                addTranspiration = redistribution * (myRootDensity[layer] / rootDensityWithoutStress)
-                layerTranspiration[layer] += addTranspiration
-                actualTranspiration += addTranspiration
+    isRedistribution = isTranspiration & (waterStress > EPSILON) & (rootDensityWithoutStress > EPSILON)
+    if np.any(isRedistribution):
+        redistribution = np.minimum(waterStress, rootDensityWithoutStress) * maxTranspiration
+        isAdded = isNotStressed & isRedistribution[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            addTranspiration = redistribution[:, None] * (rootDensity / rootDensityWithoutStress[:, None])
+        layerTranspiration[isAdded] += addTranspiration[isAdded]
+        actualTranspiration = sumLayers(layerTranspiration)
 
     # Assign transpiration flux [m3 s-1]
-    for layer in range(nrLayers):
-        if layerTranspiration[layer] > 0:
-            i = surfaceIndex + C3DStructure.nrRectangles * layer
-            rate = (layerTranspiration[layer] * 0.001) / 3600.0  # [m s-1]
-            C3DCells[i].sinkSource -= rate * C3DCells[i].area  # [m3 s-1]
-
+    assignSinkSource(layerTranspiration, layerTranspiration > 0)
     return actualTranspiration
 
 
-# assign hourly soil evaporation
-def setEvaporation(surfaceIndex, maxEvaporation):
+# -----------------------------------------------------------
+# depth coefficients of the evaporation (they depend only on the layers)
+# 1 at first layer, ~0.1 at MAX_EVAPORATION_DEPTH
+# -----------------------------------------------------------
+def initializeEvaporation():
+    global nrEvapLayers, evapCoefficient, evapWeight
+
+    nrEvapLayers = 0
+    while (nrEvapLayers < len(soil.depth)) and (soil.depth[nrEvapLayers] <= MAX_EVAPORATION_DEPTH):
+        nrEvapLayers += 1
+
+    evapCoefficient = np.zeros(nrEvapLayers, np.float64)
+    sumCoefficient = 0
+    for i in range(1, nrEvapLayers):
+        depthCoefficient = max((soil.depth[i] - soil.depth[1]) / (MAX_EVAPORATION_DEPTH - soil.depth[1]), 0)
+        evapCoefficient[i] = math.exp(-depthCoefficient * math.e)
+        sumCoefficient += (evapCoefficient[i] * soil.thickness[i])
+
+    # fraction of the evaporation of each layer
+    evapWeight = np.zeros(nrEvapLayers, np.float64)
+    for i in range(1, nrEvapLayers):
+        evapWeight[i] = (evapCoefficient[i] * soil.thickness[i]) / sumCoefficient
+
+
+# -----------------------------------------------------------
+# assign hourly soil evaporation of all rectangles
+# maxEvaporation     [mm]
+# return actual evaporation [mm] array (nrRectangles)
+# -----------------------------------------------------------
+def setEvaporation(maxEvaporation):
     # TODO: enable surface evaporation - numerical problem
     """
     surfaceWater = (C3DCells[surfaceIndex].H - C3DCells[surfaceIndex].z)        # [m]
@@ -290,56 +343,41 @@ def setEvaporation(surfaceIndex, maxEvaporation):
     C3DCells[surfaceIndex].sinkSource -= rate * C3DCells[surfaceIndex].area     # [m3 s-1]
     """
     surfaceEvaporation = 0
-    actualEvaporation = surfaceEvaporation
-    residualEvaporation = maxEvaporation - surfaceEvaporation
+    actualEvaporation = np.full(C3DStructure.nrRectangles, float(surfaceEvaporation))
+    residualEvaporation = np.full(C3DStructure.nrRectangles, maxEvaporation - surfaceEvaporation)
 
-    if residualEvaporation < EPSILON:
+    if maxEvaporation - surfaceEvaporation < EPSILON or nrEvapLayers < 2:
         return actualEvaporation
 
-    # soil evaporation
-    lastIndex = 0
-    while (lastIndex < len(soil.depth)) and (soil.depth[lastIndex] <= MAX_EVAPORATION_DEPTH):
-        lastIndex += 1
-
-    nrEvapLayers = lastIndex
-
-    # depth coefficient: 1 at first layer, ~0.1 at MAX_EVAPORATION_DEPTH
-    evapCoefficient = np.zeros(nrEvapLayers, np.float64)
-    sumCoefficient = 0
-    for i in range(1, nrEvapLayers):
-        depthCoefficient = max((soil.depth[i] - soil.depth[1]) / (MAX_EVAPORATION_DEPTH - soil.depth[1]), 0)
-        evapCoefficient[i] = math.exp(-depthCoefficient * math.e)
-        sumCoefficient += (evapCoefficient[i] * soil.thickness[i])
-
-    isWaterSupply = True
-    while (residualEvaporation > EPSILON) and (isWaterSupply is True):
-        isWaterSupply = False
-        sumEvaporation = 0.0
-
-        for layer in range(1, nrEvapLayers):
-            index = surfaceIndex + C3DStructure.nrRectangles * layer
-            horizon = soil.horizons[C3DCells[index].horizonIndex]
-            theta = soil.getVolumetricWaterContent(index)  # [m3 m-3]
-            half_FC = horizon.HYGR + (horizon.FC - horizon.HYGR) * 0.5
-            evaporationThreshold = half_FC - evapCoefficient[layer] * (half_FC - horizon.HYGR)  # [m3 m-3]
-            evaporation = residualEvaporation * ((evapCoefficient[layer]
-                                                  * soil.thickness[layer]) / sumCoefficient)  # [mm]
-            if theta < evaporationThreshold:
-                evaporation = 0.0
-            else:
-                availableWC = (theta - evaporationThreshold) * soil.thickness[layer] * 1000.  # [mm]
-                if availableWC <= evaporation:
-                    evaporation = availableWC
-                else:
-                    isWaterSupply = True
-
-            sumEvaporation += evaporation
-
-            rate = (evaporation * 0.001) / 3600.  # [m s-1]
-            C3DCells[index].sinkSource -= rate * C3DCells[index].area  # [m3 s-1]
-
-        residualEvaporation -= sumEvaporation
-        actualEvaporation += sumEvaporation
+    # soil evaporation: layers 1 .. nrEvapLayers-1
+    layers = slice(1, nrEvapLayers)
+    theta = getWaterContentColumns()[:, layers]  # [m3 m-3]
+    horizonIndex = getSoilColumns(C3DCells.horizonIndex)[:, layers]
+    HYGR = soil.horizonArrays.HYGR[horizonIndex]
+    half_FC = HYGR + (soil.horizonArrays.FC[horizonIndex] - HYGR) * 0.5
+    evaporationThreshold = half_FC - evapCoefficient[layers] * (half_FC - HYGR)  # [m3 m-3]
+    availableWC = (theta - evaporationThreshold) * soil.thickness[layers] * 1000.  # [mm]
+    isDry = theta < evaporationThreshold
+
+    sinkSource = getSoilColumns(C3DCells.sinkSource)[:, layers]
+    area = getSoilColumns(C3DCells.area)[:, layers]
+    isActive = residualEvaporation > EPSILON
+    while np.any(isActive):
+        rectangles = np.flatnonzero(isActive)
+        evaporation = residualEvaporation[rectangles, None] * evapWeight[layers]  # [mm]
+        available = availableWC[rectangles]
+        isLimited = available <= evaporation
+        evaporation = np.where(isLimited, available, evaporation)
+        evaporation[isDry[rectangles]] = 0.0
+        isWaterSupply = np.any(~isLimited & ~isDry[rectangles], axis=1)
+
+        rate = (evaporation * 0.001) / 3600.  # [m s-1]
+        sinkSource[rectangles] -= rate * area[rectangles]  # [m3 s-1]
+
+        sumEvaporation = sumLayers(evaporation)
+        residualEvaporation[rectangles] -= sumEvaporation
+        actualEvaporation[rectangles] += sumEvaporation
+        isActive[rectangles] = (residualEvaporation[rectangles] > EPSILON) & isWaterSupply
 
     return actualEvaporation
 
@@ -347,13 +385,11 @@ def setEvaporation(surfaceIndex, maxEvaporation):
 def setEvapotranspiration(currentDate, ET0):
     if C3DParameters.computeTranspiration:
         currentCrop.setCurrentLAI(currentDate)
-        for i in range(C3DStructure.nrRectangles):
-            maxTranspiration = getMaxTranspiration(currentCrop.currentLAI, currentCrop.kcMax, ET0) * k_root[i]
-            setTranspiration(i, rootDensity[i], maxTranspiration)
+        maxTranspiration = getMaxTranspiration(currentCrop.currentLAI, currentCrop.kcMax, ET0) * k_root
+        setTranspiration(maxTranspiration)
     else:
         currentCrop.currentLAI = 0
 
     if C3DParameters.computeEvaporation:
         maxEvaporation = getMaxEvaporation(currentCrop.currentLAI, ET0)
-        for i in range(C3DStructure.nrRectangles):
-            setEvaporation(i, maxEvaporation)
+        setEvaporation(maxEvaporation)
@@ -1,10 +1,55 @@
 # compile with:
 # python cythonSetup.py build_ext --inplace
+# OpenMP is needed by the multicolor Gauss-Seidel (nrThreads > 1)
+# the MSVC flag is /openmp, gcc, clang and MinGW use -fopenmp
+# if the compiler does not support OpenMP (e.g. Apple clang) the extension is built without it
 
-from setuptools import setup
+import os
+import tempfile
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
+from setuptools.errors import CompileError, LinkError
 from Cython.Build import cythonize
 
+OPENMP_TEST = "#include <omp.h>\nint main(void) { return omp_get_max_threads() > 0 ? 0 : 1; }\n"
+
+
+# OpenMP flags of the compiler that builds the extension (known only at build time)
+class CBuildExt(build_ext):
+    # test program compiled and linked with the flags
+    def isValidFlags(self, compileArgs, linkArgs):
+        with tempfile.TemporaryDirectory() as folder:
+            fileName = os.path.join(folder, "openmpTest.c")
+            with open(fileName, "w") as f:
+                f.write(OPENMP_TEST)
+            try:
+                objects = self.compiler.compile([fileName], output_dir=folder, extra_postargs=compileArgs)
+                self.compiler.link_executable(objects, "openmpTest", output_dir=folder, extra_postargs=linkArgs)
+            except (CompileError, LinkError):
+                return False
+        return True
+
+    def build_extensions(self):
+        if self.compiler.compiler_type == 'msvc':
+            compileArgs = ['/openmp']
+            linkArgs = []
+        else:
+            compileArgs = ['-fopenmp']
+            linkArgs = ['-fopenmp']
+        if not self.isValidFlags(compileArgs, linkArgs):
+            print("WARNING: the compiler does not support OpenMP, the multicolor Gauss-Seidel will be serial")
+            compileArgs = []
+            linkArgs = []
+        for extension in self.extensions:
+            extension.extra_compile_args = compileArgs
+            extension.extra_link_args = linkArgs
+        build_ext.build_extensions(self)
+
+
+extension = Extension("solverC", ["solverC.pyx"])
+
 setup(
     name='Criteria 3D solver',
-    ext_modules=cythonize("solverC.pyx"),
+    ext_modules=cythonize(extension),
+    cmdclass={'build_ext': CBuildExt},
 )
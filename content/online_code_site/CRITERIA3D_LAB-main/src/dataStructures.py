@@ -4,6 +4,7 @@
 # https://github.com/ARPA-SIMC/CRITERIA3D_LAB
 # ---------------------------------------------------------
 
+import numpy as np
 from commonConst import *
 
 
@@ -53,40 +54,202 @@ def initialize3DStructure(width, height, cellSize):
     C3DStructure.gridHeight = C3DStructure.nrRectanglesInYAxis * cellSize
 
 
-class Clink:
+# column of the link arrays: upLink, lateralLink[0..3], downLink
+UP_LINK = 0
+FIRST_LATERAL_LINK = 1
+DOWN_LINK = 5
+
+
+# -----------------------------------------------------------
+# cells stored as struct of arrays: one contiguous array
+# for each cell property, indexed by cell
+# C3DCells[i] returns a Ccell view on the i-th cell
+# -----------------------------------------------------------
+class CCellStore:
     def __init__(self):
-        self.index = NOLINK     # [-] index of linked cell
-        self.area = NODATA      # [m^2] area of interface
-        self.distance = NODATA  # [m]
+        self.allocate(0)
+
+    def allocate(self, nrCells):
+        self.nrCells = nrCells
+        self.x = np.full(nrCells, NODATA, np.float64)               # [m]
+        self.y = np.full(nrCells, NODATA, np.float64)               # [m]
+        self.z = np.full(nrCells, NODATA, np.float64)               # [m]
+        self.volume = np.full(nrCells, NODATA, np.float64)          # [m^3] volume
+        self.area = np.full(nrCells, NODATA, np.float64)            # [m^2] area (for surface cells)
+        self.horizonIndex = np.full(nrCells, int(NODATA), np.int32) # soil horizon index
+        self.isSurface = np.zeros(nrCells, bool)                    # true if the cell is on surface
+        self.Se = np.full(nrCells, NODATA, np.float64)              # [-] degree of saturation
+        self.H = np.full(nrCells, NODATA, np.float64)               # [m] current total water potential
+        self.H0 = np.full(nrCells, NODATA, np.float64)              # [m] total water potential
+        self.k = np.full(nrCells, NODATA, np.float64)               # [m s^-1] hydraulic conductivity
+        self.sinkSource = np.full(nrCells, NODATA, np.float64)      # [m^3 s^-1] water sink/source
+        self.flow = np.full(nrCells, NODATA, np.float64)            # [m^3 s^-1] sink/source + boundary
+
+        # boundary
+        self.boundaryType = np.full(nrCells, BOUNDARY_NONE, np.int32)
+        self.boundaryArea = np.full(nrCells, NODATA, np.float64)    # [m^2] area of interface
+        self.boundarySlope = np.full(nrCells, NODATA, np.float64)   # [-] slope
+        self.boundaryFlow = np.full(nrCells, NODATA, np.float64)    # [m^3 s^-1] boundary water flow
+
+        # links: UP_LINK, lateral links, DOWN_LINK
+        shape = (nrCells, C3DStructure.nrMaxLinks)
+        self.linkIndex = np.full(shape, NOLINK, np.int32)           # [-] index of linked cell
+        self.linkArea = np.full(shape, NODATA, np.float64)          # [m^2] area of interface
+        self.linkDistance = np.full(shape, NODATA, np.float64)      # [m]
+
+    def clear(self):
+        self.allocate(0)
+
+    def __len__(self):
+        return self.nrCells
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.nrCells
+        if i < 0 or i >= self.nrCells:
+            raise IndexError("cell index out of range")
+        return Ccell(self, i)
+
+    def __iter__(self):
+        for i in range(self.nrCells):
+            yield Ccell(self, i)
+
+
+def cellProperty(arrayName):
+    def getValue(self):
+        return getattr(self.store, arrayName)[self.cellIndex]
+
+    def setValue(self, value):
+        getattr(self.store, arrayName)[self.cellIndex] = value
+
+    return property(getValue, setValue)
+
+
+class Clink:
+    __slots__ = ("store", "cellIndex", "column")
+
+    def __init__(self, store, i, column):
+        self.store = store
+        self.cellIndex = i
+        self.column = column
+
+    @property
+    def index(self):
+        return self.store.linkIndex[self.cellIndex, self.column]
+
+    @index.setter
+    def index(self, value):
+        self.store.linkIndex[self.cellIndex, self.column] = value
+
+    @property
+    def area(self):
+        return self.store.linkArea[self.cellIndex, self.column]
+
+    @area.setter
+    def area(self, value):
+        self.store.linkArea[self.cellIndex, self.column] = value
+
+    @property
+    def distance(self):
+        return self.store.linkDistance[self.cellIndex, self.column]
+
+    @distance.setter
+    def distance(self, value):
+        self.store.linkDistance[self.cellIndex, self.column] = value
 
 
 class Cboundary:
-    def __init__(self):
-        self.type = BOUNDARY_NONE
-        self.area = NODATA      # [m^2] area of interface
-        self.slope = NODATA     # [-] slope
-        self.flow = NODATA      # [m^3 s^-1] boundary water flow
+    __slots__ = ("store", "cellIndex")
+
+    def __init__(self, store, i):
+        self.store = store
+        self.cellIndex = i
 
+    type = cellProperty("boundaryType")
+    area = cellProperty("boundaryArea")
+    slope = cellProperty("boundarySlope")
+    flow = cellProperty("boundaryFlow")
 
+
+# compatibility view on a single cell of the store
 class Ccell:
+    __slots__ = ("store", "cellIndex")
+
+    def __init__(self, store, i):
+        self.store = store
+        self.cellIndex = i
+
+    x = cellProperty("x")
+    y = cellProperty("y")
+    z = cellProperty("z")
+    volume = cellProperty("volume")
+    area = cellProperty("area")
+    horizonIndex = cellProperty("horizonIndex")
+    isSurface = cellProperty("isSurface")
+    Se = cellProperty("Se")
+    H = cellProperty("H")
+    H0 = cellProperty("H0")
+    k = cellProperty("k")
+    sinkSource = cellProperty("sinkSource")
+    flow = cellProperty("flow")
+
+    @property
+    def boundary(self):
+        return Cboundary(self.store, self.cellIndex)
+
+    @property
+    def upLink(self):
+        return Clink(self.store, self.cellIndex, UP_LINK)
+
+    @property
+    def downLink(self):
+        return Clink(self.store, self.cellIndex, DOWN_LINK)
+
+    @property
+    def lateralLink(self):
+        return [Clink(self.store, self.cellIndex, FIRST_LATERAL_LINK + j) for j in range(C3DStructure.nrLateralLinks)]
+
+
+# -----------------------------------------------------------
+# links stored as edge arrays: one edge for each cell i and
+# link column with a linked cell j, in the order of the rows
+# of the linear system (cell, then link column)
+# kind:  LINK_SUBSURFACE, LINK_LATERAL (sub-surface),
+#        LINK_SURFACE_SUBSURFACE, LINK_SURFACE_SURFACE
+# -----------------------------------------------------------
+class CLinkStore:
     def __init__(self):
-        self.x = NODATA             # [m]
-        self.y = NODATA             # [m]
-        self.z = NODATA             # [m]
-        self.volume = NODATA        # [m^3] volume
-        self.area = NODATA          # [m^3] area (for surface cells)
-        self.horizonIndex = NODATA  # soil horizon index
-        self.isSurface = False      # true if the cell is on surface
-        self.Se = NODATA            # [-] degree of saturation
-        self.H = NODATA             # [m] current total water potential
-        self.H0 = NODATA            # [m] total water potential
-        self.k = NODATA             # [m s^-1] hydraulic conductivity
-        self.sinkSource = NODATA    # [m^3 s^-1] water sink/source
-        self.flow = NODATA          # [m^3 s^-1] sink/source + boundary
-        self.boundary = Cboundary()
-        self.upLink = Clink()
-        self.downLink = Clink()
-        self.lateralLink = [Clink(), Clink(), Clink(), Clink()]
+        self.clear()
+
+    def clear(self):
+        self.setLinks(CCellStore())
+
+    def setLinks(self, cells):
+        i, column = np.nonzero(cells.linkIndex != NOLINK)
+        j = cells.linkIndex[i, column]
+        self.nrLinks = len(i)
+        self.i = i.astype(np.int32)
+        self.j = j.astype(np.int32)
+        self.column = column.astype(np.int32)
+        self.area = cells.linkArea[i, column]                       # [m^2] or side length [m] on surface
+        self.distance = cells.linkDistance[i, column]               # [m]
+
+        isLateral = (column >= FIRST_LATERAL_LINK) & (column < FIRST_LATERAL_LINK + C3DStructure.nrLateralLinks)
+        isSurface_i = cells.isSurface[i]
+        isSurface_j = cells.isSurface[j]
+        self.kind = np.full(self.nrLinks, LINK_SUBSURFACE, np.int32)
+        self.kind[isLateral] = LINK_LATERAL
+        self.kind[isSurface_i != isSurface_j] = LINK_SURFACE_SUBSURFACE
+        self.kind[isSurface_i & isSurface_j] = LINK_SURFACE_SURFACE
+
+        # surface and sub-surface cell of each link (used by infiltration)
+        self.surfaceCell = np.where(isSurface_i, i, j).astype(np.int32)
+        self.subSurfaceCell = np.where(isSurface_i, j, i).astype(np.int32)
+
+        # edges of each process
+        self.redistributionLinks = np.flatnonzero((self.kind == LINK_SUBSURFACE) | (self.kind == LINK_LATERAL))
+        self.infiltrationLinks = np.flatnonzero(self.kind == LINK_SURFACE_SUBSURFACE)
+        self.runoffLinks = np.flatnonzero(self.kind == LINK_SURFACE_SURFACE)
 
 
 # model parameters
@@ -95,6 +258,8 @@ class C3DParameters:
     waterRetentionCurve = IPPISCH_VG
     conductivityMean = LOGARITHMIC
     conductivityHVRatio = 1.0
+    isLookupTable = False               # tabulated Se, K, dTheta/dPsi (see soil.CHydraulicTables)
+    lookupTableError = 1E-4             # [-] max relative error of the tables
 
     # soil layers thickness
     minThickness = 0.01                 # [m]
@@ -132,15 +297,30 @@ class C3DParameters:
     maxApproximationsNr = 10
     residualTolerance = 1E-12
     MBRThreshold = 1E-5
+    linearSolver = GAUSS_SEIDEL
+    preconditioner = JACOBI
+    nrThreads = 1                       # > 1: multicolor Gauss-Seidel (Cython)
+    nonlinearSolver = PICARD
+    timeStepController = HEURISTIC
+    surfaceFlowSolver = COUPLED_SURFACE_FLOW
+
+    # output
+    outputFormat = CSV_FORMAT
+    outputBufferSize = 100000           # [-] buffered values
+    outputFlushInterval = 60.0          # [s] max time between two writes
+    isSaveFields = False                # save all cells at each output step (see fieldStore)
+    checkpointInterval = 0              # [hours] save the model state (see checkpoint), 0 = no checkpoint
 
     # simulation type
     isFirstAssimilation = True
     isPeriodicAssimilation = False
     isVisual = True
     assimilationInterval = 24
+    meteoChunkSize = 0                  # [rows] read meteo.csv in chunks during the simulation, 0 = whole file
 
 
 # global
-C3DCells = []
+C3DCells = CCellStore()
+C3DLinks = CLinkStore()
 dripperIndices = []
 plantIndices = []
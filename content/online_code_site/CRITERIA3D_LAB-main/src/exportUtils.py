@@ -1,49 +1,100 @@
 import os
+import numpy as np
 from dataStructures import *
 import rectangularMesh
 import pandas as pd
 import soil
+import outputWriter
+import fieldStore
 
 outputIndices = []
 outputSurfaceIndices = []
 outputFileWP = ""
 outputFileWC = ""
 outputFileBalance = ""
+outputFileFields = ""
+outputColumns = []
 heightSlice = C3DStructure.gridHeight * 0.5
 oneTimestampPerRow = True
-
-
-def createExportFile(outputPath):
-    global outputFileWP, outputFileWC, outputFileBalance
-    outputFileWP = os.path.join(outputPath, "waterPotential.csv")
-    outputFileWC = os.path.join(outputPath, "waterContent.csv")
+writerWP = None
+writerWC = None
+fieldStoreWriter = None
+
+
+# outputPointsFileName     default: output_points.csv in outputPath
+# output file names are without extension (see outputWriter)
+# the files are opened at the first output step (see openExportFiles)
+def createExportFile(outputPath, outputPointsFileName=""):
+    global outputFileWP, outputFileWC, outputFileBalance, outputFileFields, outputColumns
+    closeExportFiles()
+    if outputPointsFileName == "":
+        outputPointsFileName = os.path.join(outputPath, "output_points.csv")
+    outputFileWP = os.path.join(outputPath, "waterPotential")
+    outputFileWC = os.path.join(outputPath, "waterContent")
     outputFileBalance = os.path.join(outputPath, "waterBalance.csv")
+    outputFileFields = os.path.join(outputPath, "fields")
 
     if oneTimestampPerRow:
-        outputPoints = pd.read_csv(os.path.join(outputPath, "output_points.csv"))
-        outputIndicesString = takeSelected(outputPoints)
-        header = "timestamp," + outputIndicesString + "\n"
+        outputPoints = pd.read_csv(outputPointsFileName)
+        outputColumns = ["timestamp"] + takeSelected(outputPoints)
     else:
         if heightSlice == 0:
             takeAll()
         else:
             takeSlice()
-        header = "timestamp,x,y,z,Se,H\n"
+        outputColumns = ["timestamp", "x", "y", "z", "Se", "H"]
+
+
+# -----------------------------------------------------------
+# open the export files (and the field store)
+# resumeTimestamp: restart of a simulation, the rows of the existing
+# files before resumeTimestamp are kept (NODATA: new files)
+# -----------------------------------------------------------
+def openExportFiles(resumeTimestamp=NODATA):
+    global writerWP, writerWC, fieldStoreWriter
+    closeExportFiles()
+    outputFormat = C3DParameters.outputFormat
+    bufferSize = C3DParameters.outputBufferSize
+    flushInterval = C3DParameters.outputFlushInterval
+    formats = ["%d"] + ["%.3f"] * (len(outputColumns) - 1)
+    writerWP = outputWriter.getOutputWriter(outputFormat, outputFileWP, outputColumns, formats,
+                                            bufferSize, flushInterval, resumeTimestamp)
+    if oneTimestampPerRow:
+        formats = ["%d"] + ["%.4f"] * (len(outputColumns) - 1)
+        writerWC = outputWriter.getOutputWriter(outputFormat, outputFileWC, outputColumns, formats,
+                                                bufferSize, flushInterval, resumeTimestamp)
 
-    if not os.path.exists(outputFileWP):
-        open(outputFileWP, 'w').close()
+    # whole state of the model
+    if C3DParameters.isSaveFields:
+        fieldStoreWriter = fieldStore.createFieldStore(outputFileFields, resumeTimestamp)
 
-    with open(outputFileWP, "w") as f:
-        f.write(header)
 
-    if oneTimestampPerRow:
-        if not os.path.exists(outputFileWC):
-            open(outputFileWC, 'w').close()
+def flushExportFiles():
+    for writer in [writerWP, writerWC, fieldStoreWriter]:
+        if writer is not None:
+            writer.flush()
+
+
+# the export files are readable also after a crash (see checkpoint)
+def syncExportFiles():
+    for writer in [writerWP, writerWC]:
+        if writer is not None:
+            writer.sync()
+    if fieldStoreWriter is not None:
+        fieldStoreWriter.flush()
+
 
-        with open(outputFileWC, "w") as f:
-            f.write(header)
+def closeExportFiles():
+    global writerWP, writerWC, fieldStoreWriter
+    for writer in [writerWP, writerWC, fieldStoreWriter]:
+        if writer is not None:
+            writer.close()
+    writerWP = None
+    writerWC = None
+    fieldStoreWriter = None
 
 
+# return the column names of the selected points
 def takeSelected(outputPoints):
     outputIndicesStrings = []
     outputSurfaceIndices.clear()
@@ -59,7 +110,7 @@ def takeSelected(outputPoints):
                 outputSurfaceIndices.append(surfaceIndex)
                 outputIndices.append(index)
                 outputIndicesStrings.append(f'z{depth}_y{y}_x{x}')
-    return ",".join(outputIndicesStrings)
+    return outputIndicesStrings
 
 
 def takeSlice():
@@ -80,32 +131,25 @@ def takeAll():
 
 
 def takeScreenshot(timestamp):
+    if writerWP is None:
+        openExportFiles()
+    if fieldStoreWriter is not None:
+        fieldStoreWriter.append(timestamp)
+
+    indices = np.array(outputIndices, np.int64)
+    # water potential [kPa] equivalent to [centibar]
+    psi = (C3DCells.H[indices] - C3DCells.z[indices]) * 9.81
     if oneTimestampPerRow:
-        rowPotential = str(int(timestamp))
-        rowWaterContent = str(int(timestamp))
-        for index in outputIndices:
-            psi = (C3DCells[index].H - C3DCells[index].z) * 9.81    # water potential [kPa] equivalent to [centibar]
-            theta = soil.getVolumetricWaterContent(index)           # volumetric water content [m3 m-3]
-            rowPotential += "," + '{:.3f}'.format(psi)
-            rowWaterContent += "," + '{:.4f}'.format(theta)
-        rowPotential += "\n"
-        rowWaterContent += "\n"
-
-        with open(outputFileWP, "a") as f:
-            f.write(rowPotential)
-        with open(outputFileWC, "a") as f:
-            f.write(rowWaterContent)
+        # volumetric water content [m3 m-3]
+        theta = np.full(len(indices), NODATA)
+        isSubSurface = ~C3DCells.isSurface[indices]
+        theta[isSubSurface] = soil.getVolumetricWaterContentArray(indices[isSubSurface])
+        writerWP.write(np.concatenate([[int(timestamp)], psi]))
+        writerWC.write(np.concatenate([[int(timestamp)], theta]))
     else:
-        for index in outputIndices:
-            if C3DCells[index].z != 0.0 and C3DCells[index].x >= 1.0:
-                row = str(int(timestamp))
-                row += "," + '{:.3f}'.format(C3DCells[index].x)
-                row += "," + '{:.3f}'.format(C3DCells[index].y)
-                row += "," + '{:.3f}'.format(C3DCells[index].z)
-                row += "," + '{:.3f}'.format(C3DCells[index].Se)
-                psi = (C3DCells[index].H - C3DCells[index].z) * 9.81  # water potential [kPa] equivalent to [centibar]
-                row += "," + '{:.3f}'.format(psi)
-                row += "\n"
-
-                with open(outputFileWP, "a") as f:
-                    f.write(row)
+        isSelected = (C3DCells.z[indices] != 0.0) & (C3DCells.x[indices] >= 1.0)
+        selected = indices[isSelected]
+        rows = np.column_stack([np.full(len(selected), int(timestamp)), C3DCells.x[selected],
+                                C3DCells.y[selected], C3DCells.z[selected], C3DCells.Se[selected],
+                                psi[isSelected]])
+        writerWP.write(rows)
@@ -0,0 +1,297 @@
+# fieldStore.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# append-only store of the whole model state for each output step:
+# fields H, Se, theta, flow, sinkSource of all cells, the mesh geometry
+# and the water balance series
+# the fields have shape (nrSteps, nrLayers, nrRectangles): a layer
+# (layer 0 = surface) can be read for all steps without loading the fields
+# formats:
+#   HDF5 (h5py installed)   fileName.h5, chunks of FIELD_CHUNK_STEPS steps of one layer, gzip
+#   otherwise               folder fileName/ with a raw binary file for each field (memmap)
+# resumeTimestamp (restart): the steps of the existing store before resumeTimestamp
+# are kept and the new steps are appended, NODATA: new store
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from dataStructures import *
+import soil
+import waterBalance
+
+FIELDS = ["H", "Se", "theta", "flow", "sinkSource"]
+GEOMETRY = ["x", "y", "z", "area", "volume", "isSurface", "horizonIndex"]
+BALANCE = ["waterStorage", "waterFlow", "MBE", "precipitation", "irrigation"]
+FIELD_TYPE = np.float32
+FIELD_CHUNK_STEPS = 24
+
+
+def isHDF5Available():
+    try:
+        import h5py
+        return True
+    except ImportError:
+        return False
+
+
+# -----------------------------------------------------------
+# writers: append(timestamp) saves the current state of the model
+# -----------------------------------------------------------
+class CFieldStoreWriter:
+    def __init__(self, fileName, resumeTimestamp=NODATA):
+        self.fileName = fileName
+        self.resumeTimestamp = resumeTimestamp
+        self.nrLayers = C3DStructure.nrLayers
+        self.nrRectangles = C3DStructure.nrRectangles
+        self.nrSteps = 0
+        self.isOpen = True
+
+    def getStructure(self):
+        return {"nrLayers": int(C3DStructure.nrLayers), "nrRectangles": int(C3DStructure.nrRectangles),
+                "nrRectanglesInXAxis": int(C3DStructure.nrRectanglesInXAxis),
+                "nrRectanglesInYAxis": int(C3DStructure.nrRectanglesInYAxis),
+                "cellSize": float(C3DStructure.cellSize), "nrCells": int(C3DStructure.nrCells)}
+
+    # the existing store has the same mesh
+    def isSameStructure(self, structure):
+        return all(structure.get(name) == value for name, value in self.getStructure().items())
+
+    def getFields(self):
+        theta = np.full(C3DStructure.nrCells, NODATA)
+        subSurfaceCells = np.flatnonzero(~C3DCells.isSurface)
+        theta[subSurfaceCells] = soil.getVolumetricWaterContentArray(subSurfaceCells)
+        values = {"H": C3DCells.H, "Se": C3DCells.Se, "theta": theta,
+                  "flow": C3DCells.flow, "sinkSource": C3DCells.sinkSource}
+        return {name: np.asarray(values[name], FIELD_TYPE).reshape(self.nrLayers, self.nrRectangles)
+                for name in FIELDS}
+
+    def getBalance(self):
+        return np.array([waterBalance.currentStep.waterStorage, waterBalance.allSimulation.waterFlow,
+                         waterBalance.allSimulation.MBE, waterBalance.currentPrec, waterBalance.currentIrr],
+                        np.float64)
+
+    def close(self):
+        if self.isOpen:
+            self.closeFile()
+            self.isOpen = False
+
+    # the open file is not copied (e.g. in the saved state of a simulation)
+    def __deepcopy__(self, memo):
+        return self
+
+
+class CHDF5Writer(CFieldStoreWriter):
+    def __init__(self, fileName, resumeTimestamp=NODATA):
+        import h5py
+        super().__init__(fileName, resumeTimestamp)
+        self.buffer = []
+        if resumeTimestamp != NODATA and os.path.exists(fileName + ".h5"):
+            # damaged file (e.g. a crash of the previous run)
+            try:
+                self.file = h5py.File(fileName + ".h5", "a")
+            except OSError as e:
+                print("WARNING: the field store cannot be read, it is not resumed: " + fileName + " (" + str(e) + ")")
+            else:
+                if self.isSameStructure({name: value.item() for name, value in self.file.attrs.items()}):
+                    self.resume()
+                    return
+                print("WARNING: the mesh of the field store is different, it is not resumed: " + fileName)
+                self.file.close()
+        self.file = h5py.File(fileName + ".h5", "w")
+        for name, value in self.getStructure().items():
+            self.file.attrs[name] = value
+        geometry = self.file.create_group("geometry")
+        for name in GEOMETRY:
+            geometry.create_dataset(name, data=getattr(C3DCells, name))
+        self.file.create_dataset("timestamp", shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(1024,))
+        self.file.create_dataset("balance", shape=(0, len(BALANCE)), maxshape=(None, len(BALANCE)),
+                                 dtype=np.float64, chunks=(1024, len(BALANCE)))
+        self.file["balance"].attrs["columns"] = ",".join(BALANCE)
+        fields = self.file.create_group("fields")
+        for name in FIELDS:
+            fields.create_dataset(name, shape=(0, self.nrLayers, self.nrRectangles),
+                                  maxshape=(None, self.nrLayers, self.nrRectangles), dtype=FIELD_TYPE,
+                                  chunks=(FIELD_CHUNK_STEPS, 1, self.nrRectangles),
+                                  compression="gzip", compression_opts=4, shuffle=True)
+
+    # the steps before resumeTimestamp are kept
+    def resume(self):
+        self.nrSteps = int(np.searchsorted(self.file["timestamp"][:], self.resumeTimestamp))
+        for dataset in [self.file["timestamp"], self.file["balance"]] + [self.file["fields"][name] for name in FIELDS]:
+            dataset.resize(self.nrSteps, axis=0)
+
+    # the steps are written in blocks of FIELD_CHUNK_STEPS (whole chunks)
+    def append(self, timestamp):
+        self.buffer.append((int(timestamp), self.getFields(), self.getBalance()))
+        self.nrSteps += 1
+        if len(self.buffer) >= FIELD_CHUNK_STEPS:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            first = self.nrSteps - len(self.buffer)
+            for name in FIELDS:
+                dataset = self.file["fields"][name]
+                dataset.resize(self.nrSteps, axis=0)
+                dataset[first:] = np.stack([fields[name] for _, fields, _ in self.buffer])
+            self.file["balance"].resize(self.nrSteps, axis=0)
+            self.file["balance"][first:] = np.stack([balance for _, _, balance in self.buffer])
+            # the timestamps are the last ones: a step is complete when its timestamp is saved
+            self.file["timestamp"].resize(self.nrSteps, axis=0)
+            self.file["timestamp"][first:] = [timestamp for timestamp, _, _ in self.buffer]
+            self.buffer = []
+        self.file.flush()
+
+    def closeFile(self):
+        self.flush()
+        self.file.close()
+
+
+class CBinaryWriter(CFieldStoreWriter):
+    def __init__(self, fileName, resumeTimestamp=NODATA):
+        super().__init__(fileName, resumeTimestamp)
+        self.folder = fileName
+        if resumeTimestamp != NODATA and os.path.exists(os.path.join(self.folder, "timestamp.bin")):
+            with open(os.path.join(self.folder, "header.json")) as f:
+                isSameStructure = self.isSameStructure(json.load(f))
+            if isSameStructure:
+                self.resume()
+                return
+            print("WARNING: the mesh of the field store is different, it is not resumed: " + fileName)
+        os.makedirs(self.folder, exist_ok=True)
+        header = self.getStructure()
+        header.update({"fields": FIELDS, "fieldType": np.dtype(FIELD_TYPE).str, "balance": BALANCE})
+        with open(os.path.join(self.folder, "header.json"), "w") as f:
+            json.dump(header, f, indent=1)
+        np.savez(os.path.join(self.folder, "geometry.npz"),
+                 **{name: getattr(C3DCells, name) for name in GEOMETRY})
+        self.files = {name: open(os.path.join(self.folder, name + ".bin"), "wb")
+                      for name in FIELDS + ["balance", "timestamp"]}
+
+    # the files are cut after the last complete step before resumeTimestamp
+    def resume(self):
+        stepSize = self.nrLayers * self.nrRectangles * np.dtype(FIELD_TYPE).itemsize
+        timestamps = np.fromfile(os.path.join(self.folder, "timestamp.bin"), np.int64)
+        balanceSize = len(BALANCE) * np.dtype(np.float64).itemsize
+        nrSteps = min([len(timestamps), os.path.getsize(os.path.join(self.folder, "balance.bin")) // balanceSize]
+                      + [os.path.getsize(os.path.join(self.folder, name + ".bin")) // stepSize for name in FIELDS])
+        self.nrSteps = int(np.searchsorted(timestamps[:nrSteps], self.resumeTimestamp))
+        sizes = {name: self.nrSteps * stepSize for name in FIELDS}
+        sizes["balance"] = self.nrSteps * balanceSize
+        sizes["timestamp"] = self.nrSteps * np.dtype(np.int64).itemsize
+        self.files = {}
+        for name, size in sizes.items():
+            self.files[name] = open(os.path.join(self.folder, name + ".bin"), "r+b")
+            self.files[name].truncate(size)
+            self.files[name].seek(size)
+
+    def append(self, timestamp):
+        for name, values in self.getFields().items():
+            self.files[name].write(values.tobytes())
+        self.files["balance"].write(self.getBalance().tobytes())
+        self.files["timestamp"].write(np.array([timestamp], np.int64).tobytes())
+        self.nrSteps += 1
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def closeFile(self):
+        for f in self.files.values():
+            f.close()
+
+
+# fileName without extension: fileName.h5 or folder fileName/
+def createFieldStore(fileName, resumeTimestamp=NODATA):
+    if isHDF5Available():
+        return CHDF5Writer(fileName, resumeTimestamp)
+    return CBinaryWriter(fileName, resumeTimestamp)
+
+
+# HDF5 or binary store: the last written if both exist
+def isHDF5Store(fileName):
+    isHDF5 = os.path.exists(fileName + ".h5")
+    timestampFileName = os.path.join(fileName, "timestamp.bin")
+    if isHDF5 and os.path.exists(timestampFileName):
+        isHDF5 = os.path.getmtime(fileName + ".h5") >= os.path.getmtime(timestampFileName)
+        print("WARNING: field stores of both formats: " + fileName + ", the last written is read: "
+              + (fileName + ".h5" if isHDF5 else fileName))
+    return isHDF5
+
+
+# -----------------------------------------------------------
+# reader (both formats)
+# getField(name, step)         field of all cells at a step (nrCells)
+# getLayer(name, layer, steps)  one layer (nrSteps x nrRectangles),
+#                               a memmap for the binary format
+# getBalance()                 water balance series (DataFrame)
+# -----------------------------------------------------------
+class CFieldStoreReader:
+    def __init__(self, fileName):
+        self.h5file = None
+        if isHDF5Store(fileName):
+            import h5py
+            self.h5file = h5py.File(fileName + ".h5", "r")
+            self.structure = {name: value.item() for name, value in self.h5file.attrs.items()}
+            self.geometry = {name: self.h5file["geometry"][name][:] for name in GEOMETRY}
+            self.timestamps = self.h5file["timestamp"][:]
+            self.fields = {name: self.h5file["fields"][name] for name in FIELDS}
+            self.balance = self.h5file["balance"]
+        else:
+            folder = fileName
+            with open(os.path.join(folder, "header.json")) as f:
+                self.structure = json.load(f)
+            with np.load(os.path.join(folder, "geometry.npz")) as geometry:
+                self.geometry = {name: geometry[name] for name in GEOMETRY}
+            self.timestamps = np.fromfile(os.path.join(folder, "timestamp.bin"), np.int64)
+            shape = (self.structure["nrLayers"], self.structure["nrRectangles"])
+            fieldType = np.dtype(self.structure["fieldType"])
+            stepSize = shape[0] * shape[1] * fieldType.itemsize
+            # complete steps only
+            nrSteps = min([len(self.timestamps)] + [os.path.getsize(os.path.join(folder, name + ".bin")) // stepSize
+                                                   for name in FIELDS])
+            self.timestamps = self.timestamps[:nrSteps]
+            self.fields = {}
+            for name in FIELDS:
+                if nrSteps == 0:
+                    self.fields[name] = np.zeros((0,) + shape, fieldType)
+                else:
+                    self.fields[name] = np.memmap(os.path.join(folder, name + ".bin"), fieldType, "r",
+                                                  shape=(nrSteps,) + shape)
+            self.balance = np.fromfile(os.path.join(folder, "balance.bin"),
+                                       np.float64).reshape(-1, len(BALANCE))[:nrSteps]
+        self.nrSteps = len(self.timestamps)
+
+    def getStepIndex(self, timestamp):
+        index = int(np.searchsorted(self.timestamps, timestamp))
+        if index >= self.nrSteps or self.timestamps[index] != timestamp:
+            return NODATA
+        return index
+
+    def getField(self, name, step):
+        return np.asarray(self.fields[name][step]).ravel()
+
+    def getLayer(self, name, layer, steps=None):
+        if steps is None:
+            steps = slice(0, self.nrSteps)
+        return self.fields[name][steps, layer, :]
+
+    def getBalance(self):
+        table = pd.DataFrame(np.asarray(self.balance[:self.nrSteps]), columns=BALANCE)
+        table.insert(0, "timestamp", self.timestamps)
+        return table
+
+    def close(self):
+        if self.h5file is not None:
+            self.h5file.close()
+            self.h5file = None
+        self.fields = {}
+
+
+def openFieldStore(fileName):
+    return CFieldStoreReader(fileName)
+
@@ -7,11 +7,9 @@
 
 import pandas as pd
 import os
-import tkinter.filedialog
 from configparser import ConfigParser
 from ast import literal_eval
 from array import array
-import math
 
 from dataStructures import *
 import criteria3D
@@ -19,6 +17,7 @@ import assimilation
 import waterBalance
 import rectangularMesh
 import crop
+import checkpoint
 
 
 def configToDict(settingsFilename):
@@ -77,6 +76,20 @@ def readModelParameters(settingsFilename):
         print("Valid values: ]0,10]")
         return False
 
+    try:
+        C3DParameters.isLookupTable = configDict['model']['isLookupTable']
+    except:
+        C3DParameters.isLookupTable = False
+
+    try:
+        C3DParameters.lookupTableError = configDict['model']['lookupTableError']
+    except:
+        C3DParameters.lookupTableError = 1E-4
+    if C3DParameters.lookupTableError <= 0 or C3DParameters.lookupTableError >= 0.1:
+        print("ERROR!\nWrong model.lookupTableError in the model settings: " + settingsFilename)
+        print("Valid values: ]0,0.1[")
+        return False
+
     # [processes]
     try:
         C3DParameters.computeInfiltration = configDict['processes']['computeInfiltration']
@@ -232,6 +245,60 @@ def readModelParameters(settingsFilename):
         print("The default will be set: maxDeltaT = 3600 [s]")
         C3DParameters.deltaT_max = 6
 
+    try:
+        C3DParameters.linearSolver = configDict['numerical_solution']['linearSolver']
+    except:
+        C3DParameters.linearSolver = GAUSS_SEIDEL
+    if C3DParameters.linearSolver < 1 or C3DParameters.linearSolver > 4:
+        print("ERROR!\nWrong numerical_solution.linearSolver in the model settings: " + settingsFilename)
+        print("Valid values: 1 GAUSS_SEIDEL 2 SUPERLU 3 CG 4 BICGSTAB")
+        return False
+
+    try:
+        C3DParameters.preconditioner = configDict['numerical_solution']['preconditioner']
+    except:
+        C3DParameters.preconditioner = JACOBI
+    if C3DParameters.preconditioner < 1 or C3DParameters.preconditioner > 2:
+        print("ERROR!\nWrong numerical_solution.preconditioner in the model settings: " + settingsFilename)
+        print("Valid values: 1 JACOBI 2 ILU")
+        return False
+
+    try:
+        C3DParameters.nrThreads = configDict['numerical_solution']['nrThreads']
+    except:
+        C3DParameters.nrThreads = 1
+    if C3DParameters.nrThreads < 1:
+        print("ERROR!\nWrong numerical_solution.nrThreads in the model settings: " + settingsFilename)
+        return False
+
+    try:
+        C3DParameters.nonlinearSolver = configDict['numerical_solution']['nonlinearSolver']
+    except:
+        C3DParameters.nonlinearSolver = PICARD
+    if C3DParameters.nonlinearSolver != PICARD and C3DParameters.nonlinearSolver != NEWTON:
+        print("ERROR!\nWrong numerical_solution.nonlinearSolver in the model settings: " + settingsFilename)
+        print("Valid values: 1 PICARD 2 NEWTON")
+        return False
+
+    try:
+        C3DParameters.timeStepController = configDict['numerical_solution']['timeStepController']
+    except:
+        C3DParameters.timeStepController = HEURISTIC
+    if C3DParameters.timeStepController != HEURISTIC and C3DParameters.timeStepController != PI_CONTROLLER:
+        print("ERROR!\nWrong numerical_solution.timeStepController in the model settings: " + settingsFilename)
+        print("Valid values: 1 HEURISTIC 2 PI_CONTROLLER")
+        return False
+
+    try:
+        C3DParameters.surfaceFlowSolver = configDict['numerical_solution']['surfaceFlowSolver']
+    except:
+        C3DParameters.surfaceFlowSolver = COUPLED_SURFACE_FLOW
+    if C3DParameters.surfaceFlowSolver != COUPLED_SURFACE_FLOW \
+            and C3DParameters.surfaceFlowSolver != SPLIT_SURFACE_FLOW:
+        print("ERROR!\nWrong numerical_solution.surfaceFlowSolver in the model settings: " + settingsFilename)
+        print("Valid values: 1 COUPLED 2 SPLIT")
+        return False
+
     # [layers_thickness]
     try:
         C3DParameters.minThickness = configDict['layers_thickness']['minThickness']
@@ -288,6 +355,47 @@ def readModelParameters(settingsFilename):
     except:
         C3DParameters.isVisual = True
 
+    try:
+        C3DParameters.meteoChunkSize = configDict['simulation_type']['meteoChunkSize']
+    except:
+        C3DParameters.meteoChunkSize = 0
+    if C3DParameters.meteoChunkSize < 0:
+        print("ERROR!\nWrong simulation_type.meteoChunkSize in the model settings: " + settingsFilename)
+        return False
+
+    # [output]
+    try:
+        C3DParameters.outputFormat = configDict['output']['outputFormat']
+    except:
+        C3DParameters.outputFormat = CSV_FORMAT
+    if C3DParameters.outputFormat < CSV_FORMAT or C3DParameters.outputFormat > PARQUET_FORMAT:
+        print("ERROR!\nWrong output.outputFormat in the model settings: " + settingsFilename)
+        print("Valid values: 1 CSV 2 NPY 3 PARQUET")
+        return False
+
+    try:
+        C3DParameters.outputBufferSize = configDict['output']['outputBufferSize']
+    except:
+        C3DParameters.outputBufferSize = 100000
+
+    try:
+        C3DParameters.outputFlushInterval = configDict['output']['outputFlushInterval']
+    except:
+        C3DParameters.outputFlushInterval = 60.0
+
+    try:
+        C3DParameters.isSaveFields = configDict['output']['isSaveFields']
+    except:
+        C3DParameters.isSaveFields = False
+
+    try:
+        C3DParameters.checkpointInterval = configDict['output']['checkpointInterval']
+    except:
+        C3DParameters.checkpointInterval = 0
+    if C3DParameters.checkpointInterval < 0:
+        print("ERROR!\nWrong output.checkpointInterval in the model settings: " + settingsFilename)
+        return False
+
     return True
 
 
@@ -505,9 +613,12 @@ def readCropParameters(cropSettingsFilename):
     return True
 
 
+# file dialog (tkinter is imported only in visual mode)
 def getStateFileName(isSave):
+    import tkinter.filedialog
     root = tkinter.Tk()
-    options = {'defaultextension': ".csv", 'filetypes': [("Comma separated values", ".csv")], 'initialdir': "data"}
+    options = {'defaultextension': ".c3d", 'filetypes': [("Model state", ".c3d"), ("All files", "*")],
+               'initialdir': "data"}
     if isSave:
         fileName = tkinter.filedialog.asksaveasfilename(**options)
     else:
@@ -535,48 +646,41 @@ def readMeteoData(meteoPath):
     return unified.reset_index()
 
 
-def extractObsWaterPotential(obsData, timeStamp, fileName):
-    header = "x,y,z,value\n"
-    f = open(fileName, "w")
-    f.write(header)
-
+# observed water potential at timeStamp: DataFrame with x, y, z [m] and value [kPa]
+# (columns of obsData: z[cm]_y[cm]_x[cm]), missing data = NODATA
+# return None if the timestamp is missing
+def extractObsWaterPotential(obsData, timeStamp):
     df = obsData[obsData["timestamp"] == timeStamp]
     if df.empty:
         print("Error! Timestamp " + str(timeStamp) + " is missing in observed water potential data.")
-        return False
+        return None
 
-    for column in [column for column in list(df.columns) if column != "timestamp"]:
-        splitted_column = column.split("_")
-        value = df[column].values[0]
-        if math.isnan(value) or (value <= -2500):
-            value = NODATA
-        f.write(
-            "{:.2f}".format(float(splitted_column[2][1:]) / 100) + ","      # x
-            + "{:.1f}".format(float(splitted_column[1][1:]) / 100) + ","    # y
-            + "{:.1f}".format(float(splitted_column[0][1:]) / 100) + ","    # z
-            + "{:.1f}".format(value) + "\n"  # psi
-        )
-    return True
+    columns = [column for column in list(df.columns) if column != "timestamp"]
+    position = [[float(coordinate[1:]) / 100 for coordinate in column.split("_")] for column in columns]
+    values = df[columns].values[0].astype(np.float64)
+    values[np.isnan(values) | (values <= -2500)] = NODATA
+    return pd.DataFrame({"x": [round(p[2], 2) for p in position],
+                         "y": [round(p[1], 1) for p in position],
+                         "z": [round(p[0], 1) for p in position],
+                         "value": [round(value, 1) for value in values.tolist()]})
 
 
-def assimilateObsWaterPotential(fileName):
-    obsState = pd.read_csv(fileName)
+def assimilateObsWaterPotential(obsState):
     assimilation.assimilate(obsState)
     waterBalance.updateStorage()
     return True
 
 
+# the whole model state (see checkpoint.py)
 def saveCurrentModelState(stateFileName):
-    float_array = array('d')
-    for i in range(len(C3DCells)):
-        float_array.append(C3DCells[i].H)
-
-    f = open(stateFileName, "wb")
-    float_array.tofile(f)
-    f.close()
+    checkpoint.saveCheckpoint(stateFileName)
 
 
+# checkpoint or raw file of the H values (previous versions)
 def loadModelState(stateFileName):
+    if checkpoint.isCheckpoint(stateFileName):
+        return checkpoint.loadCheckpoint(stateFileName) is not None
+
     f = open(stateFileName, "rb")
     float_array = array('d')
     float_array.fromfile(f, len(C3DCells))
@@ -588,3 +692,4 @@ def loadModelState(stateFileName):
         criteria3D.setMatricPotential(i, signPsi)
 
     waterBalance.updateStorage()
+    return True
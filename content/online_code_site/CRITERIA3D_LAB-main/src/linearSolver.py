@@ -0,0 +1,120 @@
+# linearSolver.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# sparse linear solvers for the system assembled by computeStep
+# the system is stored as in Gauss-Seidel (padded matrix):
+#   x[i] + sum_k A[i][k] * x[indices[i][k]] = b[i]
+# where A and b are already divided by the diagonal D
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.linalg import splu, spilu, cg, bicgstab, LinearOperator
+from dataStructures import *
+
+# relative tolerance of the Krylov solvers
+KRYLOV_RTOL = 1E-10
+
+
+# -----------------------------------------------------------
+# build the CSR matrix (I + A) of the conditioned system
+# only the links before the first NOLINK of each row are used
+# -----------------------------------------------------------
+def buildMatrixCSR(A, indices, nrCells):
+    isLink = np.cumprod(indices[:nrCells] != NOLINK, axis=1).astype(bool)
+    nrLinks = isLink.sum(axis=1)
+
+    rows = np.concatenate((np.arange(nrCells), np.repeat(np.arange(nrCells), nrLinks)))
+    columns = np.concatenate((np.arange(nrCells), indices[:nrCells][isLink]))
+    values = np.concatenate((np.ones(nrCells), A[:nrCells][isLink]))
+    return sparse.csr_matrix((values, (rows, columns)), shape=(nrCells, nrCells))
+
+
+def getPreconditioner(matrix):
+    if C3DParameters.preconditioner == ILU:
+        try:
+            ilu = spilu(matrix.tocsc(), drop_tol=1E-5, fill_factor=10)
+        except RuntimeError:
+            return None
+        return LinearOperator(matrix.shape, ilu.solve)
+    else:
+        # JACOBI
+        inverseDiagonal = 1. / matrix.diagonal()
+        return LinearOperator(matrix.shape, lambda v: v * inverseDiagonal)
+
+
+def krylovSolve(method, matrix, b, x0, preconditioner, maxIterations):
+    try:
+        return method(matrix, b, x0=x0, rtol=KRYLOV_RTOL, atol=C3DParameters.residualTolerance,
+                      maxiter=maxIterations, M=preconditioner)
+    except TypeError:
+        # scipy < 1.12
+        return method(matrix, b, x0=x0, tol=KRYLOV_RTOL, atol=C3DParameters.residualTolerance,
+                      maxiter=maxIterations, M=preconditioner)
+
+
+# -----------------------------------------------------------
+# solve the system, x is the initial guess and it is overwritten
+# D             diagonal before conditioning (needed by CG)
+# return False if the solver fails
+# a Krylov solver that reaches maxIterations without reaching
+# the tolerance is accepted, as Gauss-Seidel does
+# -----------------------------------------------------------
+def solveSparse(A, indices, b, D, x, maxIterations):
+    nrCells = len(x)
+    matrix = buildMatrixCSR(A, indices, nrCells)
+
+    # exact solution: the explicit boundary fluxes (in b) are not damped by the
+    # iterations, with a small capacity (saturated cells) the solution can diverge
+    if C3DParameters.linearSolver == SUPERLU:
+        try:
+            solution = splu(matrix.tocsc()).solve(b[:nrCells])
+        except RuntimeError:
+            return False
+        info = 0
+
+    elif C3DParameters.linearSolver == CG:
+        # symmetric form: rows multiplied by the diagonal
+        symmetricMatrix = sparse.diags(D[:nrCells]) @ matrix
+        symmetricMatrix = symmetricMatrix.tocsr()
+        preconditioner = getPreconditioner(symmetricMatrix)
+        solution, info = krylovSolve(cg, symmetricMatrix, D[:nrCells] * b[:nrCells], x,
+                                     preconditioner, maxIterations)
+
+    elif C3DParameters.linearSolver == BICGSTAB:
+        preconditioner = getPreconditioner(matrix)
+        solution, info = krylovSolve(bicgstab, matrix, b[:nrCells], x,
+                                     preconditioner, maxIterations)
+    else:
+        print("Wrong linear solver:", C3DParameters.linearSolver)
+        return False
+
+    if info < 0 or not np.all(np.isfinite(solution)):
+        return False
+
+    x[:] = solution
+    return True
+
+
+# -----------------------------------------------------------
+# solve the Newton system J * dx = b (not symmetric)
+# SuperLU, or BiCGSTAB when a Krylov solver is selected
+# return None if the solver fails
+# -----------------------------------------------------------
+def solveJacobian(matrix, b, maxIterations):
+    if C3DParameters.linearSolver == CG or C3DParameters.linearSolver == BICGSTAB:
+        preconditioner = getPreconditioner(matrix)
+        solution, info = krylovSolve(bicgstab, matrix, b, np.zeros(len(b)), preconditioner, maxIterations)
+        if info < 0:
+            return None
+    else:
+        try:
+            solution = splu(matrix.tocsc()).solve(b)
+        except RuntimeError:
+            return None
+
+    if not np.all(np.isfinite(solution)):
+        return None
+    return solution
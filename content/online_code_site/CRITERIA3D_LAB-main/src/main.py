@@ -6,46 +6,87 @@
 
 import pandas as pd
 import os
-import time
+import sys
+import argparse
+from configparser import ConfigParser
+from ast import literal_eval
 
 from dataStructures import *
 import soil
 import waterBalance
 import criteria3D
-import visual3D
 import exportUtils
 import importUtils
 import crop
-from transmissivity import computeNormTransmissivity
+import checkpoint
+import meteoData
 
 
-def main():
-    # path
-    print(os.getcwd())
-    projectPath = os.path.join("..\\data", "test2D")
+# project data needed by runProject
+class CProject:
+    def __init__(self, projectPath, outputFolder):
+        self.projectPath = projectPath
+        self.outputFolder = outputFolder
+        self.stateFolder = os.path.join(projectPath, "state")
+        self.meteoFileName = ""
+        # hourly meteo records (None: streaming, see meteoData.CMeteoReader)
+        self.meteoRecords = None
+        self.firstTimestamp = NODATA
+        self.obsWaterPotential = None
+
+    # chunks of hourly meteo records
+    def getMeteoChunks(self):
+        if self.meteoRecords is not None:
+            return [self.meteoRecords]
+        return meteoData.CMeteoReader(self.meteoFileName, C3DParameters.meteoChunkSize)
+
+
+# -----------------------------------------------------------
+# read settings, soil, crop and meteo data, initialize the mesh
+# parameters        C3DParameters to override after reading settings.ini
+# soilFileName      soil properties file (default: settings/soil.csv)
+# weatherFolder     meteo folder (default: meteo)
+# outputFolder      export folder (default: output)
+# return a CProject, or None on error
+# -----------------------------------------------------------
+def loadProject(projectPath, parameters=None, soilFileName="", weatherFolder="", outputFolder=""):
     settingsFolder = os.path.join(projectPath, "settings")
-    weatherFolder = os.path.join(projectPath, "meteo")
     obsDataFolder = os.path.join(projectPath, "obs_data")
-    stateFolder = os.path.join(projectPath, "state")
-    outputFolder = os.path.join(projectPath, "output")
+    if weatherFolder == "":
+        weatherFolder = os.path.join(projectPath, "meteo")
+    if outputFolder == "":
+        outputFolder = os.path.join(projectPath, "output")
+    if soilFileName == "":
+        soilFileName = os.path.join(settingsFolder, "soil.csv")
+    project = CProject(projectPath, outputFolder)
 
     print("Read model settings...")
     modelSettings = os.path.join(settingsFolder, "settings.ini")
     if not importUtils.readModelParameters(modelSettings):
-        return
+        return None
+
+    if parameters is not None:
+        for name, value in parameters.items():
+            if not hasattr(C3DParameters, name):
+                print("ERROR! Wrong parameter: " + str(name))
+                return None
+            setattr(C3DParameters, name, value)
+
+    if C3DParameters.linearSolver == SUPERLU:
+        print("WARNING: SUPERLU solves exactly the system with the boundary fluxes of the previous approximation:")
+        print("*** in saturated soils the water potential can diverge with very small time steps (see README.md).")
 
     print("Read field settings...")
     fieldSettings = os.path.join(settingsFolder, "field.ini")
     if not importUtils.readFieldParameters(fieldSettings):
-        return
+        return None
 
     print("read soil properties...")
-    soilSettings = os.path.join(settingsFolder, "soil.csv")
-    if not soil.readHorizon(soilSettings):
-        return
+    if not soil.readHorizon(soilFileName):
+        return None
     if C3DStructure.gridDepth > soil.horizons[len(soil.horizons)-1].lowerDepth:
         print("Wrong soil properties: lower depth is < field.depth")
-        return
+        return None
     C3DStructure.nrLayers, soil.depth, soil.thickness = soil.setLayers(C3DStructure.gridDepth,
                                                                        C3DParameters.minThickness,
                                                                        C3DParameters.maxThickness,
@@ -61,7 +102,7 @@ def main():
         if os.path.exists(cropSettingsFilename):
             print("Read crop settings...")
             if not importUtils.readCropParameters(cropSettingsFilename):
-                return
+                return None
             crop.initializeCrop()
         else:
             print("WARNING: crop settings file does not exist!")
@@ -78,51 +119,64 @@ def main():
     print("Initial water storage [m3]:", format(waterBalance.currentStep.waterStorage, ".5f"))
 
     # read unified meteo input file
-    print("Read weather and irrigation data...")
-    wholeData = importUtils.readMeteoData(weatherFolder)
-    wholeData["time"] = pd.to_datetime(wholeData["timestamp"], infer_datetime_format=True)
-
-    print("Total simulation time [hours]:", len(wholeData))
-
-    # split the dataframe in two
-    weatherData = wholeData[["timestamp", "air_humidity", "solar_radiation", "air_temperature", "wind_speed"]]
-    waterData = wholeData[["timestamp", "precipitation", "irrigation"]]
+    project.meteoFileName = os.path.join(weatherFolder, "meteo.csv")
+    if C3DParameters.meteoChunkSize > 0:
+        print("Weather and irrigation data are read during the simulation (chunks of",
+              C3DParameters.meteoChunkSize, "rows)")
+        firstRow = pd.read_csv(project.meteoFileName, nrows=1)
+        project.firstTimestamp = int(meteoData.getHour(firstRow["timestamp"].values)[0])
+    else:
+        print("Read weather and irrigation data...")
+        project.meteoRecords = meteoData.loadMeteoRecords(project.meteoFileName)
+        print("Total simulation time [hours]:", len(project.meteoRecords))
+        project.firstTimestamp = int(project.meteoRecords["timestamp"][0])
 
     # initialize export
-    exportUtils.createExportFile(outputFolder)
+    os.makedirs(outputFolder, exist_ok=True)
+    exportUtils.createExportFile(outputFolder, os.path.join(projectPath, "output", "output_points.csv"))
 
-    obsTmpFileName = os.path.join(stateFolder, "obsWP.csv")
     if C3DParameters.isPeriodicAssimilation or C3DParameters.isFirstAssimilation:
         obsWaterPotentialFileName = os.path.join(obsDataFolder, "waterPotential.csv")
         if os.path.exists(obsWaterPotentialFileName):
             print("Read observed water potential...")
-            obsWaterPotential = pd.read_csv(obsWaterPotentialFileName)
+            project.obsWaterPotential = pd.read_csv(obsWaterPotentialFileName)
         else:
             print("WARNING: observed water potential file does not exist!")
             print("*** The assimilation procedure will be deactivated.")
             C3DParameters.isPeriodicAssimilation = False
             C3DParameters.isFirstAssimilation = False
 
+    return project
+
+
+# -----------------------------------------------------------
+# run the simulation of a project loaded by loadProject
+# nrHours           max number of simulated hours (NODATA: all meteo data)
+# restartFileName   checkpoint saved by a previous run of the same project (see checkpoint.py)
+# -----------------------------------------------------------
+def runProject(project, nrHours=NODATA, restartFileName=""):
     # first assimilation
     weatherIndex = 0
-    if C3DParameters.isFirstAssimilation:
+    if C3DParameters.isFirstAssimilation and restartFileName == "":
         print("Assimilate observed water potential (first hour)...")
-        obsWeather = weatherData.loc[weatherIndex]
-        timestamp = obsWeather["timestamp"]
-        if not importUtils.extractObsWaterPotential(obsWaterPotential, timestamp, obsTmpFileName):
-            return
-        importUtils.assimilateObsWaterPotential(obsTmpFileName)
+        timestamp = project.firstTimestamp
+        obsState = importUtils.extractObsWaterPotential(project.obsWaterPotential, timestamp)
+        if obsState is None:
+            return False
+        importUtils.assimilateObsWaterPotential(obsState)
         criteria3D.setIsRedraw(False)
         criteria3D.computeWaterFlow(3600)
-        importUtils.assimilateObsWaterPotential(obsTmpFileName)
+        importUtils.assimilateObsWaterPotential(obsState)
 
     criteria3D.setIsRedraw(C3DParameters.isVisual)
     if C3DParameters.isVisual:
+        # imported here: vpython is needed only for the visualization
+        import visual3D
         visual3D.initialize(1200)
         visual3D.isPause = True
         # wait for start (press 'r')
         while visual3D.isPause:
-            time.sleep(0.00001)
+            visual3D.waitKeyInput()
             # check for equilibrium
             if visual3D.isComputeEquilibrium:
                 criteria3D.computeEquilibrium()
@@ -130,25 +184,44 @@ def main():
 
     print("Start...")
     waterBalance.initializeBalance()
+
+    currentIndex = 1
+    if restartFileName != "":
+        print("Restart from: " + restartFileName)
+        header = checkpoint.loadCheckpoint(restartFileName)
+        if header is None or header["weatherIndex"] == NODATA:
+            print("ERROR! Wrong checkpoint: " + restartFileName)
+            return False
+        weatherIndex = header["weatherIndex"]
+        currentIndex = header["currentIndex"]
+
     if C3DParameters.isVisual:
         visual3D.redraw()
 
     # main cycle
-    currentIndex = 1
-    lastIndex = min(len(weatherData), len(waterData))
-    while weatherIndex < lastIndex:
-        # compute
-        obsWeather = weatherData.loc[weatherIndex]
-        obsWater = waterData.loc[weatherIndex]
-        transmissivity = computeNormTransmissivity(weatherData, weatherIndex, C3DStructure.latitude, C3DStructure.longitude)
-        criteria3D.computeOneHour(obsWeather, obsWater, transmissivity)
+    checkpointFileName = os.path.join(project.outputFolder, "checkpoint.c3d")
+    firstIndex = weatherIndex
+    for index, obsWeather in enumerate(meteoData.iterateRecords(project.getMeteoChunks())):
+        if index < firstIndex:
+            continue
+        if nrHours != NODATA and index >= firstIndex + nrHours:
+            break
+
+        # restart: the export files keep their rows before the restart hour
+        if index == firstIndex and restartFileName != "":
+            exportUtils.openExportFiles(obsWeather["timestamp"])
+
+        # compute (weather and water data are in the same record)
+        criteria3D.computeOneHour(obsWeather, obsWeather, obsWeather["transmissivity"])
 
         # assimilation
         if C3DParameters.isPeriodicAssimilation and (currentIndex % C3DParameters.assimilationInterval) == 0:
             print("Assimilate observed water potential...")
-            if not importUtils.extractObsWaterPotential(obsWaterPotential, obsWeather["timestamp"], obsTmpFileName):
-                return
-            importUtils.assimilateObsWaterPotential(obsTmpFileName)
+            obsState = importUtils.extractObsWaterPotential(project.obsWaterPotential, obsWeather["timestamp"])
+            if obsState is None:
+                exportUtils.flushExportFiles()
+                return False
+            importUtils.assimilateObsWaterPotential(obsState)
 
         # save output
         exportUtils.takeScreenshot(obsWeather["timestamp"])
@@ -156,8 +229,90 @@ def main():
         weatherIndex += 1
         currentIndex += 1
 
-    visual3D.isPause = True
+        if C3DParameters.checkpointInterval > 0 and (currentIndex - 1) % C3DParameters.checkpointInterval == 0:
+            # the outputs are written before the checkpoint: a restart finds all rows before it
+            exportUtils.syncExportFiles()
+            checkpoint.saveCheckpoint(checkpointFileName, weatherIndex, currentIndex)
+
+    exportUtils.flushExportFiles()
+    if C3DParameters.isVisual:
+        visual3D.redraw()
+        visual3D.isPause = True
     print("\nEnd simulation.\n")
+    return True
+
+
+# value of a parameter override: python literal or string
+def getParameterValue(text):
+    try:
+        return literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+# -----------------------------------------------------------
+# run configuration file (all keys are optional, the paths are relative to the file):
+# [project]
+# projectPath, outputFolder, soilFileName, weatherFolder, restartFileName, hours
+# [parameters]
+# C3DParameters to override, e.g. isVisual = False
+# -----------------------------------------------------------
+def readRunConfig(fileName, arguments):
+    config = ConfigParser()
+    config.optionxform = str
+    if len(config.read(fileName)) == 0:
+        print("ERROR! Missing run configuration file: " + fileName)
+        return False
+    basePath = os.path.dirname(os.path.abspath(fileName))
+    if config.has_section("project"):
+        for name in ["projectPath", "outputFolder", "soilFileName", "weatherFolder", "restartFileName"]:
+            if config.has_option("project", name) and getattr(arguments, name) == "":
+                setattr(arguments, name, os.path.join(basePath, config.get("project", name)))
+        if config.has_option("project", "hours") and arguments.hours == NODATA:
+            arguments.hours = config.getint("project", "hours")
+    if config.has_section("parameters"):
+        # the parameters of the command line have priority
+        arguments.parameters = [name + "=" + value for name, value in config.items("parameters")] \
+            + arguments.parameters
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CRITERIA3D_LAB: 3D soil water flow model")
+    parser.add_argument("projectPath", nargs="?", default="", help="project folder (default: ../data/test2D)")
+    parser.add_argument("-o", "--output", dest="outputFolder", default="", help="export folder (default: output)")
+    parser.add_argument("--soil", dest="soilFileName", default="", help="soil file (default: settings/soil.csv)")
+    parser.add_argument("--meteo", dest="weatherFolder", default="", help="meteo folder (default: meteo)")
+    parser.add_argument("--restart", dest="restartFileName", default="", help="restart from a checkpoint")
+    parser.add_argument("--hours", type=int, default=NODATA, help="max number of simulated hours")
+    parser.add_argument("--set", dest="parameters", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a parameter of settings.ini (e.g. --set waterRetentionCurve=2)")
+    parser.add_argument("--headless", action="store_true", help="no visualization (same as --set isVisual=False)")
+    parser.add_argument("--config", default="", help="run configuration file (.ini)")
+    arguments = parser.parse_args()
+
+    if arguments.config != "" and not readRunConfig(arguments.config, arguments):
+        return False
+    if arguments.projectPath == "":
+        arguments.projectPath = os.path.join("..", "data", "test2D")
+
+    parameters = {}
+    for item in arguments.parameters:
+        if "=" not in item:
+            print("ERROR! Wrong parameter (NAME=VALUE): " + item)
+            return False
+        name, value = item.split("=", 1)
+        parameters[name.strip()] = getParameterValue(value.strip())
+    if arguments.headless:
+        parameters["isVisual"] = False
+
+    project = loadProject(arguments.projectPath, parameters, arguments.soilFileName,
+                          arguments.weatherFolder, arguments.outputFolder)
+    if project is None:
+        return False
+    return runProject(project, arguments.hours, arguments.restartFileName)
 
 
-main()
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
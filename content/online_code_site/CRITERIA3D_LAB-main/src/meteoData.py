@@ -0,0 +1,220 @@
+# meteoData.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# meteo input (meteo.csv): hourly records (numpy structured arrays, METEO_TYPE)
+# with clear sky radiation, normalized transmissivity and hourly ET0 computed
+# for the whole series (numpy)
+# sub-hourly data (e.g. 10 minutes) are aggregated in hourly records:
+# mean of the state variables, sum of precipitation and irrigation
+# timestamp of a record: end of the hour
+# missing values are kept (NaN): the policy is applied by criteria3D.computeOneHour
+#
+# two ways to read the data:
+# loadMeteoRecords     the whole series in memory, the derived variables are saved
+#                      in a cache file next to meteo.csv (used only if meteo.csv and
+#                      the site: latitude, longitude, elevation, time zone are the same)
+# CMeteoReader         streaming: chunks of hourly records, bounded memory
+
+import os
+import json
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+import pandas as pd
+from dataStructures import *
+from transmissivity import clearSkyRadArray, computeNormTransmissivityArray, TRANSMISSIVITY_HOURS
+from PenmanMonteith import computeHourlyET0Array
+
+METEO_CACHE_VERSION = 2
+METEO_CACHE_FILE = "meteo_cache.npz"
+DEFAULT_WIND_SPEED = 2.0        # [m s-1] used for missing data (see criteria3D.computeOneHour)
+
+MEAN_VARIABLES = ["air_humidity", "solar_radiation", "air_temperature", "wind_speed"]
+SUM_VARIABLES = ["precipitation", "irrigation"]
+METEO_VARIABLES = ["clear_sky_radiation", "transmissivity", "ET0"]
+METEO_TYPE = np.dtype([("timestamp", np.int64)]
+                      + [(name, np.float64) for name in MEAN_VARIABLES + SUM_VARIABLES + METEO_VARIABLES])
+
+
+# -----------------------------------------------------------
+# records of the rows of meteo.csv (METEO_VARIABLES not computed)
+# -----------------------------------------------------------
+def toRecords(table):
+    records = np.zeros(len(table), METEO_TYPE)
+    records["timestamp"] = table["timestamp"].values
+    for name in MEAN_VARIABLES + SUM_VARIABLES:
+        records[name] = table[name].values
+    return records
+
+
+def getHour(timestamps):
+    return -(-np.asarray(timestamps, np.int64) // 3600) * 3600
+
+
+# -----------------------------------------------------------
+# hourly records (same values for hourly data)
+# isLast = False: the rows of the last hour are not aggregated (the hour may
+# continue in the next rows), they are returned as the second value
+# -----------------------------------------------------------
+def aggregateHourly(records, isLast):
+    if len(records) == 0:
+        return records, records
+    hours = getHour(records["timestamp"])
+    if not isLast:
+        lastRows = np.flatnonzero(hours == hours[-1])
+        records, remaining = records[:lastRows[0]], records[lastRows[0]:]
+        hours = hours[:lastRows[0]]
+        if len(records) == 0:
+            return records, remaining
+    else:
+        remaining = records[:0]
+
+    start = np.flatnonzero(np.concatenate(([True], hours[1:] != hours[:-1])))
+    hourly = np.zeros(len(start), METEO_TYPE)
+    hourly["timestamp"] = hours[start]
+    for name in MEAN_VARIABLES + SUM_VARIABLES:
+        values = records[name]
+        isValid = ~np.isnan(values)
+        total = np.add.reduceat(np.where(isValid, values, 0.), start)
+        count = np.add.reduceat(isValid.astype(np.int64), start)
+        with np.errstate(invalid="ignore"):
+            if name in MEAN_VARIABLES:
+                hourly[name] = np.where(count > 0, total / count, np.nan)
+            else:
+                hourly[name] = np.where(count > 0, total, np.nan)
+    return hourly, remaining
+
+
+# -----------------------------------------------------------
+# compute METEO_VARIABLES of the records [first, last)
+# the records before and after are used for the transmissivity
+# -----------------------------------------------------------
+def computeMeteoVariables(records, first=0, last=None):
+    if last is None:
+        last = len(records)
+    potentialRad = clearSkyRadArray(records["timestamp"], C3DStructure.latitude, C3DStructure.longitude)
+    transmissivity = computeNormTransmissivityArray(records["solar_radiation"], potentialRad)[first:last]
+    current = records[first:last]
+    windSpeed = np.where(np.isnan(current["wind_speed"]), DEFAULT_WIND_SPEED, current["wind_speed"])
+    current["clear_sky_radiation"] = potentialRad[first:last]
+    current["transmissivity"] = transmissivity
+    current["ET0"] = computeHourlyET0Array(C3DStructure.elevation, current["air_temperature"],
+                                           current["solar_radiation"], current["air_humidity"],
+                                           windSpeed, transmissivity)
+    return current
+
+
+def getCacheKey(meteoFileName):
+    values = hashlib.sha256()
+    with open(meteoFileName, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            values.update(block)
+    site = [METEO_CACHE_VERSION, C3DStructure.latitude, C3DStructure.longitude,
+            C3DStructure.elevation, C3DStructure.timeZone]
+    values.update(json.dumps(site).encode())
+    return values.hexdigest()
+
+
+# return the cached variables, or None if the cache is missing or old
+def readCache(cacheFileName, key, nrHours):
+    if not os.path.exists(cacheFileName):
+        return None
+    try:
+        with np.load(cacheFileName, allow_pickle=False) as cache:
+            if str(cache["key"]) != key:
+                return None
+            variables = {name: cache[name] for name in METEO_VARIABLES}
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    if any(len(values) != nrHours for values in variables.values()):
+        return None
+    return variables
+
+
+# a temporary file for each process (batch workers can share the meteo folder)
+def saveCache(cacheFileName, key, variables):
+    tmpFileName = ""
+    try:
+        fileDescriptor, tmpFileName = tempfile.mkstemp(suffix=".tmp", prefix=METEO_CACHE_FILE + ".",
+                                                       dir=os.path.dirname(cacheFileName))
+        with os.fdopen(fileDescriptor, "wb") as f:
+            np.savez(f, key=np.array(key), **variables)
+        os.replace(tmpFileName, cacheFileName)
+    except OSError as e:
+        print("WARNING: the meteo cache is not saved: " + str(e))
+        if tmpFileName != "" and os.path.exists(tmpFileName):
+            os.remove(tmpFileName)
+
+
+# -----------------------------------------------------------
+# all hourly records of meteoFileName (meteo.csv)
+# -----------------------------------------------------------
+def loadMeteoRecords(meteoFileName):
+    records, _ = aggregateHourly(toRecords(pd.read_csv(meteoFileName)), True)
+    cacheFileName = os.path.join(os.path.dirname(meteoFileName), METEO_CACHE_FILE)
+    key = getCacheKey(meteoFileName)
+    variables = readCache(cacheFileName, key, len(records))
+    if variables is None:
+        print("Compute radiation and ET0 of the meteo data...")
+        records = computeMeteoVariables(records)
+        saveCache(cacheFileName, key, {name: records[name] for name in METEO_VARIABLES})
+    else:
+        for name in METEO_VARIABLES:
+            records[name] = variables[name]
+    return records
+
+
+# -----------------------------------------------------------
+# streaming reader: iterate on chunks of hourly records
+# chunkSize     rows of meteo.csv read at a time
+# the last rows of a chunk are kept until the next one is read
+# (the transmissivity needs the hours after the current one)
+# -----------------------------------------------------------
+class CMeteoReader:
+    def __init__(self, meteoFileName, chunkSize):
+        self.fileName = meteoFileName
+        self.chunkSize = chunkSize
+        self.nrBefore = TRANSMISSIVITY_HOURS - 1
+        self.nrAfter = TRANSMISSIVITY_HOURS - 1
+
+    def __iter__(self):
+        empty = np.zeros(0, METEO_TYPE)
+        previous = empty            # hours already returned (the last nrBefore)
+        current = empty             # hours not returned
+        rows = empty                # rows of the last hour (sub-hourly data)
+        for table in pd.read_csv(self.fileName, chunksize=self.chunkSize,
+                                 usecols=["timestamp"] + MEAN_VARIABLES + SUM_VARIABLES):
+            hourly, rows = aggregateHourly(np.concatenate((rows, toRecords(table))), False)
+            current = np.concatenate((current, hourly))
+            if len(current) > self.nrAfter:
+                nrHours = len(current) - self.nrAfter
+                yield self.computeChunk(previous, current, nrHours)
+                previous = np.concatenate((previous, current[:nrHours]))[-self.nrBefore:]
+                current = current[nrHours:]
+
+        hourly, _ = aggregateHourly(rows, True)
+        current = np.concatenate((current, hourly))
+        if len(current) > 0:
+            yield self.computeChunk(previous, current, len(current))
+
+    def computeChunk(self, previous, current, nrHours):
+        records = np.concatenate((previous, current))
+        return computeMeteoVariables(records, len(previous), len(previous) + nrHours)
+
+
+# iterate on the hourly records of chunks
+def iterateRecords(chunks):
+    for chunk in chunks:
+        for record in chunk:
+            yield record
+
+
+# the records have the fields of METEO_TYPE, pandas series have an index
+def hasVariable(record, name):
+    if isinstance(record, np.void):
+        return name in record.dtype.names
+    return name in record
@@ -0,0 +1,154 @@
+# newtonSolver.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# Newton-Raphson iterations for the water flow step (nonlinearSolver = NEWTON)
+# residual of cell i (finite volumes, implicit Euler):
+#   F[i] = (W[i](H) - W[i](H0)) / deltaT - sum_j G[i,j](H) * (H[j] - H[i]) - flow[i](H)
+# W: water volume [m3]   G: link conductance [m2 s-1]   flow: sink/source + boundary [m3 s-1]
+# the Jacobian contains the derivatives of the soil-soil conductances (dK/dH)
+# and of the boundary flows; infiltration and runoff conductances are lagged
+# each approximation: Newton direction, then backtracking line search on |F|
+
+import numpy as np
+import scipy.sparse as sparse
+from dataStructures import *
+from waterProcesses import linkConductances
+import boundaryConditions
+import waterBalance
+import linearSolver
+import soil
+
+ARMIJO_FACTOR = 1E-4
+MIN_STEP_LENGTH = 1. / 64.
+
+
+# -----------------------------------------------------------
+# update the cells at the current H and return the residual F
+# and the link conductances
+# theta0:   water content at H0 of the sub-surface cells
+# -----------------------------------------------------------
+def computeResidual(deltaT, isFirstApprox, isInfiltration, surfaceCells, subSurfaceCells, theta0):
+    C3DCells.Se[subSurfaceCells] = soil.getDegreeOfSaturationArray(subSurfaceCells)
+    C3DCells.k[subSurfaceCells] = soil.getHydraulicConductivityArray(subSurfaceCells)
+    boundaryConditions.updateBoundary(deltaT)
+    conductances = linkConductances(deltaT, isFirstApprox, isInfiltration)
+
+    residual = np.zeros(C3DStructure.nrCells, np.float64)
+    residual[surfaceCells] = C3DCells.area[surfaceCells] * (C3DCells.H[surfaceCells] - C3DCells.H0[surfaceCells])
+    theta = soil.getVolumetricWaterContentArray(subSurfaceCells)
+    residual[subSurfaceCells] = C3DCells.volume[subSurfaceCells] * (theta - theta0)
+    residual /= deltaT
+
+    linkFlow = conductances * (C3DCells.H[C3DLinks.j] - C3DCells.H[C3DLinks.i])
+    residual -= np.bincount(C3DLinks.i, weights=linkFlow, minlength=C3DStructure.nrCells)
+    residual -= C3DCells.flow
+    return residual, conductances
+
+
+def buildJacobian(deltaT, conductances, surfaceCells, subSurfaceCells):
+    nrCells = C3DStructure.nrCells
+    i = C3DLinks.i
+    j = C3DLinks.j
+    dH = C3DCells.H[j] - C3DCells.H[i]
+
+    # storage (tangent capacity)
+    diagonal = np.zeros(nrCells, np.float64)
+    diagonal[surfaceCells] = C3DCells.area[surfaceCells]
+    diagonal[subSurfaceCells] = C3DCells.volume[subSurfaceCells] * soil.get_dTheta_dPsiArray(subSurfaceCells)
+    diagonal /= deltaT
+
+    # conductances
+    diagonal += np.bincount(i, weights=conductances, minlength=nrCells)
+    rows = [i]
+    columns = [j]
+    values = [-conductances]
+
+    # derivatives of the soil-soil conductances
+    dK_dH = np.zeros(nrCells, np.float64)
+    dK_dH[subSurfaceCells] = soil.get_dK_dHArray(subSurfaceCells)
+    links = C3DLinks.redistributionLinks
+    li = i[links]
+    lj = j[links]
+    factor = C3DLinks.area[links] / C3DLinks.distance[links]
+    factor = np.where(C3DLinks.kind[links] == LINK_LATERAL, factor * C3DParameters.conductivityHVRatio, factor)
+    meanType = C3DParameters.conductivityMean
+    dG_dHi = factor * soil.dMeanK_dk1Array(meanType, C3DCells.k[li], C3DCells.k[lj]) * dK_dH[li]
+    dG_dHj = factor * soil.dMeanK_dk1Array(meanType, C3DCells.k[lj], C3DCells.k[li]) * dK_dH[lj]
+    diagonal -= np.bincount(li, weights=dG_dHi * dH[links], minlength=nrCells)
+    rows.append(li)
+    columns.append(lj)
+    values.append(-dG_dHj * dH[links])
+
+    # boundary flows
+    diagonal -= boundaryConditions.getBoundaryFlowDerivative(dK_dH)
+
+    cells = np.arange(nrCells)
+    rows.append(cells)
+    columns.append(cells)
+    values.append(diagonal)
+    return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                             shape=(nrCells, nrCells))
+
+
+# -----------------------------------------------------------
+# same interface and time step control of solver.computeStep
+# isInfiltration:   compute surface/sub-surface links
+# -----------------------------------------------------------
+def computeStep(deltaT, isInfiltration):
+    approximation = 1
+    isValidStep = False
+    C3DCells.H0[:] = C3DCells.H
+    surfaceCells = np.flatnonzero(C3DCells.isSurface)
+    subSurfaceCells = np.flatnonzero(~C3DCells.isSurface)
+    curve = C3DParameters.waterRetentionCurve
+    theta0 = soil.thetaFromPsiArray(curve, C3DCells.H0[subSurfaceCells] - C3DCells.z[subSurfaceCells],
+                                    C3DCells.horizonIndex[subSurfaceCells])
+    ratio = (C3DParameters.maxIterationsNr / C3DParameters.maxApproximationsNr)
+
+    while (not isValidStep) and (approximation <= C3DParameters.maxApproximationsNr):
+        isFirstApprox = (approximation == 1)
+        waterBalance.maxCourant = 0.0
+        residual, conductances = computeResidual(deltaT, isFirstApprox, isInfiltration,
+                                                 surfaceCells, subSurfaceCells, theta0)
+
+        if (waterBalance.maxCourant > 1.0) and (deltaT > C3DParameters.deltaT_min):
+            print("Courant too high:", waterBalance.maxCourant)
+            print("Decrease time step")
+            waterBalance.controller.reduceCourant(deltaT, waterBalance.maxCourant)
+            return False
+
+        jacobian = buildJacobian(deltaT, conductances, surfaceCells, subSurfaceCells)
+        maxIterationsNr = int(max(10, ratio * approximation))
+        direction = linearSolver.solveJacobian(jacobian, -residual, maxIterationsNr)
+        if direction is None:
+            waterBalance.controller.reduceNotConvergent(deltaT)
+            print("System is not convergent.")
+            return False
+
+        # line search
+        H = C3DCells.H.copy()
+        norm = np.linalg.norm(residual)
+        stepLength = 1.0
+        while True:
+            C3DCells.H[:] = H + stepLength * direction
+            # check surface error
+            C3DCells.H[surfaceCells] = np.maximum(C3DCells.H[surfaceCells], C3DCells.z[surfaceCells])
+            newResidual, conductances = computeResidual(deltaT, isFirstApprox, isInfiltration,
+                                                        surfaceCells, subSurfaceCells, theta0)
+            if np.linalg.norm(newResidual) <= (1. - ARMIJO_FACTOR * stepLength) * norm \
+                    or stepLength <= MIN_STEP_LENGTH:
+                break
+            stepLength *= 0.5
+
+        C3DCells.Se[surfaceCells] = np.where(C3DCells.H[surfaceCells] > C3DCells.z[surfaceCells], 1.0, 0.0)
+
+        # waterBalance
+        isValidStep = waterBalance.waterBalance(deltaT, approximation, conductances)
+        if waterBalance.forceExit:
+            return False
+        approximation += 1
+
+    return isValidStep
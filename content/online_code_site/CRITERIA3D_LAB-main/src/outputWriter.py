@@ -0,0 +1,273 @@
+# outputWriter.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# buffered output writers: the file is kept open and the rows are
+# written when the buffer is full (bufferSize values) or when
+# flushInterval seconds are passed since the last write
+# formats (C3DParameters.outputFormat):
+#   CSV_FORMAT        fileName.csv (text, same format of the previous versions)
+#   NPY_FORMAT        fileName_npy/chunk_000000.npy ... + columns.txt
+#   PARQUET_FORMAT    fileName.parquet (needs pyarrow, otherwise NPY_FORMAT)
+# resumeTimestamp (restart): the rows of the existing file before resumeTimestamp
+# are written again at the beginning of the new file, NODATA: new file
+# after a crash the rows written before it are kept (an incomplete last row of
+# a .csv file is skipped), a .parquet file is readable only after sync() or close()
+
+import os
+import time
+import glob
+import atexit
+import numpy as np
+import pandas as pd
+from commonConst import *
+
+# file (or folder) of each format: fileName + suffix
+OUTPUT_SUFFIX = {CSV_FORMAT: ".csv", NPY_FORMAT: "_npy", PARQUET_FORMAT: ".parquet"}
+
+openWriters = []
+
+
+class COutputWriter:
+    # columns:    names of the columns (the first one is the timestamp)
+    # formats:    printf formats of the columns (CSV)
+    def __init__(self, fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp=NODATA):
+        self.fileName = fileName
+        self.columns = list(columns)
+        self.formats = list(formats)
+        # read before the file is opened again
+        self.previousRows = self.readPreviousRows(resumeTimestamp)
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        self.buffer = []
+        self.nrBufferedValues = 0
+        self.lastFlush = time.monotonic()
+        self.isOpen = True
+
+    # rows: 2D array (nrRows x nrColumns) or one row
+    def write(self, rows):
+        rows = np.atleast_2d(np.asarray(rows, np.float64))
+        if rows.shape[0] == 0:
+            return
+        self.buffer.append(rows)
+        self.nrBufferedValues += rows.size
+        if self.nrBufferedValues >= self.bufferSize or (time.monotonic() - self.lastFlush) >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.writeChunk(np.concatenate(self.buffer))
+            self.buffer = []
+            self.nrBufferedValues = 0
+        self.lastFlush = time.monotonic()
+
+    # the rows are readable also after a crash (e.g. before a checkpoint)
+    def sync(self):
+        self.flush()
+
+    def close(self):
+        if not self.isOpen:
+            return
+        self.flush()
+        self.closeFile()
+        self.isOpen = False
+        if self in openWriters:
+            openWriters.remove(self)
+
+    # rows of the existing file before resumeTimestamp
+    def readPreviousRows(self, resumeTimestamp):
+        noRows = np.zeros((0, len(self.columns)))
+        if resumeTimestamp == NODATA:
+            return noRows
+        # empty or damaged file (e.g. a crash of the previous run)
+        try:
+            table = self.readTable()
+        except (OSError, ValueError, EOFError) as e:
+            print("WARNING: the output file cannot be read, it is not resumed: " + self.fileName
+                  + OUTPUT_SUFFIX[self.outputFormat] + " (" + str(e) + ")")
+            return noRows
+        if table is None:
+            return noRows
+        if list(table.columns) != self.columns:
+            print("WARNING: the columns of the output file are different, it is not resumed: " + self.fileName)
+            return noRows
+        rows = table.values.astype(np.float64)
+        return rows[rows[:, 0] < resumeTimestamp]
+
+    def readTable(self):
+        return readOutput(self.fileName, self.outputFormat)
+
+    def writePreviousRows(self):
+        if len(self.previousRows) > 0:
+            self.writeChunk(self.previousRows)
+        self.previousRows = None
+
+    def writeChunk(self, rows):
+        pass
+
+    def closeFile(self):
+        pass
+
+    # the open file is not copied (e.g. in the saved state of a simulation)
+    def __deepcopy__(self, memo):
+        return self
+
+
+class CCsvWriter(COutputWriter):
+    outputFormat = CSV_FORMAT
+
+    def __init__(self, fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp=NODATA):
+        super().__init__(fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp)
+        self.file = open(fileName + ".csv", "w")
+        self.file.write(",".join(self.columns) + "\n")
+        self.rowFormat = ",".join(self.formats) + "\n"
+        self.writePreviousRows()
+
+    # the last row is incomplete if the file does not end with a new line
+    def readTable(self):
+        table = super().readTable()
+        if table is not None and len(table) > 0:
+            with open(self.fileName + ".csv", "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    table = table.iloc[:-1]
+        return table
+
+    def writeChunk(self, rows):
+        self.file.write("".join([self.rowFormat % tuple(row) for row in rows.tolist()]))
+        self.file.flush()
+
+    def closeFile(self):
+        self.file.close()
+
+
+class CNpyWriter(COutputWriter):
+    outputFormat = NPY_FORMAT
+
+    def __init__(self, fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp=NODATA):
+        super().__init__(fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp)
+        self.folder = fileName + "_npy"
+        os.makedirs(self.folder, exist_ok=True)
+        for oldChunk in glob.glob(os.path.join(self.folder, "chunk_*.npy")):
+            os.remove(oldChunk)
+        with open(os.path.join(self.folder, "columns.txt"), "w") as f:
+            f.write("\n".join(self.columns) + "\n")
+        self.nrChunks = 0
+        self.writePreviousRows()
+
+    def writeChunk(self, rows):
+        np.save(os.path.join(self.folder, "chunk_" + format(self.nrChunks, "06d") + ".npy"), rows)
+        self.nrChunks += 1
+
+
+# the rows are written in fileName.parquet.tmp, that is moved to fileName.parquet
+# (complete file, with its footer) by sync() and close()
+class CParquetWriter(COutputWriter):
+    outputFormat = PARQUET_FORMAT
+
+    def __init__(self, fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp=NODATA):
+        import pyarrow
+        import pyarrow.parquet
+        super().__init__(fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp)
+        self.pyarrow = pyarrow
+        if resumeTimestamp == NODATA and os.path.exists(fileName + ".parquet"):
+            os.remove(fileName + ".parquet")
+        self.schema = pyarrow.schema([(name, pyarrow.float64()) for name in self.columns])
+        self.writer = pyarrow.parquet.ParquetWriter(fileName + ".parquet.tmp", self.schema)
+        self.writePreviousRows()
+
+    # one row group for each chunk
+    def writeChunk(self, rows):
+        table = self.pyarrow.Table.from_arrays([self.pyarrow.array(rows[:, i]) for i in range(rows.shape[1])],
+                                               names=self.columns)
+        self.writer.write_table(table)
+
+    # the rows written are copied in the new temporary file
+    def sync(self):
+        self.flush()
+        self.closeFile()
+        table = self.pyarrow.parquet.read_table(self.fileName + ".parquet")
+        self.writer = self.pyarrow.parquet.ParquetWriter(self.fileName + ".parquet.tmp", self.schema)
+        self.writer.write_table(table)
+
+    def closeFile(self):
+        self.writer.close()
+        os.replace(self.fileName + ".parquet.tmp", self.fileName + ".parquet")
+
+
+# fileName without extension
+def getOutputWriter(outputFormat, fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp=NODATA):
+    writer = None
+    if outputFormat == PARQUET_FORMAT:
+        try:
+            writer = CParquetWriter(fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp)
+        except ImportError:
+            print("WARNING: pyarrow is not installed, the output will be saved in .npy files")
+            outputFormat = NPY_FORMAT
+    if writer is None and outputFormat == NPY_FORMAT:
+        writer = CNpyWriter(fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp)
+    if writer is None:
+        writer = CCsvWriter(fileName, columns, formats, bufferSize, flushInterval, resumeTimestamp)
+    # registered only when the file is open
+    openWriters.append(writer)
+    return writer
+
+
+# last modification time of an output file (or of the files of the folder)
+def getModificationTime(path):
+    if os.path.isdir(path):
+        return max([os.path.getmtime(name) for name in glob.glob(os.path.join(path, "*"))], default=0.)
+    return os.path.getmtime(path)
+
+
+# formats of the existing output files (fileName without extension)
+def getOutputFormats(fileName):
+    formats = []
+    for outputFormat, suffix in OUTPUT_SUFFIX.items():
+        if outputFormat == NPY_FORMAT:
+            if os.path.exists(os.path.join(fileName + suffix, "columns.txt")):
+                formats.append(outputFormat)
+        elif os.path.exists(fileName + suffix):
+            formats.append(outputFormat)
+    return formats
+
+
+# -----------------------------------------------------------
+# read an output file (fileName without extension)
+# outputFormat: format written by the simulation (writer.outputFormat),
+# if NODATA the last modified file of any format is read
+# return a DataFrame, or None if the file does not exist
+# -----------------------------------------------------------
+def readOutput(fileName, outputFormat=NODATA):
+    formats = getOutputFormats(fileName)
+    if len(formats) == 0 or (outputFormat != NODATA and outputFormat not in formats):
+        return None
+    if outputFormat == NODATA:
+        outputFormat = max(formats, key=lambda item: getModificationTime(fileName + OUTPUT_SUFFIX[item]))
+        if len(formats) > 1:
+            print("WARNING: output files of different formats: " + fileName
+                  + ", the last modified is read: " + fileName + OUTPUT_SUFFIX[outputFormat])
+
+    if outputFormat == CSV_FORMAT:
+        return pd.read_csv(fileName + ".csv")
+    if outputFormat == PARQUET_FORMAT:
+        return pd.read_parquet(fileName + ".parquet")
+    folder = fileName + "_npy"
+    with open(os.path.join(folder, "columns.txt")) as f:
+        columns = f.read().split()
+    chunks = [np.load(chunk) for chunk in sorted(glob.glob(os.path.join(folder, "chunk_*.npy")))]
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=columns)
+    table = pd.DataFrame(np.concatenate(chunks), columns=columns)
+    table["timestamp"] = table["timestamp"].astype(np.int64)
+    return table
+
+
+def closeAll():
+    for writer in list(openWriters):
+        writer.close()
+
+
+atexit.register(closeAll)
@@ -4,13 +4,15 @@
 # https://github.com/ARPA-SIMC/CRITERIA3D_LAB
 # ---------------------------------------------------------
 
-from math import fabs, sqrt
+from math import sqrt
+from bisect import bisect_left, bisect_right
 import numpy as np
 import soil
-from copy import copy
 from dataStructures import *
 from enum import Enum
 
+CELL_TREE_NEIGHBOURS = 8       # closest cells compared by CCellTree
+
 
 class Neighbours(Enum):
     Right = 1
@@ -30,177 +32,245 @@ class CRectangularMeshHeader:
     magnify = NODATA
 
 
+# -----------------------------------------------------------
+# spatial index of the mesh (see buildSpatialIndex)
+# xLower, xUpper:   [m] x limits of the columns of rectangles
+# yLower, yUpper:   [m] y limits of the rows of rectangles
+# layerTop, layerBottom:  [m] depth limits of the layers (of soil.depth)
+# -----------------------------------------------------------
+class CSpatialIndex:
+    def __init__(self):
+        self.xLower = np.zeros(0, np.float64)
+        self.xUpper = np.zeros(0, np.float64)
+        self.yLower = np.zeros(0, np.float64)
+        self.yUpper = np.zeros(0, np.float64)
+        self.layerDepth = None
+        self.layerTop = np.zeros(0, np.float64)
+        self.layerBottom = np.zeros(0, np.float64)
+
+
+# -----------------------------------------------------------
+# KD-tree of the centers of a set of cells (scipy.spatial.cKDTree)
+# getClosestCells returns the closest cell of the set to each point,
+# the first one in indices if the distances are equal (as a linear search):
+# the CELL_TREE_NEIGHBOURS closest cells are compared, the points with more
+# cells at the same distance are queried again with twice the neighbours
+# -----------------------------------------------------------
+class CCellTree:
+    def __init__(self, indices):
+        # imported here: scipy is slow to import
+        from scipy.spatial import cKDTree
+        self.indices = np.asarray(list(indices), np.int64)
+        self.points = np.column_stack((C3DCells.x[self.indices], C3DCells.y[self.indices],
+                                       C3DCells.z[self.indices]))
+        self.tree = cKDTree(self.points)
+
+    # points: array (nrPoints x 3) of x, y, z [m]
+    def getClosestCells(self, points):
+        points = np.atleast_2d(np.asarray(points, np.float64))
+        closest = np.zeros(len(points), np.int64)
+        remaining = np.arange(len(points))
+        nrNeighbours = min(CELL_TREE_NEIGHBOURS, len(self.indices))
+        while len(remaining) > 0:
+            distances, positions = self.tree.query(points[remaining], k=nrNeighbours)
+            distances = distances.reshape(len(remaining), nrNeighbours)
+            positions = positions.reshape(len(remaining), nrNeighbours)
+            # distances of the candidates computed as in a linear search
+            delta = self.points[positions] - points[remaining, None, :]
+            distance = np.sqrt(delta[:, :, 0] * delta[:, :, 0] + delta[:, :, 1] * delta[:, :, 1]
+                               + delta[:, :, 2] * delta[:, :, 2])
+            isClosest = distance == np.min(distance, axis=1)[:, None]
+            closest[remaining] = np.min(np.where(isClosest, positions, len(self.indices)), axis=1)
+
+            # equal (or almost equal) distance of the last neighbour: other cells may be as close
+            if nrNeighbours == len(self.indices):
+                break
+            isComplete = distances[:, -1] > distances[:, 0] * (1 + 1e-9) + 1e-12
+            remaining = remaining[~isComplete]
+            nrNeighbours = min(nrNeighbours * 2, len(self.indices))
+        return self.indices[closest]
+
+
+# -----------------------------------------------------------
+# rectangles of the mesh stored as struct of arrays
+# v:               [m] vertices (nrRectangles x 4 x 3), from (x, y) counterclockwise
+# centroid:        [m] (nrRectangles x 3)
+# area:            [m^2]
+# neighbours:      index of the neighbour on each side (Neighbours order), NOLINK on the border
+# boundarySides:   [m] length of the sides on the border (NODATA inside)
+# boundarySlopes:  [-] slope from the centroid to the sides on the border (NODATA inside)
+# isBoundary, boundarySide, boundarySlope: side on the border with the max positive slope
+# C3DRM[i] returns a CRectangle view on the i-th rectangle
+# -----------------------------------------------------------
+class CRectangleStore:
+    def __init__(self):
+        self.allocate(0)
+
+    def allocate(self, nrRectangles):
+        self.nrRectangles = nrRectangles
+        self.v = np.zeros((nrRectangles, C3DStructure.nrVerticesPerRectangle, C3DStructure.nrDimensions))
+        self.centroid = np.zeros((nrRectangles, C3DStructure.nrDimensions))
+        self.area = np.zeros(nrRectangles)
+        self.neighbours = np.full((nrRectangles, len(Neighbours)), NOLINK, np.int64)
+        self.boundarySides = np.full((nrRectangles, len(Neighbours)), NODATA)
+        self.boundarySlopes = np.full((nrRectangles, len(Neighbours)), NODATA)
+        self.isBoundary = np.zeros(nrRectangles, bool)
+        self.boundarySide = np.full(nrRectangles, NODATA)
+        self.boundarySlope = np.full(nrRectangles, NODATA)
+
+    def clear(self):
+        self.allocate(0)
+
+    def __len__(self):
+        return self.nrRectangles
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.nrRectangles
+        if i < 0 or i >= self.nrRectangles:
+            raise IndexError("rectangle index out of range")
+        return CRectangle(self, i)
+
+    def __iter__(self):
+        for i in range(self.nrRectangles):
+            yield CRectangle(self, i)
+
+
+def rectangleProperty(arrayName):
+    def getValue(self):
+        return getattr(self.store, arrayName)[self.index]
+
+    def setValue(self, value):
+        getattr(self.store, arrayName)[self.index] = value
+
+    return property(getValue, setValue)
+
+
+# compatibility view on a single rectangle of the store
+class CRectangle:
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, i):
+        self.store = store
+        self.index = i
+
+    v = rectangleProperty("v")
+    centroid = rectangleProperty("centroid")
+    area = rectangleProperty("area")
+    neighbours = rectangleProperty("neighbours")
+    boundarySides = rectangleProperty("boundarySides")
+    boundarySlopes = rectangleProperty("boundarySlopes")
+    isBoundary = rectangleProperty("isBoundary")
+    boundarySide = rectangleProperty("boundarySide")
+    boundarySlope = rectangleProperty("boundarySlope")
+
+
 # global structures
 header = CRectangularMeshHeader()
-C3DRM = []
-
+C3DRM = CRectangleStore()
+spatialIndex = CSpatialIndex()
 
-class CRectangle:
-    def __init__(self, index, v=np.zeros((C3DStructure.nrVerticesPerRectangle, C3DStructure.nrDimensions), float)):
-        self.index = index
-        self.v = copy(v)
-        self.centroid = getCentroid3D(self.v)
-        self.area = getArea2D(self.v)
-
-        # initialize
-        self.isBoundary = False
-        self.boundarySide = NODATA
-        self.boundarySlope = NODATA
-
-        self.neighbours, self.boundarySides, self.boundarySlopes = boundaryProperties(self.index, self.v, self.centroid)
-
-        if NOLINK in self.neighbours:
-            isFirst = True
-            index = NOLINK
-            for i in range(len(self.boundarySlopes)):
-                if self.boundarySlopes[i] != NODATA and self.boundarySlopes[i] > 0:
-                    if isFirst:
-                        index = i
-                        isFirst = False
-                    else:
-                        if self.boundarySlopes[i] > self.boundarySlopes[index]:
-                            index = i
-            if index != NOLINK:
-                self.isBoundary = True
-                self.boundarySide = self.boundarySides[index]
-                self.boundarySlope = self.boundarySlopes[index]
+# vertices of the sides of a rectangle (Neighbours order)
+SIDE_VERTICES = [(1, 2), (2, 3), (3, 0), (0, 1)]
 
 
+# -----------------------------------------------------------
+# regular grid of rectangles (rows along the x axis), in closed form:
+# x and y of the lower left vertex of the rectangles
+# -----------------------------------------------------------
 def rectangularMeshCreation():
     global header
-    C3DRM.clear()
-    C3DStructure.totalArea = 0
     dx = C3DStructure.gridWidth * 0.5
     dy = C3DStructure.gridHeight * 0.5
-
-    index = 0
-    for y in np.arange(-dy, dy, C3DStructure.cellSize):
-        for x in np.arange(-dx, dx, C3DStructure.cellSize):
-            if (x < dx) and (y < dy):
-                rectangle = CRectangle(index, getRectangleVertices(x, y))
-                C3DRM.append(copy(rectangle))
-                C3DStructure.totalArea += rectangle.area
-                index += 1
-    header = getHeader(C3DRM)
-
-
+    x = np.arange(-dx, dx, C3DStructure.cellSize)
+    y = np.arange(-dy, dy, C3DStructure.cellSize)
+    # arange may add one more value (rounding of the grid size)
+    x = x[x < dx][:C3DStructure.nrRectanglesInXAxis]
+    y = y[y < dy][:C3DStructure.nrRectanglesInYAxis]
+    x, y = np.meshgrid(x, y)
+    x = x.ravel()
+    y = y.ravel()
+
+    C3DRM.allocate(len(x))
+    v = getRectangleVertices(x, y)
+    C3DRM.v[...] = v
+    C3DRM.centroid[:, 0] = (v[:, 0, 0] + v[:, 1, 0]) / 2
+    C3DRM.centroid[:, 1] = (v[:, 0, 1] + v[:, 2, 1]) / 2
+    C3DRM.centroid[:, 2] = (v[:, 0, 2] + v[:, 1, 2] + v[:, 2, 2] + v[:, 3, 2]) / 4
+    C3DRM.area[:] = (v[:, 1, 0] - v[:, 0, 0]) * (v[:, 2, 1] - v[:, 0, 1])
+    setBoundaryProperties()
+    C3DStructure.totalArea = float(np.sum(C3DRM.area))
+
+    header = getHeader()
+    buildSpatialIndex()
+
+
+# x, y: arrays of the lower left vertex [m]
 def getRectangleVertices(x, y):
-    v = np.zeros((C3DStructure.nrVerticesPerRectangle, C3DStructure.nrDimensions), float)
+    v = np.zeros((len(x), C3DStructure.nrVerticesPerRectangle, C3DStructure.nrDimensions), float)
     dzy = C3DStructure.slopeY * y
     dzy2 = C3DStructure.slopeY * (y + C3DStructure.cellSize)
     dzPlant = C3DStructure.plantSlope * C3DStructure.plantSlopeWidth
-    dzPlant1 = C3DStructure.plantSlope * min(C3DStructure.plantSlopeWidth, fabs(x))
-    dzPlant2 = C3DStructure.plantSlope * min(C3DStructure.plantSlopeWidth, fabs(x + C3DStructure.cellSize))
-    v[0] = [x, y, C3DStructure.elevation + dzPlant - dzPlant1 - dzy]
-    v[1] = [x + C3DStructure.cellSize, y, C3DStructure.elevation + dzPlant - dzPlant2 - dzy]
-    v[2] = [x + C3DStructure.cellSize, y + C3DStructure.cellSize, C3DStructure.elevation + dzPlant - dzPlant2 - dzy2]
-    v[3] = [x, y + C3DStructure.cellSize, C3DStructure.elevation + dzPlant - dzPlant1 - dzy2]
+    dzPlant1 = C3DStructure.plantSlope * np.minimum(C3DStructure.plantSlopeWidth, np.fabs(x))
+    dzPlant2 = C3DStructure.plantSlope * np.minimum(C3DStructure.plantSlopeWidth, np.fabs(x + C3DStructure.cellSize))
+    v[:, 0] = np.column_stack((x, y, C3DStructure.elevation + dzPlant - dzPlant1 - dzy))
+    v[:, 1] = np.column_stack((x + C3DStructure.cellSize, y, C3DStructure.elevation + dzPlant - dzPlant2 - dzy))
+    v[:, 2] = np.column_stack((x + C3DStructure.cellSize, y + C3DStructure.cellSize,
+                               C3DStructure.elevation + dzPlant - dzPlant2 - dzy2))
+    v[:, 3] = np.column_stack((x, y + C3DStructure.cellSize, C3DStructure.elevation + dzPlant - dzPlant1 - dzy2))
     return v
 
 
-def boundaryProperties(index, vertices, centroid):
-    neighbours = []
-    boundarySides = []
-    boundarySlopes = []
-    greater_than = lambda a, b: a >= b
-    less_than = lambda a, b: a <= b
-    plus = lambda a, b: a + b
-    minus = lambda a, b: a - b
-    neighbours_map = {
-        Neighbours.Right: {
-            "index": index + 1,
-            "limit": C3DStructure.gridWidth*0.5,
-            "comparator": less_than,
-            "vertices": [vertices[1], vertices[2]],
-            "boundary_coordinate": 0,
-            "operator": plus
-        },
-        Neighbours.Up: {
-            "index": index + C3DStructure.nrRectanglesInXAxis,
-            "limit": C3DStructure.gridHeight*0.5,
-            "comparator": less_than,
-            "vertices": [vertices[2], vertices[3]],
-            "boundary_coordinate": 1,
-            "operator": plus
-        },
-        Neighbours.Left: {
-            "index": index - 1,
-            "limit": -C3DStructure.gridWidth*0.5,
-            "comparator": greater_than,
-            "vertices": [vertices[3], vertices[0]],
-            "boundary_coordinate": 0,
-            "operator": minus
-        },
-        Neighbours.Down: {
-            "index": index - C3DStructure.nrRectanglesInXAxis,
-            "limit": -C3DStructure.gridHeight*0.5,
-            "comparator": greater_than,
-            "vertices": [vertices[0], vertices[1]],
-            "boundary_coordinate": 1,
-            "operator": minus
-        },
-    }
-    for key, value in neighbours_map.items():
-        coordinate_to_check = neighbours_map[key]["boundary_coordinate"]
-        limit_to_check = neighbours_map[key]["limit"]
-        move_coordinate = neighbours_map[key]["operator"]
-        check_limit = neighbours_map[key]["comparator"]
-
-        if check_limit(move_coordinate(
-                centroid[coordinate_to_check], C3DStructure.cellSize),
-                limit_to_check):
-            neighbours.append(neighbours_map[key]["index"])
-            boundarySides.append(NODATA)
-            boundarySlopes.append(NODATA)
-        else:
-            neighbours.append(NOLINK)
-
-            # compute boundary side
-            boundarySides.append(distance3D(neighbours_map[key]["vertices"][0], neighbours_map[key]["vertices"][1]))
-            boundaryPoint = (neighbours_map[key]["vertices"][0] + neighbours_map[key]["vertices"][1]) * 0.5
-
-            # compute slope
-            dz = centroid[2] - boundaryPoint[2]
-            dxy = distance2D(centroid, boundaryPoint)
-            if abs(dz / dxy) < EPSILON:
-                boundarySlopes.append(0.0)
-            else:
-                boundarySlopes.append(dz / dxy)
-    return neighbours, boundarySides, boundarySlopes
-
-
-def getCentroid3D(vertices):
-    return np.array(
-        [(vertices[0][0] + vertices[1][0]) / 2,
-         (vertices[0][1] + vertices[2][1]) / 2,
-         (vertices[0][2] + vertices[1][2] + vertices[2][2] + vertices[3][2]) / 4])
-
-
-def getArea2D(vertices):
-    x_side = vertices[1][0] - vertices[0][0]
-    y_side = vertices[2][1] - vertices[0][1]
-    return x_side * y_side
-
-
-def getHeader(rectangleList):
+# neighbours of the rectangles and slopes of the sides on the border
+def setBoundaryProperties():
+    index = np.arange(C3DRM.nrRectangles)
+    centroid = C3DRM.centroid
+    cellSize = C3DStructure.cellSize
+    isInside = [centroid[:, 0] + cellSize <= C3DStructure.gridWidth * 0.5,
+                centroid[:, 1] + cellSize <= C3DStructure.gridHeight * 0.5,
+                centroid[:, 0] - cellSize >= -C3DStructure.gridWidth * 0.5,
+                centroid[:, 1] - cellSize >= -C3DStructure.gridHeight * 0.5]
+    offsets = [1, C3DStructure.nrRectanglesInXAxis, -1, -C3DStructure.nrRectanglesInXAxis]
+
+    for side in Neighbours:
+        k = side.value - 1
+        C3DRM.neighbours[:, k] = np.where(isInside[k], index + offsets[k], NOLINK)
+
+        # border
+        border = np.flatnonzero(~isInside[k])
+        v1 = C3DRM.v[border, SIDE_VERTICES[k][0]]
+        v2 = C3DRM.v[border, SIDE_VERTICES[k][1]]
+        C3DRM.boundarySides[border, k] = distance3DArray(v1, v2)
+        boundaryPoint = (v1 + v2) * 0.5
+        dz = centroid[border, 2] - boundaryPoint[:, 2]
+        slope = dz / distance2DArray(centroid[border], boundaryPoint)
+        C3DRM.boundarySlopes[border, k] = np.where(np.abs(slope) < EPSILON, 0.0, slope)
+
+    # side with the max positive slope (the first one if equal)
+    slopes = np.where(C3DRM.neighbours == NOLINK, C3DRM.boundarySlopes, NODATA)
+    C3DRM.isBoundary[:] = np.any(slopes > 0, axis=1)
+    side = np.argmax(slopes, axis=1)[C3DRM.isBoundary]
+    C3DRM.boundarySide[C3DRM.isBoundary] = C3DRM.boundarySides[C3DRM.isBoundary, side]
+    C3DRM.boundarySlope[C3DRM.isBoundary] = C3DRM.boundarySlopes[C3DRM.isBoundary, side]
+
+
+# [m] length of the side of each neighbour (NODATA on the border)
+def getAdjacentSides():
+    sides = np.full((C3DRM.nrRectangles, len(Neighbours)), NODATA)
+    for k in range(len(Neighbours)):
+        sides[:, k] = distance2DArray(C3DRM.v[:, SIDE_VERTICES[k][0]], C3DRM.v[:, SIDE_VERTICES[k][1]])
+    sides[C3DRM.neighbours == NOLINK] = NODATA
+    return sides
+
+
+def getHeader():
     myHeader = CRectangularMeshHeader()
-    myHeader.xMin = rectangleList[0].centroid[0]
-    myHeader.yMin = rectangleList[0].centroid[1]
-    myHeader.zMin = rectangleList[0].centroid[2]
-    myHeader.xMax = myHeader.xMin
-    myHeader.yMax = myHeader.yMin
-    myHeader.zMax = myHeader.zMin
-
-    for i in range(1, len(rectangleList)):
-        x = rectangleList[i].centroid[0]
-        y = rectangleList[i].centroid[1]
-        z = rectangleList[i].centroid[2]
-        myHeader.xMin = min(myHeader.xMin, x)
-        myHeader.yMin = min(myHeader.yMin, y)
-        myHeader.zMin = min(myHeader.zMin, z)
-        myHeader.xMax = max(myHeader.xMax, x)
-        myHeader.yMax = max(myHeader.yMax, y)
-        myHeader.zMax = max(myHeader.zMax, z)
+    myHeader.xMin = float(np.min(C3DRM.centroid[:, 0]))
+    myHeader.yMin = float(np.min(C3DRM.centroid[:, 1]))
+    myHeader.zMin = float(np.min(C3DRM.centroid[:, 2]))
+    myHeader.xMax = float(np.max(C3DRM.centroid[:, 0]))
+    myHeader.yMax = float(np.max(C3DRM.centroid[:, 1]))
+    myHeader.zMax = float(np.max(C3DRM.centroid[:, 2]))
 
     halfStep = C3DStructure.cellSize * 0.5
     myHeader.xMin -= halfStep
@@ -214,68 +284,120 @@ def getHeader(rectangleList):
     return myHeader
 
 
-def distance2D(v1, v2):
-    dx = fabs(v1[0] - v2[0])
-    dy = fabs(v1[1] - v2[1])
-    return sqrt(dx * dx + dy * dy)
-
-
-def distance3D(v1, v2):
-    dx = fabs(v1[0] - v2[0])
-    dy = fabs(v1[1] - v2[1])
-    dz = fabs(v1[2] - v2[2])
-    return sqrt(dx * dx + dy * dy + dz * dz)
-
-
-def getAdjacentVertices(rectangle1, rectangle2):
-    commonVertices = []
-    for i in rectangle1.v:
-        for j in rectangle2.v:
-            if np.allclose(i, j, rtol=1e-05):
-                commonVertices.append(i)
-    if len(commonVertices) > 2:
-        raise Exception('Too many common vertices')
-    return commonVertices[0], commonVertices[1]
+# v1, v2: arrays of points (nrPoints x 2 or 3)
+def distance2DArray(v1, v2):
+    dx = np.fabs(v1[:, 0] - v2[:, 0])
+    dy = np.fabs(v1[:, 1] - v2[:, 1])
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def distance3DArray(v1, v2):
+    dx = np.fabs(v1[:, 0] - v2[:, 0])
+    dy = np.fabs(v1[:, 1] - v2[:, 1])
+    dz = np.fabs(v1[:, 2] - v2[:, 2])
+    return np.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+# -----------------------------------------------------------
+# spatial index: the rectangles are a regular grid (rows along the x axis),
+# the column and the row of a point are found on the limits of the axes
+# -----------------------------------------------------------
+def buildSpatialIndex():
+    global spatialIndex
+    spatialIndex = CSpatialIndex()
+    nrRectanglesInXAxis = C3DStructure.nrRectanglesInXAxis
+    columns = C3DRM.v[:nrRectanglesInXAxis]
+    rows = C3DRM.v[::nrRectanglesInXAxis]
+    spatialIndex.xLower = columns[:, 0, 0].copy()
+    spatialIndex.xUpper = columns[:, 1, 0].copy()
+    spatialIndex.yLower = rows[:, 1, 1].copy()
+    spatialIndex.yUpper = rows[:, 2, 1].copy()
+
+
+# first i with lower[i] <= value < upper[i] (increasing limits), NODATA if missing
+def getAxisIndices(values, lower, upper):
+    first = np.searchsorted(upper, values, side="right")
+    last = np.searchsorted(lower, values, side="right") - 1
+    return np.where(first <= last, first, int(NODATA))
+
+
+def getAxisIndex(value, lower, upper):
+    first = bisect_right(upper, value)
+    last = bisect_right(lower, value) - 1
+    return first if first <= last else NODATA
+
+
+# the layers are set after the mesh: the limits are updated when soil.depth changes
+def getLayerLimits():
+    if spatialIndex.layerDepth is not soil.depth or len(spatialIndex.layerTop) != C3DStructure.nrLayers:
+        depth = np.asarray(soil.depth[:C3DStructure.nrLayers], np.float64)
+        thickness = np.asarray(soil.thickness[:C3DStructure.nrLayers], np.float64)
+        spatialIndex.layerTop = depth - (thickness * 0.5)
+        spatialIndex.layerBottom = depth + (thickness * 0.5)
+        spatialIndex.layerDepth = soil.depth
+    return spatialIndex.layerTop, spatialIndex.layerBottom
+
+
+# first layer with top < depth <= bottom, NODATA if missing
+def getLayerIndices(depths):
+    top, bottom = getLayerLimits()
+    depths = np.asarray(depths, np.float64)
+    layers = np.searchsorted(bottom, depths, side="left")
+    isInside = layers < C3DStructure.nrLayers
+    isInside[isInside] = top[layers[isInside]] < depths[isInside]
+    return np.where(isInside, layers, int(NODATA))
+
+
+def getLayerIndex(depth):
+    top, bottom = getLayerLimits()
+    layer = bisect_left(bottom, depth)
+    if layer < C3DStructure.nrLayers and top[layer] < depth:
+        return layer
+    return NODATA
 
 
-def getAdjacentSide(i, j):
-    rectangle1 = C3DRM[i]
-    rectangle2 = C3DRM[j]
-    v1, v2 = getAdjacentVertices(rectangle1, rectangle2)
-    return distance2D(v1, v2)
+def getSurfaceIndices(x, y):
+    columns = getAxisIndices(x, spatialIndex.xLower, spatialIndex.xUpper)
+    rows = getAxisIndices(y, spatialIndex.yLower, spatialIndex.yUpper)
+    isInside = (columns != NODATA) & (rows != NODATA)
+    return np.where(isInside, rows * C3DStructure.nrRectanglesInXAxis + columns, int(NODATA))
 
 
-def isInsideRectangle(x, y, rectangle):
-    if rectangle.v[0][0] <= x < rectangle.v[1][0] \
-       and rectangle.v[1][1] <= y < rectangle.v[2][1]:
-        return True
-    else:
-        return False
+def getCellIndices(x, y, depth):
+    surfaceIndices = getSurfaceIndices(x, y)
+    layers = getLayerIndices(depth)
+    isInside = (surfaceIndices != NODATA) & (layers != NODATA)
+    return np.where(isInside, surfaceIndices + C3DStructure.nrRectangles * layers, int(NODATA))
 
 
 def getSurfaceIndex(x, y):
-    # search index
-    for index in range(C3DStructure.nrRectangles):
-        if isInsideRectangle(x, y, C3DRM[index]):
-            return index
-    return NODATA
+    column = getAxisIndex(x, spatialIndex.xLower, spatialIndex.xUpper)
+    row = getAxisIndex(y, spatialIndex.yLower, spatialIndex.yUpper)
+    if column == NODATA or row == NODATA:
+        return NODATA
+    return row * C3DStructure.nrRectanglesInXAxis + column
 
 
 def getCellIndex(x, y, depth):
     surfaceIndex = getSurfaceIndex(x, y)
     if surfaceIndex != NODATA:
-        for layer in range(C3DStructure.nrLayers):
-            top = soil.depth[layer] - (soil.thickness[layer] * 0.5)
-            bottom = soil.depth[layer] + (soil.thickness[layer] * 0.5)
-            if top < depth <= bottom:
-                index = surfaceIndex + C3DStructure.nrRectangles * layer
-                return index
+        layer = getLayerIndex(depth)
+        if layer != NODATA:
+            return surfaceIndex + C3DStructure.nrRectangles * layer
     return NODATA
 
 
+# the surface cell of a column has the same index of its rectangle
 def getXYDepth(index):
-    x = C3DCells[index].x
-    y = C3DCells[index].y
-    surfaceIndex = getSurfaceIndex(x, y)
-    depth = C3DCells[surfaceIndex].z - C3DCells[index].z
+    x = C3DCells.x[index]
+    y = C3DCells.y[index]
+    surfaceIndex = index % C3DStructure.nrRectangles
+    depth = C3DCells.z[surfaceIndex] - C3DCells.z[index]
     return x, y, depth
+
+
+def getXYDepthArray(indices):
+    indices = np.asarray(indices, np.int64)
+    surfaceIndices = indices % C3DStructure.nrRectangles
+    depth = C3DCells.z[surfaceIndices] - C3DCells.z[indices]
+    return C3DCells.x[indices], C3DCells.y[indices], depth
@@ -0,0 +1,226 @@
+# simulation.py
+# ---------------------------------------------------------
+# This module is part of the CRITERIA3D_LAB distribution
+# https://github.com/ARPA-SIMC/CRITERIA3D_LAB
+# ---------------------------------------------------------
+#
+# Simulation: context object that owns the state of one simulation
+# (structure, parameters, mesh, soil, cells, crop, solver arrays,
+# water balance and export settings).
+# The model modules keep working on their globals: activate() installs
+# the state of the simulation in the modules and deactivate() takes it back.
+# Only one simulation at a time is active (the others wait on a lock),
+# so many simulations can live in one process or in a thread pool.
+#
+# with Simulation() as sim:  ...   or   sim.load(...), sim.run(...)
+# the default state is the one of the modules when this module is imported
+
+import copy
+import threading
+import numpy as np
+
+from dataStructures import *
+import soil
+import rectangularMesh
+import waterBalance
+import crop
+import exportUtils
+import criteria3D
+import boundaryConditions
+
+if CYTHON:
+    import solverC
+
+# module variables owned by a simulation
+MODULE_STATE = {
+    soil: ["depth", "thickness", "horizons", "horizonArrays", "hydraulicTables"],
+    rectangularMesh: ["header", "C3DRM", "spatialIndex"],
+    waterBalance: ["totalTime", "currentPrec", "currentIrr", "MBRMultiply", "maxCourant", "bestMBR",
+                   "nrMBRWrong", "forceExit", "nrAcceptedSteps", "nrRejectedSteps", "nrApproximations",
+                   "nrSurfaceSteps", "controller", "currentStep", "previousStep", "allSimulation", "cellStorage",
+                   "previousCellStorage", "cellMBE", "surfaceCells", "subSurfaceCells", "cellThetaR",
+                   "cellThetaRange"],
+    crop: ["currentCrop", "rootDensity", "k_root", "maxRootFactor", "x", "y",
+           "nrEvapLayers", "evapCoefficient", "evapWeight"],
+    exportUtils: ["outputIndices", "outputSurfaceIndices", "outputFileWP", "outputFileWC",
+                  "outputFileBalance", "outputFileFields", "outputColumns", "heightSlice", "oneTimestampPerRow", "writerWP", "writerWC",
+                  "fieldStoreWriter"],
+    criteria3D: ["isRedraw"],
+    boundaryConditions: ["runoffCells", "lateralDrainageCells", "freeDrainageCells", "prescribedPotentialCells",
+                         "boundaryCells", "surfaceBoundaryCells", "splitRunoffFlow"],
+}
+
+# solver arrays: scratch buffers, not included in the state saved by load()
+SOLVER_STATE = ["A", "C", "x", "b", "D", "indices", "isColored", "solverArrays"]
+
+# classes with model state in class attributes
+CLASS_STATE = [C3DStructure, C3DParameters]
+
+# objects shared with 'from dataStructures import *': their content is swapped
+OBJECT_STATE = [C3DCells, C3DLinks]
+LIST_STATE = [dripperIndices, plantIndices]
+
+MISSING = object()
+stateLock = threading.RLock()
+
+
+def getState(isSolver=True):
+    state = {"modules": {}, "classes": {}, "objects": {}, "lists": {}}
+    for module, names in MODULE_STATE.items():
+        state["modules"][module.__name__] = {name: getattr(module, name, MISSING) for name in names}
+    if isSolver:
+        state["solver"] = {name: getattr(criteria3D.solver, name, MISSING) for name in SOLVER_STATE}
+    for cls in CLASS_STATE:
+        state["classes"][cls.__name__] = {name: value for name, value in vars(cls).items()
+                                          if not name.startswith("__")}
+    for i, obj in enumerate(OBJECT_STATE):
+        state["objects"][i] = dict(vars(obj))
+    for i, values in enumerate(LIST_STATE):
+        state["lists"][i] = list(values)
+    return state
+
+
+def setState(state):
+    for module, names in MODULE_STATE.items():
+        for name, value in state["modules"][module.__name__].items():
+            setModuleValue(module, name, value)
+    if "solver" in state:
+        for name, value in state["solver"].items():
+            setModuleValue(criteria3D.solver, name, value)
+        if CYTHON:
+            solverC.selectArrays(criteria3D.solver.solverArrays)
+    for cls in CLASS_STATE:
+        values = state["classes"][cls.__name__]
+        for name in [name for name in vars(cls) if not name.startswith("__") and name not in values]:
+            delattr(cls, name)
+        for name, value in values.items():
+            setattr(cls, name, value)
+    for i, obj in enumerate(OBJECT_STATE):
+        vars(obj).clear()
+        vars(obj).update(state["objects"][i])
+    for i, values in enumerate(LIST_STATE):
+        values[:] = state["lists"][i]
+
+
+def setModuleValue(module, name, value):
+    if value is MISSING:
+        if hasattr(module, name):
+            delattr(module, name)
+    else:
+        setattr(module, name, value)
+
+
+# new (empty) objects for a new simulation
+def getNewState():
+    state = copy.deepcopy(defaultState)
+    state["objects"] = {i: dict(vars(type(obj)())) for i, obj in enumerate(OBJECT_STATE)}
+    state["lists"] = {i: [] for i in range(len(LIST_STATE))}
+
+    state["solver"] = {}
+    for name in SOLVER_STATE:
+        value = getattr(criteria3D.solver, name, MISSING)
+        if isinstance(value, np.ndarray):
+            value = np.zeros((0,) * value.ndim, value.dtype)
+        elif value is not MISSING:
+            value = None
+        state["solver"][name] = value
+    return state
+
+
+defaultState = getState(isSolver=False)
+
+
+class Simulation:
+    def __init__(self):
+        self.state = getNewState()
+        self.initialState = None
+        self.outerState = None
+        self.project = None
+        self.isActive = False
+        self.isClosed = False
+
+    def activate(self):
+        if self.isClosed:
+            raise RuntimeError("the simulation is closed")
+        stateLock.acquire()
+        if self.isActive:
+            stateLock.release()
+            raise RuntimeError("the simulation is already active")
+        self.outerState = getState()
+        setState(self.state)
+        # the modules own the state while it is active
+        self.state = None
+        self.isActive = True
+
+    def deactivate(self):
+        if not self.isActive:
+            return
+        self.state = getState()
+        setState(self.outerState)
+        self.outerState = None
+        self.isActive = False
+        stateLock.release()
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.deactivate()
+        return False
+
+    # -----------------------------------------------------------
+    # read project data (see main.loadProject), without visualization
+    # the state after loading is saved: reset() restarts from it
+    # -----------------------------------------------------------
+    def load(self, projectPath, parameters=None, soilFileName="", weatherFolder="", outputFolder=""):
+        import main
+        parameters = dict(parameters) if parameters is not None else {}
+        parameters["isVisual"] = False
+        with self:
+            self.project = main.loadProject(projectPath, parameters, soilFileName, weatherFolder, outputFolder)
+            if self.project is None:
+                return False
+            self.initialState = copy.deepcopy(getState(isSolver=False))
+        return True
+
+    def run(self, nrHours=NODATA, restartFileName=""):
+        import main
+        if self.project is None:
+            raise RuntimeError("the project is not loaded")
+        with self:
+            return main.runProject(self.project, nrHours, restartFileName)
+
+    # back to the state after load(), without reading files
+    def reset(self):
+        if self.initialState is None:
+            raise RuntimeError("the project is not loaded")
+        with self:
+            setState(copy.deepcopy(self.initialState))
+
+    # [m3] water balance of the simulation
+    def getWaterBalance(self):
+        with self:
+            return {"waterStorage": waterBalance.currentStep.waterStorage,
+                    "initialStorage": waterBalance.allSimulation.waterStorage,
+                    "waterFlow": waterBalance.allSimulation.waterFlow,
+                    "MBE": waterBalance.allSimulation.MBE}
+
+    # free the solver arrays and the state
+    def close(self):
+        if self.isClosed:
+            return
+        if self.isActive:
+            self.deactivate()
+        with stateLock:
+            solverArrays = self.state["solver"].get("solverArrays", MISSING) if "solver" in self.state else MISSING
+            if CYTHON and solverArrays is not MISSING and solverArrays is not None:
+                solverArrays.free()
+            for name in ["writerWP", "writerWC", "fieldStoreWriter"]:
+                writer = self.state["modules"]["exportUtils"][name]
+                if writer is not MISSING and writer is not None:
+                    writer.close()
+            self.state = None
+            self.initialState = None
+            self.project = None
+            self.isClosed = True
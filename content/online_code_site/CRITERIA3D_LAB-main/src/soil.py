@@ -33,14 +33,37 @@ class CSoilHorizon:
     HYGR = NODATA           # [m3 m-3] water content at Hygroscopic moisture content
 
 
+# horizon parameters stored as arrays (indexed by horizon)
+# used by the vectorized functions on whole cell arrays
+class CHorizonArrays:
+    def __init__(self, horizonList):
+        self.Campbell_he = np.array([h.Campbell_he for h in horizonList], np.float64)
+        self.Campbell_b = np.array([h.Campbell_b for h in horizonList], np.float64)
+        self.Campbell_n = np.array([h.Campbell_n for h in horizonList], np.float64)
+        self.VG_he = np.array([h.VG_he for h in horizonList], np.float64)
+        self.VG_alpha = np.array([h.VG_alpha for h in horizonList], np.float64)
+        self.VG_n = np.array([h.VG_n for h in horizonList], np.float64)
+        self.VG_m = np.array([h.VG_m for h in horizonList], np.float64)
+        self.VG_Sc = np.array([h.VG_Sc for h in horizonList], np.float64)
+        self.VG_thetaR = np.array([h.VG_thetaR for h in horizonList], np.float64)
+        self.Mualem_L = np.array([h.Mualem_L for h in horizonList], np.float64)
+        self.thetaS = np.array([h.thetaS for h in horizonList], np.float64)
+        self.Ks = np.array([h.Ks for h in horizonList], np.float64)
+        self.FC = np.array([h.FC for h in horizonList], np.float64)
+        self.WP = np.array([h.WP for h in horizonList], np.float64)
+        self.HYGR = np.array([h.HYGR for h in horizonList], np.float64)
+
+
 # global arrays
 depth = np.array([], np.float64)
 thickness = np.array([], np.float64)
 horizons = []
+horizonArrays = CHorizonArrays([])
+hydraulicTables = None
 
 
 def readHorizon(soilFileName):
-    global horizons
+    global horizons, horizonArrays, hydraulicTables
 
     horizons.clear()
     soilDataFrame = pd.read_csv(soilFileName)
@@ -92,6 +115,11 @@ def readHorizon(soilFileName):
 
         i += 1
 
+    horizonArrays = CHorizonArrays(horizons)
+    hydraulicTables = None
+    if C3DParameters.isLookupTable:
+        hydraulicTables = CHydraulicTables(C3DParameters.waterRetentionCurve, C3DParameters.lookupTableError)
+        print("Soil lookup tables - max relative error:", format(hydraulicTables.getMaxError(), ".2e"))
     return True
 
 
@@ -156,33 +184,84 @@ def getHorizonIndex(myDepth):
     return NODATA
 
 
+def getHorizonIndexArray(depths):
+    depths = np.asarray(depths, np.float64)
+    indices = np.full(len(depths), int(NODATA), np.int64)
+    # the first horizon is assigned last
+    for i in reversed(range(len(horizons))):
+        indices[(horizons[i].upperDepth <= depths) & (depths <= horizons[i].lowerDepth)] = i
+    return indices
+
+
 def getVolumetricWaterContent(i):
-    if C3DCells[i].isSurface:
+    if C3DCells.isSurface[i]:
         return NODATA
     curve = C3DParameters.waterRetentionCurve
-    Se = C3DCells[i].Se
-    index = C3DCells[i].horizonIndex
+    Se = C3DCells.Se[i]
+    index = C3DCells.horizonIndex[i]
     return waterContent(curve, Se, horizons[index])
 
 
 def getDegreeOfSaturation(i):
-    if C3DCells[i].isSurface:
-        if C3DCells[i].H > C3DCells[i].z:
+    if C3DCells.isSurface[i]:
+        if C3DCells.H[i] > C3DCells.z[i]:
             return 1.0
         else:
             return 0.0
     curve = C3DParameters.waterRetentionCurve
-    index = C3DCells[i].horizonIndex
-    signPsi = C3DCells[i].H - C3DCells[i].z
+    index = C3DCells.horizonIndex[i]
+    signPsi = C3DCells.H[i] - C3DCells.z[i]
     return degreeOfSaturation(curve, signPsi, horizons[index])
 
 
 def getHydraulicConductivity(i):
-    if C3DCells[i].isSurface:
+    if C3DCells.isSurface[i]:
         return NODATA
     curve = C3DParameters.waterRetentionCurve
-    index = C3DCells[i].horizonIndex
-    return hydraulicConductivity(curve, C3DCells[i].Se, horizons[index])
+    index = C3DCells.horizonIndex[i]
+    return hydraulicConductivity(curve, C3DCells.Se[i], horizons[index])
+
+
+# -----------------------------------------------------------
+# vectorized versions of the cell functions
+# cellIndices     array of indices of sub-surface cells
+# -----------------------------------------------------------
+def getVolumetricWaterContentArray(cellIndices):
+    curve = C3DParameters.waterRetentionCurve
+    Se = C3DCells.Se[cellIndices]
+    return waterContentArray(curve, Se, C3DCells.horizonIndex[cellIndices])
+
+
+def getDegreeOfSaturationArray(cellIndices):
+    curve = C3DParameters.waterRetentionCurve
+    signPsi = C3DCells.H[cellIndices] - C3DCells.z[cellIndices]
+    return degreeOfSaturationArray(curve, signPsi, C3DCells.horizonIndex[cellIndices])
+
+
+def getHydraulicConductivityArray(cellIndices):
+    curve = C3DParameters.waterRetentionCurve
+    Se = C3DCells.Se[cellIndices]
+    return hydraulicConductivityArray(curve, Se, C3DCells.horizonIndex[cellIndices])
+
+
+def get_dTheta_dHArray(cellIndices):
+    curve = C3DParameters.waterRetentionCurve
+    return dTheta_dHArray(curve, C3DCells.H0[cellIndices], C3DCells.H[cellIndices],
+                          C3DCells.z[cellIndices], C3DCells.horizonIndex[cellIndices])
+
+
+# [m^-1] derivative of theta at the current potential (tangent)
+def get_dTheta_dPsiArray(cellIndices):
+    curve = C3DParameters.waterRetentionCurve
+    signPsi = C3DCells.H[cellIndices] - C3DCells.z[cellIndices]
+    return dTheta_dPsiArray(curve, signPsi, C3DCells.horizonIndex[cellIndices])
+
+
+# [s^-1] derivative of the hydraulic conductivity with respect to H
+def get_dK_dHArray(cellIndices):
+    curve = C3DParameters.waterRetentionCurve
+    signPsi = C3DCells.H[cellIndices] - C3DCells.z[cellIndices]
+    return dK_dPsiArray(curve, signPsi, C3DCells.horizonIndex[cellIndices])
 
 
 # [m] air entry potential with sign
@@ -279,11 +358,11 @@ def dTheta_dPsi(curve, signPsi, horizon):
 
 
 def get_dTheta_dH(i):
-    if C3DCells[i].isSurface:
+    if C3DCells.isSurface[i]:
         return NODATA
     curve = C3DParameters.waterRetentionCurve
-    index = C3DCells[i].horizonIndex
-    return dTheta_dH(curve, C3DCells[i].H0, C3DCells[i].H, C3DCells[i].z, horizons[index])
+    index = C3DCells.horizonIndex[i]
+    return dTheta_dH(curve, C3DCells.H0[i], C3DCells.H[i], C3DCells.z[i], horizons[index])
 
 
 def dTheta_dH(curve, H0, H1, z, horizon):
@@ -297,6 +376,169 @@ def dTheta_dH(curve, H0, H1, z, horizon):
         return (theta1 - theta0) / (psi1 - psi0)
 
 
+# -----------------------------------------------------------
+# vectorized water retention and conductivity functions
+# values          array of psi [m] or Se [-]
+# horizonIndex    array of horizon indices (same size)
+# -----------------------------------------------------------
+def airEntryPotentialArray(curve, horizonIndex):
+    if curve == CAMPBELL:
+        return -horizonArrays.Campbell_he[horizonIndex]
+    elif curve == IPPISCH_VG:
+        return -horizonArrays.VG_he[horizonIndex]
+    else:
+        return np.full(len(horizonIndex), NODATA)
+
+
+def waterPotentialArray(curve, Se, horizonIndex):
+    h = horizonArrays
+    if curve == CAMPBELL:
+        return -h.Campbell_he[horizonIndex] * Se ** (-h.Campbell_b[horizonIndex])
+    elif curve == IPPISCH_VG:
+        alpha = h.VG_alpha[horizonIndex]
+        n = h.VG_n[horizonIndex]
+        m = h.VG_m[horizonIndex]
+        Sc = h.VG_Sc[horizonIndex]
+        return -(1. / alpha) * ((1. / (Se * Sc)) ** (1. / m) - 1.) ** (1. / n)
+    else:
+        return np.full(len(Se), NODATA)
+
+
+def waterContentArray(curve, Se, horizonIndex):
+    h = horizonArrays
+    if curve == CAMPBELL:
+        return Se * h.thetaS[horizonIndex]
+    elif curve == IPPISCH_VG:
+        thetaR = h.VG_thetaR[horizonIndex]
+        return Se * (h.thetaS[horizonIndex] - thetaR) + thetaR
+    else:
+        return np.full(len(Se), NODATA)
+
+
+def degreeOfSaturationArray(curve, signPsi, horizonIndex):
+    if hydraulicTables is not None and hydraulicTables.curve == curve:
+        return hydraulicTables.degreeOfSaturation(signPsi, horizonIndex)
+    h = horizonArrays
+    Se = np.ones(len(signPsi), np.float64)
+    isUnsaturated = signPsi < airEntryPotentialArray(curve, horizonIndex)
+    psi = np.fabs(signPsi[isUnsaturated])
+    index = horizonIndex[isUnsaturated]
+    if curve == CAMPBELL:
+        Se[isUnsaturated] = (psi / np.fabs(h.Campbell_he[index])) ** (-1. / h.Campbell_b[index])
+    elif curve == IPPISCH_VG:
+        Se[isUnsaturated] = (1. / h.VG_Sc[index]) * (1. + (h.VG_alpha[index] * psi)
+                                                      ** h.VG_n[index]) ** (-h.VG_m[index])
+    else:
+        Se[isUnsaturated] = NODATA
+    return Se
+
+
+def hydraulicConductivityArray(curve, Se, horizonIndex):
+    if hydraulicTables is not None and hydraulicTables.curve == curve:
+        return hydraulicTables.hydraulicConductivity(Se, horizonIndex)
+    h = horizonArrays
+    Ks = h.Ks[horizonIndex]
+    if curve == CAMPBELL:
+        he = h.Campbell_he[horizonIndex]
+        psi = he * Se ** (-h.Campbell_b[horizonIndex])
+        return Ks * (he / psi) ** h.Campbell_n[horizonIndex]
+    elif curve == IPPISCH_VG:
+        m = h.VG_m[horizonIndex]
+        Sc = h.VG_Sc[horizonIndex]
+        num = 1. - (1. - (Se * Sc) ** (1. / m)) ** m
+        den = 1. - (1. - Sc ** (1. / m)) ** m
+        return Ks * Se ** h.Mualem_L[horizonIndex] * (num / den) ** 2.
+    else:
+        return np.full(len(Se), NODATA)
+
+
+def thetaFromPsiArray(curve, signPsi, horizonIndex):
+    Se = degreeOfSaturationArray(curve, signPsi, horizonIndex)
+    return waterContentArray(curve, Se, horizonIndex)
+
+
+def SeFromThetaArray(curve, theta, horizonIndex):
+    h = horizonArrays
+    thetaS = h.thetaS[horizonIndex]
+    if curve == CAMPBELL:
+        Se = theta / thetaS
+    elif curve == IPPISCH_VG:
+        thetaR = h.VG_thetaR[horizonIndex]
+        Se = (theta - thetaR) / (thetaS - thetaR)
+    else:
+        return np.full(len(theta), NODATA)
+    return np.where(theta >= thetaS, 1., Se)
+
+
+def psiFromThetaArray(curve, theta, horizonIndex):
+    Se = SeFromThetaArray(curve, theta, horizonIndex)
+    return waterPotentialArray(curve, Se, horizonIndex)
+
+
+def dTheta_dPsiArray(curve, signPsi, horizonIndex):
+    if hydraulicTables is not None and hydraulicTables.curve == curve:
+        return hydraulicTables.dTheta_dPsi(signPsi, horizonIndex)
+    h = horizonArrays
+    dTheta = np.zeros(len(signPsi), np.float64)
+    isUnsaturated = signPsi <= airEntryPotentialArray(curve, horizonIndex)
+    psi = signPsi[isUnsaturated]
+    index = horizonIndex[isUnsaturated]
+    if curve == CAMPBELL:
+        theta = h.thetaS[index] * degreeOfSaturationArray(curve, psi, index)
+        dTheta[isUnsaturated] = -theta / (h.Campbell_b[index] * psi)
+    elif curve == IPPISCH_VG:
+        alpha = h.VG_alpha[index]
+        n = h.VG_n[index]
+        m = h.VG_m[index]
+        dSe_dPsi = alpha * n * (m * (1. + (alpha * np.fabs(psi)) ** n) ** (-(m + 1.))
+                                * (alpha * np.fabs(psi)) ** (n - 1.))
+        dSe_dPsi *= (1. / h.VG_Sc[index])
+        dTheta[isUnsaturated] = dSe_dPsi * (h.thetaS[index] - h.VG_thetaR[index])
+    return dTheta
+
+
+def dTheta_dHArray(curve, H0, H1, z, horizonIndex):
+    psi0 = H0 - z
+    psi1 = H1 - z
+    dTheta = np.empty(len(psi0), np.float64)
+    isSmall = np.fabs(psi1 - psi0) < EPSILON_METER
+    dTheta[isSmall] = dTheta_dPsiArray(curve, psi0[isSmall], horizonIndex[isSmall])
+
+    isSecant = ~isSmall
+    index = horizonIndex[isSecant]
+    theta0 = thetaFromPsiArray(curve, psi0[isSecant], index)
+    theta1 = thetaFromPsiArray(curve, psi1[isSecant], index)
+    dTheta[isSecant] = (theta1 - theta0) / (psi1[isSecant] - psi0[isSecant])
+    return dTheta
+
+
+# [s^-1] derivative of the hydraulic conductivity with respect to signPsi
+# dK/dSe * dSe/dPsi (zero when saturated)
+def dK_dPsiArray(curve, signPsi, horizonIndex):
+    h = horizonArrays
+    Se = degreeOfSaturationArray(curve, signPsi, horizonIndex)
+    dTheta = dTheta_dPsiArray(curve, signPsi, horizonIndex)
+    Ks = h.Ks[horizonIndex]
+    if curve == CAMPBELL:
+        # K = Ks * Se^(b*n)
+        bn = h.Campbell_b[horizonIndex] * h.Campbell_n[horizonIndex]
+        dK_dSe = Ks * bn * Se ** (bn - 1.)
+        dSe_dPsi = dTheta / h.thetaS[horizonIndex]
+    elif curve == IPPISCH_VG:
+        m = h.VG_m[horizonIndex]
+        Sc = h.VG_Sc[horizonIndex]
+        L = h.Mualem_L[horizonIndex]
+        u = (Se * Sc) ** (1. / m)
+        den = 1. - (1. - Sc ** (1. / m)) ** m
+        f = (1. - (1. - u) ** m) / den
+        df_dSe = ((1. - u) ** (m - 1.) * u / Se) / den
+        dK_dSe = Ks * (L * Se ** (L - 1.) * f ** 2. + 2. * Se ** L * f * df_dSe)
+        dSe_dPsi = dTheta / (h.thetaS[horizonIndex] - h.VG_thetaR[horizonIndex])
+    else:
+        return np.zeros(len(signPsi))
+    return dK_dSe * dSe_dPsi
+
+
 def meanK(meanType, k1, k2):
     k = NODATA
     if meanType == LOGARITHMIC:
@@ -311,6 +553,130 @@ def meanK(meanType, k1, k2):
     return k
 
 
+def meanKArray(meanType, k1, k2):
+    if meanType == LOGARITHMIC:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = (k1 - k2) / np.log(k1 / k2)
+        return np.where(k1 != k2, k, k1)
+    elif meanType == HARMONIC:
+        return 2.0 / (1.0 / k1 + 1.0 / k2)
+    elif meanType == GEOMETRIC:
+        return np.sqrt(k1 * k2)
+    return np.full(np.shape(k1), NODATA)
+
+
+# derivative of the mean conductivity with respect to k1
+def dMeanK_dk1Array(meanType, k1, k2):
+    if meanType == LOGARITHMIC:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logRatio = np.log(k1 / k2)
+            dk = 1. / logRatio - (k1 - k2) / (k1 * logRatio ** 2)
+        return np.where(np.fabs(logRatio) > 1E-6, dk, 0.5)
+    elif meanType == HARMONIC:
+        k = 2.0 / (1.0 / k1 + 1.0 / k2)
+        return k ** 2 / (2.0 * k1 ** 2)
+    elif meanType == GEOMETRIC:
+        return 0.5 * np.sqrt(k2 / k1)
+    return np.zeros(np.shape(k1))
+
+
+# -----------------------------------------------------------
+# lookup table of a function y(x) for each horizon:
+# y is linear in log(x) between the nodes (log-spaced),
+# the nodes are doubled until the relative error is < maxError
+# function(x, horizonIndex)    analytic function (arrays)
+# xMin, xMax                   table range for each horizon
+# outside the range: value at the range limit
+# -----------------------------------------------------------
+class CHydraulicTable:
+    def __init__(self, function, xMin, xMax, maxError):
+        nrHorizons = len(xMin)
+        logMin = np.log(xMin)
+        logMax = np.log(xMax)
+        nrPoints = 65
+        while True:
+            self.nrPoints = nrPoints
+            step = (logMax - logMin) / (nrPoints - 1)
+            x = np.exp(logMin[:, np.newaxis] + step[:, np.newaxis] * np.arange(nrPoints))
+            x[:, 0] = xMin
+            x[:, -1] = xMax
+            y = function(x.ravel(), np.repeat(np.arange(nrHorizons), nrPoints)).reshape(nrHorizons, nrPoints)
+
+            # position = log(x) * scale - start  (node index)
+            self.scale = 1. / step
+            self.start = logMin / step
+            self.offset = np.arange(nrHorizons) * nrPoints
+            # y = intercept + slope * position  (for each interval, the last one is repeated)
+            slope = np.diff(y, axis=1)
+            slope = np.concatenate([slope, slope[:, -1:]], axis=1)
+            self.slope = slope.ravel()
+            self.intercept = (y - slope * np.arange(nrPoints)).ravel()
+
+            # check inside the intervals
+            position = (np.arange(nrPoints - 1)[:, np.newaxis] + np.array([0.25, 0.5, 0.75])).ravel()
+            logX = (logMin[:, np.newaxis] + step[:, np.newaxis] * position).ravel()
+            index = np.repeat(np.arange(nrHorizons), len(position))
+            y = function(np.exp(logX), index)
+            isValid = y != 0
+            error = np.fabs(self.interpolate(logX, index)[isValid] / y[isValid] - 1.)
+            self.maxError = float(np.max(error)) if len(error) > 0 else 0.
+            if self.maxError <= maxError or nrPoints >= TABLE_MAX_POINTS:
+                break
+            nrPoints = nrPoints * 2 - 1
+
+    # belowValue: value for x < xMin (default: value at xMin)
+    def interpolate(self, logX, horizonIndex, belowValue=None):
+        position = logX * self.scale[horizonIndex] - self.start[horizonIndex]
+        isBelow = position < 0. if belowValue is not None else None
+        np.clip(position, 0., self.nrPoints - 1., out=position)
+        i = position.astype(np.int64)
+        i += self.offset[horizonIndex]
+        y = self.intercept[i] + self.slope[i] * position
+        if belowValue is not None:
+            y[isBelow] = belowValue
+        return y
+
+
+# -----------------------------------------------------------
+# tabulated Se(psi), K(Se) and dTheta/dPsi(psi) of the horizons
+# (C3DParameters.isLookupTable), used by the vectorized functions
+# range: from the air entry potential to TABLE_PSI_MAX
+# -----------------------------------------------------------
+class CHydraulicTables:
+    def __init__(self, curve, maxError):
+        self.curve = curve
+        horizonIndex = np.arange(len(horizonArrays.Ks))
+        airEntry = np.fabs(airEntryPotentialArray(curve, horizonIndex))
+        psiMax = np.maximum(np.full(len(horizonIndex), TABLE_PSI_MAX), airEntry * 10.)
+        SeMin = degreeOfSaturationArray(curve, -psiMax, horizonIndex)
+
+        self.Se = CHydraulicTable(lambda psi, index: degreeOfSaturationArray(curve, -psi, index),
+                                  airEntry, psiMax, maxError)
+        self.dTheta = CHydraulicTable(lambda psi, index: dTheta_dPsiArray(curve, -psi, index),
+                                      airEntry, psiMax, maxError)
+        self.k = CHydraulicTable(lambda Se, index: hydraulicConductivityArray(curve, Se, index),
+                                 SeMin, np.ones(len(horizonIndex)), maxError)
+
+    def getMaxError(self):
+        return max(self.Se.maxError, self.dTheta.maxError, self.k.maxError)
+
+    # saturated cells: |psi| < air entry (Se = 1)
+    def degreeOfSaturation(self, signPsi, horizonIndex):
+        return self.Se.interpolate(logPsiArray(signPsi), horizonIndex)
+
+    def hydraulicConductivity(self, Se, horizonIndex):
+        return self.k.interpolate(np.log(Se), horizonIndex)
+
+    def dTheta_dPsi(self, signPsi, horizonIndex):
+        return self.dTheta.interpolate(logPsiArray(signPsi), horizonIndex, belowValue=0.)
+
+
+# log of the absolute value of the water potential (-inf if psi >= 0)
+def logPsiArray(signPsi):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log(np.maximum(-signPsi, 0.))
+
+
 # [m3 m-3] water content at field capacity
 def getFieldCapacityWC(horizon):
     curve = C3DParameters.waterRetentionCurve
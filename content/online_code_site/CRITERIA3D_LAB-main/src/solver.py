@@ -7,22 +7,26 @@
 from math import fabs
 import numpy as np
 from dataStructures import *
-from waterProcesses import runoff, infiltration, redistribution
+from waterProcesses import linkConductances
 import boundaryConditions
 import waterBalance
+import linearSolver
+import newtonSolver
 import soil
 
 A = np.array([[], []], np.float64)
 C = np.array([], np.float64)
 x = np.array([], np.float64)
 b = np.array([], np.float64)
+D = np.array([], np.float64)
 indices = np.array([[], []], int)
 
 
 def setCriteria3DArrays(nrCells, nrLinks):
-    global x, b, C, A, indices
+    global x, b, C, D, A, indices
     x.resize(nrCells)
     b.resize(nrCells)
+    D.resize(nrCells)
     C.resize(nrCells)
     A.resize((nrCells, nrLinks))
     indices.resize((nrCells, nrLinks))
@@ -30,71 +34,52 @@ def setCriteria3DArrays(nrCells, nrLinks):
 
 def computeStep(deltaT):
     global x, C, indices
+    if C3DParameters.nonlinearSolver == NEWTON:
+        return newtonSolver.computeStep(deltaT, True)
+
     # initialize
     approximation = 1
     isValidStep = False
-    for i in range(C3DStructure.nrCells):
-        C3DCells[i].H0 = C3DCells[i].H
-        x[i] = C3DCells[i].H
-        if C3DCells[i].isSurface:
-            C[i] = C3DCells[i].area
+    C3DCells.H0[:] = C3DCells.H
+    x[:] = C3DCells.H
+    surfaceCells = np.flatnonzero(C3DCells.isSurface)
+    subSurfaceCells = np.flatnonzero(~C3DCells.isSurface)
+    C[surfaceCells] = C3DCells.area[surfaceCells]
 
     while (not isValidStep) and (approximation <= C3DParameters.maxApproximationsNr):
         isFirstApprox = (approximation == 1)
         waterBalance.maxCourant = 0.0
-        for i in range(C3DStructure.nrCells):
-            if not C3DCells[i].isSurface:
-                C3DCells[i].Se = soil.getDegreeOfSaturation(i)
-                C3DCells[i].k = soil.getHydraulicConductivity(i)
-                C[i] = C3DCells[i].volume * soil.get_dTheta_dH(i)
+        C3DCells.Se[subSurfaceCells] = soil.getDegreeOfSaturationArray(subSurfaceCells)
+        C3DCells.k[subSurfaceCells] = soil.getHydraulicConductivityArray(subSurfaceCells)
+        C[subSurfaceCells] = C3DCells.volume[subSurfaceCells] * soil.get_dTheta_dHArray(subSurfaceCells)
         boundaryConditions.updateBoundary(deltaT)
 
         # print("approximation nr:", approximation)
         # print("Sum flows (abs) [l]:", format(waterBalance.sumWaterFlow(deltaT, True) * 1000., ".5f"))
 
-        for i in range(C3DStructure.nrCells):
-            k = 0
-            if (newMatrixElement(i, C3DCells[i].upLink, k,
-                                 False, deltaT, isFirstApprox)):
-                k += 1
-            for link in range(C3DStructure.nrLateralLinks):
-                if (newMatrixElement(i, C3DCells[i].lateralLink[link], k,
-                                     True, deltaT, isFirstApprox)):
-                    k += 1
-            if (newMatrixElement(i, C3DCells[i].downLink, k,
-                                 False, deltaT, isFirstApprox)):
-                k += 1
-            if k < C3DStructure.nrMaxLinks:
-                indices[i][k] = NOLINK
-
-            arrangeMatrix(i, deltaT)
+        conductances = arrangeMatrix(deltaT, isFirstApprox)
 
         if (waterBalance.maxCourant > 1.0) and (deltaT > C3DParameters.deltaT_min):
             print("Courant too high:", waterBalance.maxCourant)
             print("Decrease time step")
-            while waterBalance.maxCourant > 1.0:
-                waterBalance.halveTimeStep()
-                waterBalance.maxCourant *= 0.5
+            waterBalance.controller.reduceCourant(deltaT, waterBalance.maxCourant)
             return False
 
         if not solveMatrix(approximation):
-            waterBalance.halveTimeStep()
+            waterBalance.controller.reduceNotConvergent(deltaT)
             print("System is not convergent.")
             return False
 
         # check surface error
-        for i in range(C3DStructure.nrRectangles):
-            if C3DCells[i].isSurface:
-                if x[i] < C3DCells[i].z:
-                    x[i] = C3DCells[i].z
+        x[surfaceCells] = np.maximum(x[surfaceCells], C3DCells.z[surfaceCells])
 
         # new hydraulic head
-        for i in range(0, C3DStructure.nrCells):
-            C3DCells[i].H = x[i]
-            C3DCells[i].Se = soil.getDegreeOfSaturation(i)
+        C3DCells.H[:] = x
+        C3DCells.Se[surfaceCells] = np.where(C3DCells.H[surfaceCells] > C3DCells.z[surfaceCells], 1.0, 0.0)
+        C3DCells.Se[subSurfaceCells] = soil.getDegreeOfSaturationArray(subSurfaceCells)
 
         # waterBalance
-        isValidStep = waterBalance.waterBalance(deltaT, approximation)
+        isValidStep = waterBalance.waterBalance(deltaT, approximation, conductances)
         if waterBalance.forceExit:
             return False
         approximation += 1
@@ -102,60 +87,44 @@ def computeStep(deltaT):
     return isValidStep
 
 
-def newMatrixElement(i, link, k, isLateral, deltaT, isFirstApprox):
-    global A, indices
-    j = link.index
-    if j == NOLINK:
-        return False
-
-    if C3DCells[i].isSurface:
-        if C3DCells[j].isSurface:
-            if C3DParameters.computeSurfaceFlow:
-                value = runoff(i, link, deltaT, isFirstApprox)
-            else:
-                value = 0.0
-        else:
-            value = infiltration(i, j, link, deltaT, isFirstApprox)
-    else:
-        if C3DCells[j].isSurface:
-            value = infiltration(j, i, link, deltaT, isFirstApprox)
-        else:
-            value = redistribution(i, link, isLateral)
-    if value == 0.0:
-        return False
-
-    indices[i][k] = j
-    A[i][k] = value
-    return True
-
-
-def arrangeMatrix(i, deltaT):
-    global b, C, A
-    mySum = 0.0
-    for j in range(C3DStructure.nrMaxLinks):
-        if indices[i][j] == NOLINK:
-            break
-        mySum += A[i][j]
-        A[i][j] *= -1.0
-
-    # diagonal and vector b     
-    D = (C[i] / deltaT) + mySum
-    b[i] = (C[i] / deltaT) * C3DCells[i].H0
-    if C3DCells[i].flow != NODATA:
-        b[i] += C3DCells[i].flow
+# -----------------------------------------------------------
+# the link conductances are computed in bulk on C3DLinks,
+# then each row of A keeps the non-zero values in the order
+# of the link columns (up, lateral, down)
+# return the link conductances (for the water balance)
+# -----------------------------------------------------------
+def arrangeMatrix(deltaT, isFirstApprox):
+    global A, b, D, indices
+    conductances = linkConductances(deltaT, isFirstApprox, True)
+    values = np.zeros((C3DStructure.nrCells, C3DStructure.nrMaxLinks), np.float64)
+    values[C3DLinks.i, C3DLinks.column] = conductances
+
+    # move the zero values at the end of the rows
+    isLink = values != 0.0
+    order = np.argsort(~isLink, axis=1, kind='stable')
+    values = np.take_along_axis(values, order, axis=1)
+    isLink = np.take_along_axis(isLink, order, axis=1)
+    linkIndex = np.take_along_axis(C3DCells.linkIndex, order, axis=1)
+
+    # diagonal and vector b
+    D[:] = (C / deltaT) + values.sum(axis=1)
+    b[:] = (C / deltaT) * C3DCells.H0
+    b += np.where(C3DCells.flow != NODATA, C3DCells.flow, 0.0)
 
     # matrix conditioning
-    b[i] /= D
-    for j in range(C3DStructure.nrMaxLinks):
-        if indices[i][j] == NOLINK:
-            break
-        A[i][j] /= D
+    b /= D
+    A[:] = -values / D[:, np.newaxis]
+    indices[:] = np.where(isLink, linkIndex, NOLINK)
+    return conductances
 
 
 def solveMatrix(approximation):
     ratio = (C3DParameters.maxIterationsNr / C3DParameters.maxApproximationsNr)
     maxIterationsNr = max(10, ratio * approximation)
 
+    if C3DParameters.linearSolver != GAUSS_SEIDEL:
+        return linearSolver.solveSparse(A, indices, b, D, x, int(maxIterationsNr))
+
     iteration = 0
     norm = 1000.
     bestNorm = norm
@@ -8,6 +8,8 @@
 # on windows you can use MinGW or VS compiler
 # compile with:
 # python cythonSetup.py build_ext --inplace
+# the multicolor Gauss-Seidel needs OpenMP (see cythonSetup.py),
+# without OpenMP it is compiled as a serial loop
 
 
 #!python
@@ -16,6 +18,7 @@
 
 from libc.stdlib cimport malloc, free
 from libc.math cimport fabs, sqrt, log
+from cython.parallel cimport prange
 
 cdef int LOGARITHMIC = 1
 cdef int HARMONIC = 2
@@ -25,44 +28,101 @@ cdef int NOLINK = -1
 
 cdef double *x
 cdef double *b
-cdef double *C
 cdef double *A 
 cdef int *indices
-cdef int nrCells
-cdef short int nrLinks 
-
+cdef int nrCells = 0
+cdef short int nrLinks = 0
+
+# multicolor Gauss-Seidel: cells sorted by color
+cdef int *colorCells
+cdef int *colorStart
+cdef int nrColors = 0
+cdef double *dx_buffer
+
+
+# -----------------------------------------------------------
+# arrays of the linear system of one simulation, freed with
+# free() or when the object is deleted
+# the functions of this module work on the selected arrays
+# -----------------------------------------------------------
+cdef class CSolverArrays:
+    cdef double *x
+    cdef double *b
+    cdef double *A
+    cdef double *dx_buffer
+    cdef int *indices
+    cdef int *colorCells
+    cdef int *colorStart
+    cdef int nrColors
+    cdef readonly int nrCells
+    cdef readonly short int nrLinks
+
+    def __cinit__(self, int nr_Cells, short nr_Links):
+        self.nrCells = nr_Cells
+        self.nrLinks = nr_Links
+        self.x = <double *>malloc(nr_Cells * sizeof(double))
+        self.b = <double *>malloc(nr_Cells * sizeof(double))
+        self.A = <double *>malloc(nr_Cells * nr_Links * sizeof(double))
+        self.indices = <int *>malloc(nr_Cells * nr_Links * sizeof(int))
+        self.dx_buffer = <double *>malloc(nr_Cells * sizeof(double))
+        self.colorCells = <int *>malloc(nr_Cells * sizeof(int))
+        self.colorStart = NULL
+        self.nrColors = 0
+
+    def __dealloc__(self):
+        self.release()
+
+    cdef void release(self):
+        free(self.x)
+        free(self.b)
+        free(self.A)
+        free(self.indices)
+        free(self.dx_buffer)
+        free(self.colorCells)
+        free(self.colorStart)
+        self.x = self.b = self.A = self.dx_buffer = NULL
+        self.indices = self.colorCells = self.colorStart = NULL
+        self.nrCells = 0
+        self.nrColors = 0
+
+    def free(self):
+        if currentArrays is self:
+            selectArrays(None)
+        self.release()
+
+
+cdef CSolverArrays currentArrays = None
+
+def selectArrays(CSolverArrays arrays):
+    global currentArrays, nrCells, nrLinks, x, b, A, indices, nrColors, colorCells, colorStart, dx_buffer
+    currentArrays = arrays
+    if arrays is None:
+        nrCells = 0
+        nrLinks = 0
+        nrColors = 0
+        x = b = A = dx_buffer = NULL
+        indices = colorCells = colorStart = NULL
+        return
+    nrCells = arrays.nrCells
+    nrLinks = arrays.nrLinks
+    x = arrays.x
+    b = arrays.b
+    A = arrays.A
+    indices = arrays.indices
+    dx_buffer = arrays.dx_buffer
+    colorCells = arrays.colorCells
+    colorStart = arrays.colorStart
+    nrColors = arrays.nrColors
+
+def getSelectedArrays():
+    return currentArrays
+
+# allocate and select new arrays
 def setArraysC(int nr_Cells, short nr_Links):
-    global nrCells, nrLinks, x, b, C, A, indices
-    nrCells = nr_Cells
-    nrLinks = nr_Links
-    x = <double *>malloc(nrCells * sizeof(double))
-    b = <double *>malloc(nrCells * sizeof(double))
-    C = <double *>malloc(nrCells * sizeof(double))
-    A = <double *>malloc(nrCells * nrLinks * sizeof(double))
-    indices = <int *>malloc(nrCells * nrLinks * sizeof(int))
-    
-def arrangeMatrix(int i, double deltaT, double H0, double flow):
-    cdef int n
-    cdef short int j
-    cdef double D
-    cdef double mySum = 0.0
-    for j in range(nrLinks):
-        n = i*nrLinks + j
-        if (indices[n] == NOLINK): break       
-        mySum += A[n]
-        A[n] *= -1.0
+    arrays = CSolverArrays(nr_Cells, nr_Links)
+    selectArrays(arrays)
+    return arrays
     
-    # diagonal and vector b     
-    D = (C[i] / deltaT) + mySum
-    b[i] = (C[i] / deltaT) * H0 + flow
-
-    # matrix conditioning
-    b[i] /= D
-    for j in range(nrLinks):
-        n = i*nrLinks + j
-        if (indices[n] == NOLINK): break 
-        A[n] /= D 
-
 def GaussSeidel():
     cdef int i, n
     cdef short j
@@ -82,20 +142,73 @@ def GaussSeidel():
         x[i] = new_x
     return norm
 
+# cells: indices of the cells sorted by color
+# start: position of the first cell of each color in cells (nrColors + 1 values)
+# cells of the same color must not be linked
+def setColors(int[::1] cells, int[::1] start):
+    cdef int i
+    cdef CSolverArrays arrays = currentArrays
+    if arrays is None:
+        raise RuntimeError("solver arrays are not selected")
+    free(arrays.colorStart)
+    arrays.nrColors = start.shape[0] - 1
+    arrays.colorStart = <int *>malloc((arrays.nrColors + 1) * sizeof(int))
+    for i in range(arrays.nrColors + 1):
+        arrays.colorStart[i] = start[i]
+    for i in range(nrCells):
+        arrays.colorCells[i] = cells[i]
+    selectArrays(arrays)
+
+# one sweep for each color, the cells of a color are updated in parallel
+def GaussSeidelColored(int nrThreads):
+    cdef int c, k, i, n
+    cdef short j
+    cdef double new_x
+    cdef double norm = 0.0
+
+    with nogil:
+        for c in range(nrColors):
+            for k in prange(colorStart[c], colorStart[c+1], num_threads=nrThreads, schedule='static'):
+                i = colorCells[k]
+                new_x = b[i]
+                for j in range(nrLinks):
+                    n = i*nrLinks + j
+                    if (indices[n] == NOLINK): break
+                    new_x = new_x - A[n] * x[indices[n]]
+
+                dx_buffer[i] = fabs(new_x - x[i])
+                x[i] = new_x
+
+        # infinite norm
+        for i in range(nrCells):
+            if (dx_buffer[i] > norm): norm = dx_buffer[i]
+    return norm
+
 def set_x(int index, double value):
     x[index] = value
     
 def get_x(int index):
     return x[index]
-    
-def set_C(int index, double value):
-    C[index] = value
 
-def set_indices(int i, short int j, int index):
-    indices[i * nrLinks + j] = index
+def set_x_array(double[::1] values):
+    cdef int i
+    for i in range(nrCells):
+        x[i] = values[i]
+
+def get_x_array(double[::1] values):
+    cdef int i
+    for i in range(nrCells):
+        values[i] = x[i]
     
-def set_A(int i, short int j, double value):
-    A[i * nrLinks + j] = value
+# copy the system assembled by solverCython.arrangeMatrix
+def set_system(double[:, ::1] A_in, int[:, ::1] indices_in, double[::1] b_in):
+    cdef int i
+    cdef short int j
+    for i in range(nrCells):
+        b[i] = b_in[i]
+        for j in range(nrLinks):
+            A[i*nrLinks + j] = A_in[i, j]
+            indices[i*nrLinks + j] = indices_in[i, j]
 
 
 def meanK(int type, double k1, double k2):
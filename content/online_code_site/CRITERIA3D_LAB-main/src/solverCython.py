@@ -4,37 +4,61 @@
 # https://github.com/ARPA-SIMC/CRITERIA3D_LAB
 # ---------------------------------------------------------
 
+import numpy as np
 from dataStructures import *
-from waterProcesses import runoff, infiltration, redistribution
+from waterProcesses import linkConductances
 import boundaryConditions
 import soil
 import waterBalance
-from solverC import setArraysC, set_x, set_C, set_A, set_indices, get_x, arrangeMatrix, GaussSeidel
+import linearSolver
+import newtonSolver
+from solverC import setArraysC, set_x_array, get_x_array, set_system, setColors, GaussSeidel, GaussSeidelColored
+
+# linear system, copied in the C arrays used by Gauss-Seidel
+A = np.array([[], []], np.float64)
+x = np.array([], np.float64)
+b = np.array([], np.float64)
+D = np.array([], np.float64)
+indices = np.array([[], []], np.int32)
+
+# C arrays (solverC.CSolverArrays)
+solverArrays = None
+
+# multicolor Gauss-Seidel: None = colors not yet computed
+isColored = None
 
 
 def setCriteria3DArrays(nrCells, nrLinks):
-    setArraysC(nrCells, nrLinks)
+    global A, x, b, D, indices, isColored, solverArrays
+    isColored = None
+    solverArrays = setArraysC(nrCells, nrLinks)
+    A = np.zeros((nrCells, nrLinks), np.float64)
+    x = np.zeros(nrCells, np.float64)
+    b = np.zeros(nrCells, np.float64)
+    D = np.zeros(nrCells, np.float64)
+    indices = np.full((nrCells, nrLinks), NOLINK, np.int32)
 
 
 def computeStep(deltaT):
+    if C3DParameters.nonlinearSolver == NEWTON:
+        return newtonSolver.computeStep(deltaT, C3DParameters.computeInfiltration)
+
     # initialize
     approximation = 1
     isValidStep = False
-    for i in range(C3DStructure.nrCells):
-        C3DCells[i].H0 = C3DCells[i].H
-        set_x(i, C3DCells[i].H)
-        if C3DCells[i].isSurface:
-            set_C(i, C3DCells[i].area)
+    C3DCells.H0[:] = C3DCells.H
+    set_x_array(C3DCells.H)
+    surfaceCells = np.flatnonzero(C3DCells.isSurface)
+    subSurfaceCells = np.flatnonzero(~C3DCells.isSurface)
+    capacity = np.zeros(C3DStructure.nrCells, np.float64)
+    capacity[surfaceCells] = C3DCells.area[surfaceCells]
 
     while (not isValidStep) and (approximation <= C3DParameters.maxApproximationsNr):
         isFirstApprox = (approximation == 1)
         waterBalance.maxCourant = 0.0
-        for i in range(C3DStructure.nrCells):
-            if not C3DCells[i].isSurface:
-                C3DCells[i].Se = soil.getDegreeOfSaturation(i)
-                C3DCells[i].k = soil.getHydraulicConductivity(i)
-                dTheta_dH = soil.get_dTheta_dH(i)
-                set_C(i, C3DCells[i].volume * dTheta_dH)
+        C3DCells.Se[subSurfaceCells] = soil.getDegreeOfSaturationArray(subSurfaceCells)
+        C3DCells.k[subSurfaceCells] = soil.getHydraulicConductivityArray(subSurfaceCells)
+        capacity[subSurfaceCells] = C3DCells.volume[subSurfaceCells] * soil.get_dTheta_dHArray(subSurfaceCells)
 
         # boundary
         boundaryConditions.updateBoundary(deltaT)
@@ -42,45 +66,28 @@ def computeStep(deltaT):
         # print("approximation nr:", approximation)
         # print("Sum flows (abs) [l]:", format(waterBalance.sumWaterFlow(deltaT, True) * 1000., ".5f"))
 
-        for i in range(C3DStructure.nrCells):
-            k = 0
-            if (newMatrixElement(i, C3DCells[i].upLink, k,
-                                 False, deltaT, isFirstApprox)):
-                k += 1
-            for link in range(C3DStructure.nrLateralLinks):
-                if (newMatrixElement(i, C3DCells[i].lateralLink[link], k,
-                                     True, deltaT, isFirstApprox)):
-                    k += 1
-            if (newMatrixElement(i, C3DCells[i].downLink, k,
-                                 False, deltaT, isFirstApprox)):
-                k += 1
-            if k < C3DStructure.nrMaxLinks:
-                set_indices(i, k, NOLINK)
-
-            arrangeMatrix(i, deltaT, C3DCells[i].H0, C3DCells[i].flow)
+        conductances = arrangeMatrix(deltaT, isFirstApprox, capacity)
 
         if (waterBalance.maxCourant > 1.0) and (deltaT > C3DParameters.deltaT_min):
             # print("Courant too high:", waterBalance.maxCourant)
             # print("Decrease time step")
-            waterBalance.halveTimeStep()
+            waterBalance.controller.reduceCourant(deltaT, waterBalance.maxCourant)
             return False
 
         if not solveMatrix(approximation):
-            waterBalance.halveTimeStep()
+            waterBalance.controller.reduceNotConvergent(deltaT)
             print("System is not convergent.")
             return False
 
         # new hydraulic head
-        for i in range(0, C3DStructure.nrCells):
-            C3DCells[i].H = get_x(i)
-            # check surface error
-            if C3DCells[i].isSurface:
-                if C3DCells[i].H < C3DCells[i].z:
-                    C3DCells[i].H = C3DCells[i].z
-            C3DCells[i].Se = soil.getDegreeOfSaturation(i)
+        get_x_array(C3DCells.H)
+        # check surface error
+        C3DCells.H[surfaceCells] = np.maximum(C3DCells.H[surfaceCells], C3DCells.z[surfaceCells])
+        C3DCells.Se[surfaceCells] = np.where(C3DCells.H[surfaceCells] > C3DCells.z[surfaceCells], 1.0, 0.0)
+        C3DCells.Se[subSurfaceCells] = soil.getDegreeOfSaturationArray(subSurfaceCells)
 
         # waterBalance
-        isValidStep = waterBalance.waterBalance(deltaT, approximation)
+        isValidStep = waterBalance.waterBalance(deltaT, approximation, conductances)
         if waterBalance.forceExit:
             return False
 
@@ -89,45 +96,87 @@ def computeStep(deltaT):
     return isValidStep
 
 
-def newMatrixElement(i, link, k, isLateral, deltaT, isFirstApprox):
-    j = link.index
-    if j == NOLINK:
+# -----------------------------------------------------------
+# the link conductances are computed in bulk on C3DLinks,
+# then each row of A keeps the non-zero values in the order
+# of the link columns (up, lateral, down)
+# return the link conductances (for the water balance)
+# -----------------------------------------------------------
+def arrangeMatrix(deltaT, isFirstApprox, capacity):
+    conductances = linkConductances(deltaT, isFirstApprox, C3DParameters.computeInfiltration)
+    values = np.zeros((C3DStructure.nrCells, C3DStructure.nrMaxLinks), np.float64)
+    values[C3DLinks.i, C3DLinks.column] = conductances
+
+    # move the zero values at the end of the rows
+    isLink = values != 0.0
+    order = np.argsort(~isLink, axis=1, kind='stable')
+    values = np.take_along_axis(values, order, axis=1)
+    isLink = np.take_along_axis(isLink, order, axis=1)
+    linkIndex = np.take_along_axis(C3DCells.linkIndex, order, axis=1)
+
+    # diagonal and vector b
+    D[:] = (capacity / deltaT) + values.sum(axis=1)
+    b[:] = (capacity / deltaT) * C3DCells.H0 + C3DCells.flow
+
+    # matrix conditioning
+    b[:] /= D
+    A[:] = -values / D[:, np.newaxis]
+    indices[:] = np.where(isLink, linkIndex, NOLINK)
+    set_system(A, indices, b)
+    return conductances
+
+
+# -----------------------------------------------------------
+# red-black colors of the structured mesh (layer, row, column)
+# -----------------------------------------------------------
+def getCellColors():
+    cell = np.arange(C3DStructure.nrCells)
+    layer = cell // C3DStructure.nrRectangles
+    rectangle = cell % C3DStructure.nrRectangles
+    row = rectangle // C3DStructure.nrRectanglesInXAxis
+    column = rectangle % C3DStructure.nrRectanglesInXAxis
+    return (layer + row + column) % 2
+
+
+# linked cells must have different colors
+def initializeColors():
+    colors = getCellColors()
+    if np.any(colors[C3DLinks.i] == colors[C3DLinks.j]):
+        print("WARNING! The mesh is not red-black: the serial Gauss-Seidel will be used.")
         return False
 
-    if C3DCells[i].isSurface and C3DCells[j].isSurface:
-        if C3DParameters.computeSurfaceFlow:
-            value = runoff(i, link, deltaT, isFirstApprox)
-        else:
-            value = 0.0
-    elif C3DCells[i].isSurface or C3DCells[j].isSurface:
-        if C3DParameters.computeInfiltration:
-            if C3DCells[i].isSurface:
-                value = infiltration(i, j, link, deltaT, isFirstApprox)
-            else:
-                value = infiltration(j, i, link, deltaT, isFirstApprox)
-        else:
-            value = 0.0
-    else:
-        value = redistribution(i, link, isLateral)
-
-    if value == 0.0:
-        return False
-
-    set_indices(i, k, j)
-    set_A(i, k, value)
+    cells = np.argsort(colors, kind='stable').astype(np.int32)
+    start = np.searchsorted(colors[cells], np.arange(colors.max() + 2)).astype(np.int32)
+    setColors(cells, start)
     return True
 
 
 def solveMatrix(approximation):
+    global isColored
     ratio = (C3DParameters.maxIterationsNr / C3DParameters.maxApproximationsNr)
     maxIterationsNr = max(10, ratio * approximation)
 
+    if C3DParameters.linearSolver != GAUSS_SEIDEL:
+        get_x_array(x)
+        if not linearSolver.solveSparse(A, indices, b, D, x, int(maxIterationsNr)):
+            return False
+        set_x_array(x)
+        return True
+
+    isMulticolor = C3DParameters.nrThreads > 1
+    if isMulticolor and isColored is None:
+        isColored = initializeColors()
+    isMulticolor = isMulticolor and isColored
+
     iteration = 0
     norm = 1000.
     bestNorm = norm
     while ((norm > C3DParameters.residualTolerance)
            and (iteration < maxIterationsNr)):
-        norm = GaussSeidel()
+        if isMulticolor:
+            norm = GaussSeidelColored(C3DParameters.nrThreads)
+        else:
+            norm = GaussSeidel()
         if norm > (bestNorm * 10.):
             return False
         bestNorm = min(norm, bestNorm)
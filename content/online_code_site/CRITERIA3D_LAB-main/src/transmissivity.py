@@ -7,12 +7,15 @@
 
 import math
 import datetime
+import numpy as np
 import pandas as pd
 from dataStructures import C3DStructure
 
 SOLAR_CONSTANT = 1367  # [W/m²]
 TRANSMISSIVITY_THRESHOLD = 300  # [W/m²]
 MAXIMUM_TRANSMISSIVITY = 0.75
+# [hours] max hours before the current hour used for the transmissivity
+TRANSMISSIVITY_HOURS = 12
 
 
 def degreeToRadians(degree):
@@ -33,10 +36,10 @@ def clearSkyRad(myDate, finalHourUTC, latDegrees, lonDegrees):
     solarTime = finalHourUTC - 0.5 + C3DStructure.timeZone
     if solarTime < 0:
         solarTime += 24
-        myDate = myDate - 1
+        myDate = myDate - datetime.timedelta(days=1)
     if solarTime > 24:
         solarTime -= 24
-        myDate = myDate - 1
+        myDate = myDate + datetime.timedelta(days=1)
 
     doy = dateToDOY(myDate.year, myDate.month, myDate.day)
     timeAdjustment = degreeToRadians(279.575 + 0.986 * doy)
@@ -63,7 +66,7 @@ def computeNormTransmissivity(obsData, obsIndex, latitude, longitude):
     observedRad = 0
     nrHoursAhead = 0
 
-    while (potentialRad < TRANSMISSIVITY_THRESHOLD) and (nrHoursAhead < 12) and (currentIndex >= 0):
+    while (potentialRad < TRANSMISSIVITY_THRESHOLD) and (nrHoursAhead < TRANSMISSIVITY_HOURS) and (currentIndex >= 0):
         currentData = obsData.iloc[currentIndex]
         currentDateTime = pd.to_datetime(currentData["timestamp"], unit='s')
         date = datetime.date(currentDateTime.year, currentDateTime.month, currentDateTime.day)
@@ -88,3 +91,83 @@ def computeNormTransmissivity(obsData, obsIndex, latitude, longitude):
         return 1.
     else:
         return min(1., observedRad / potentialRad)
+
+
+# -----------------------------------------------------------
+# the same computations for the whole series (numpy arrays)
+# timestamps        [s] UTC
+# -----------------------------------------------------------
+def clearSkyRadArray(timestamps, latDegrees, lonDegrees):
+    latRad = degreeToRadians(latDegrees)
+    longitudeCorrection = (C3DStructure.timeZone * 15. - lonDegrees) / 15.
+
+    dateTime = np.asarray(timestamps, np.int64).astype("datetime64[s]")
+    days = dateTime.astype("datetime64[D]")
+    hour = (dateTime - days).astype(np.int64) // 3600
+    solarTime = hour - 0.5 + C3DStructure.timeZone
+    # solar time in the previous or next day
+    days = days - (solarTime < 0) + (solarTime > 24)
+    solarTime = np.where(solarTime < 0, solarTime + 24, solarTime)
+    solarTime = np.where(solarTime > 24, solarTime - 24, solarTime)
+
+    doy = (days - days.astype("datetime64[Y]")).astype(np.int64) + 1
+    timeAdjustment = degreeToRadians(279.575 + 0.986 * doy)
+
+    timeEq = (-104.7 * np.sin(timeAdjustment) + 596.2 * np.sin(2. * timeAdjustment)
+              + 4.3 * np.sin(3. * timeAdjustment) - 12.7 * np.sin(4 * timeAdjustment)
+              - 429.3 * np.cos(timeAdjustment) - 2. * np.cos(2. * timeAdjustment)
+              + 19.3 * np.cos(3. * timeAdjustment)) / 3600.
+
+    solarNoon = 12. + longitudeCorrection - timeEq
+
+    solarDeclination = 0.4102 * np.sin(2. * math.pi / 365. * (doy - 80.))
+
+    solarAngle = np.arcsin(math.sin(latRad) * np.sin(solarDeclination)
+                           + math.cos(latRad) * np.cos(solarDeclination)
+                           * np.cos(math.pi / 12 * (solarTime - solarNoon)))
+    return np.maximum(0., SOLAR_CONSTANT * np.sin(solarAngle)) * MAXIMUM_TRANSMISSIVITY
+
+
+# -----------------------------------------------------------
+# normalized transmissivity of all hours (see computeNormTransmissivity)
+# the radiation of the hours before (up to TRANSMISSIVITY_HOURS) is summed until the
+# potential radiation reaches TRANSMISSIVITY_THRESHOLD, then the same number of hours
+# from the current one is summed again
+# solarRadiation, potentialRad    [W/m²] observed and clear sky radiation
+# -----------------------------------------------------------
+def computeNormTransmissivityArray(solarRadiation, potentialRad):
+    solarRadiation = np.asarray(solarRadiation, np.float64)
+    potentialRad = np.asarray(potentialRad, np.float64)
+    nrHours = len(potentialRad)
+    nrSteps = TRANSMISSIVITY_HOURS
+    index = np.arange(nrHours)
+
+    # hours before: index - k (k = 0 .. nrSteps-1)
+    before = index[:, None] - np.arange(nrSteps)[None, :]
+    isBefore = before >= 0
+    before = np.maximum(before, 0)
+    potentialBefore = np.where(isBefore, potentialRad[before], 0.)
+    cumulatedBefore = np.cumsum(potentialBefore, axis=1)
+    # first hour reaching the threshold (nrSteps if never reached)
+    isReached = isBefore & (cumulatedBefore >= TRANSMISSIVITY_THRESHOLD)
+    firstReached = np.where(isReached.any(axis=1), isReached.argmax(axis=1), nrSteps)
+    nrBefore = np.minimum(np.minimum(firstReached + 1, nrSteps), index + 1)
+    nrHoursAhead = np.where(firstReached < nrBefore, nrBefore - 1, nrBefore)
+
+    # hours after: index + k (k < nrHoursAhead)
+    after = index[:, None] + np.arange(nrSteps)[None, :]
+    isAfter = (np.arange(nrSteps)[None, :] < nrHoursAhead[:, None]) & (after < nrHours)
+    after = np.minimum(after, nrHours - 1)
+    isBefore &= np.arange(nrSteps)[None, :] < nrBefore[:, None]
+
+    # same order of the sums of computeNormTransmissivity
+    isSummed = np.concatenate((isBefore, isAfter), axis=1)
+    hours = np.concatenate((before, after), axis=1)
+    potential = np.where(isSummed, potentialRad[hours], 0.).cumsum(axis=1)[:, -1]
+    observed = np.where(isSummed, solarRadiation[hours], 0.).cumsum(axis=1)[:, -1]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = observed / potential
+    transmissivity = np.where(ratio < 1., ratio, 1.)
+    transmissivity[potential == 0] = 1.
+    return transmissivity
@@ -4,6 +4,9 @@
 # https://github.com/ARPA-SIMC/CRITERIA3D_LAB
 # ---------------------------------------------------------
 
+import threading
+import time
+import numpy as np
 import vpython as visual
 from dataStructures import *
 from color import *
@@ -13,6 +16,7 @@ import rectangularMesh
 import soil
 import crop
 import importUtils
+import exportUtils
 
 sliceRectangles = []
 subSurfaceRectangles = []
@@ -28,6 +32,14 @@ isPointVisualization = False
 isPause = False
 isComputeEquilibrium = False
 colorScale = []
+# incremental redraw: only the rectangles with a visible color change are sent
+colorThreshold = 1. / 256.      # smallest change of a color component [0, 1]
+frameRate = 10.                 # [s-1] maximum redraws during the simulation
+lastRedrawTime = 0.
+sliceColors = np.zeros((0, 3))      # last colors sent of the rectangles
+surfaceColors = np.zeros((0, 3))
+# set at each key command: the simulation waits on it when paused
+keyEvent = threading.Event()
 
 
 def initialize(totalWidth):
@@ -300,6 +312,14 @@ def keyInput(evt):
         drawColorScale()
         redraw()
 
+    keyEvent.set()
+
+
+# wait for the next key command (the flags are changed by keyInput)
+def waitKeyInput():
+    keyEvent.wait()
+    keyEvent.clear()
+
 
 def getNewRectangle(myColor, myCanvas, v, computeNormal):
     vert = []
@@ -316,13 +336,83 @@ def getNewRectangle(myColor, myCanvas, v, computeNormal):
     return newRectangle
 
 
+# boolean mask of the indices (list)
+def getIndexMask(indices, size):
+    mask = np.zeros(size, bool)
+    mask[np.asarray(indices, np.int64)] = True
+    return mask
+
+
+# root factor of the rectangles (surfaceIndices) in all layers (nrLayers x nr. rectangles)
+def getRootArray(surfaceIndices):
+    root = np.zeros((C3DStructure.nrLayers, len(surfaceIndices)))
+    if crop.maxRootFactor > 0:
+        rootFactor = crop.k_root[surfaceIndices] * crop.rootDensity[surfaceIndices, 1:].T / soil.thickness[1:, None]
+        root[1:] = rootFactor / crop.maxRootFactor
+    return root
+
+
+# colors of the subsurface cells (indices) in the current visualization
+def getCellColors(indices, root):
+    if isRootVisualization:
+        colors = getRootColorArray(root, 0, 1)
+        colors[getIndexMask(exportUtils.outputIndices, C3DStructure.nrCells)[indices]] = 1.0
+    elif isPointVisualization:
+        colors = np.tile([0., 1., 0.], (len(indices), 1))
+        colors[getIndexMask(exportUtils.outputIndices, C3DStructure.nrCells)[indices]] = (1, 0, 0)
+    elif isWaterPotential:
+        colors = getMatricPotentialColorArray(C3DCells.H[indices] - C3DCells.z[indices])
+    else:
+        colors = getSEColorArray(C3DCells.Se[indices], degreeMinimum, degreeMaximum)
+    return colors
+
+
+def getSurfaceColors():
+    nrRectangles = C3DStructure.nrRectangles
+    if isRootVisualization:
+        return getRootColorArray(crop.k_root, 0, 1.5)
+    elif isPointVisualization:
+        colors = np.tile([0., 1., 0.], (nrRectangles, 1))
+        colors[getIndexMask(exportUtils.outputSurfaceIndices, nrRectangles)] = (1, 0, 0)
+        colors[getIndexMask(dripperIndices, nrRectangles)] = (0, 0.5, 1)
+        colors[getIndexMask(plantIndices, nrRectangles)] = (1, 1, 1)
+        return colors
+    else:
+        return getSurfaceWaterColorArray(getSurfaceWaterLevel(), waterLevelMaximum)
+
+
+def getSurfaceWaterLevel():
+    nrRectangles = C3DStructure.nrRectangles
+    return np.maximum(C3DCells.H[:nrRectangles] - C3DCells.z[:nrRectangles], 0.0)
+
+
+# -----------------------------------------------------------
+# send the colors of the rectangles changed more than colorThreshold
+# from the last colors sent (all if isAll)
+# return the last colors sent
+# -----------------------------------------------------------
+def updateColors(rectangles, colors, lastColors, isAll):
+    if isAll or len(lastColors) != len(colors):
+        lastColors = colors.copy()
+        changed = range(len(colors))
+    else:
+        changed = np.flatnonzero(np.max(np.abs(colors - lastColors), axis=1) > colorThreshold)
+        lastColors[changed] = colors[changed]
+
+    for i in changed:
+        myColor = visual.vector(colors[i, 0], colors[i, 1], colors[i, 2])
+        rectangles[i].v0.color = myColor
+        rectangles[i].v1.color = myColor
+        rectangles[i].v2.color = myColor
+        rectangles[i].v3.color = myColor
+    return lastColors
+
+
 def drawSlice(isFirst):
-    global sliceRectangles
-    from crop import k_root, rootDensity, maxRootFactor
-    from exportUtils import outputIndices
+    global sliceRectangles, sliceColors
 
     firstIndex = visualizedSlice * C3DStructure.nrRectanglesInXAxis
-    posY = C3DCells[firstIndex].y
+    posY = C3DCells.y[firstIndex]
 
     if isPointVisualization:
         var = "Output points"
@@ -334,35 +424,17 @@ def drawSlice(isFirst):
         var = "Degree of saturation"
     sliceLabel.text = var + " - slice at " + format(posY * 100, ".1f") + "cm"
 
+    # index of the rectangle: layer * nrRectanglesInXAxis + x
+    surfaceIndices = firstIndex + np.arange(C3DStructure.nrRectanglesInXAxis)
+    indices = (np.arange(C3DStructure.nrLayers)[:, None] * C3DStructure.nrRectangles + surfaceIndices).ravel()
+    root = getRootArray(surfaceIndices).ravel() if isRootVisualization else None
+    colors = getCellColors(indices, root)
+
     if isFirst:
         sliceRectangles.clear()
-
-    for layer in range(C3DStructure.nrLayers):
-        for x in range(C3DStructure.nrRectanglesInXAxis):
-            index = firstIndex + x + (layer * C3DStructure.nrRectangles)
-            i = layer * C3DStructure.nrRectanglesInXAxis + x
-            if isRootVisualization:
-                if index in outputIndices:
-                    c = [1.0, 1.0, 1.0]
-                else:
-                    if layer == 0:
-                        root = 0
-                    else:
-                        surfaceIndex = firstIndex + x
-                        rootFactor = k_root[surfaceIndex] * rootDensity[surfaceIndex][layer] / soil.thickness[layer]
-                        root = rootFactor / maxRootFactor
-                    c = getRootColor(root, 0, 1)
-            elif isPointVisualization:
-                c = [0, 1, 0]
-                if index in outputIndices:
-                    c = [1, 0, 0]
-            elif isWaterPotential:
-                c = getMatricPotentialColor(C3DCells[index].H - C3DCells[index].z)
-            else:
-                c = getSEColor(C3DCells[index].Se, degreeMinimum, degreeMaximum)
-            myColor = visual.vector(c[0], c[1], c[2])
-
-            if isFirst:
+        for layer in range(C3DStructure.nrLayers):
+            for x in range(C3DStructure.nrRectanglesInXAxis):
+                c = colors[layer * C3DStructure.nrRectanglesInXAxis + x]
                 vertices = copy(rectangularMesh.C3DRM[firstIndex + x].v)
                 for v in vertices[:2]:
                     v[2] = v[2] - soil.depth[layer] + (soil.thickness[layer] * 0.5)
@@ -370,69 +442,32 @@ def drawSlice(isFirst):
                 vertices[2] = vertices[1]
                 for v in vertices[2:]:
                     v[2] = v[2] - soil.thickness[layer]
-                newRectangle = getNewRectangle(myColor, sliceCanvas, vertices, False)
+                newRectangle = getNewRectangle(visual.vector(c[0], c[1], c[2]), sliceCanvas, vertices, False)
                 sliceRectangles.append(newRectangle)
-            else:
-                sliceRectangles[i].v0.color = myColor
-                sliceRectangles[i].v1.color = myColor
-                sliceRectangles[i].v2.color = myColor
-                sliceRectangles[i].v3.color = myColor
+
+    sliceColors = updateColors(sliceRectangles, colors, sliceColors, isFirst)
 
 
 def drawSurface(isFirst):
-    global subSurfaceRectangles
-    from exportUtils import outputSurfaceIndices, outputIndices
+    global subSurfaceRectangles, surfaceColors
 
-    maxWaterLevel = 0
+    surfaceIndices = np.arange(C3DStructure.nrRectangles)
+    if visualizedLayer == 0:
+        colors = getSurfaceColors()
+    else:
+        indices = visualizedLayer * C3DStructure.nrRectangles + surfaceIndices
+        root = getRootArray(surfaceIndices)[visualizedLayer] if isRootVisualization else None
+        colors = getCellColors(indices, root)
 
     if isFirst:
         subSurfaceRectangles.clear()
-
-    for i in range(C3DStructure.nrRectangles):
-        index = visualizedLayer * C3DStructure.nrRectangles + i
-        # color
-        if visualizedLayer == 0:
-            if isRootVisualization:
-                c = getRootColor(crop.k_root[i], 0, 1.5)
-            elif isPointVisualization:
-                c = [0, 1, 0]
-                if i in plantIndices:
-                    c = [1, 1, 1]
-                elif i in dripperIndices:
-                    c = [0, 0.5, 1]
-                elif i in outputSurfaceIndices:
-                    c = [1, 0, 0]
-            else:
-                waterLevel = max(C3DCells[i].H - C3DCells[i].z, 0.0)
-                maxWaterLevel = max(waterLevel, maxWaterLevel)
-                c = getSurfaceWaterColor(waterLevel, waterLevelMaximum)
-        else:
-            if isWaterPotential:
-                c = getMatricPotentialColor(C3DCells[index].H - C3DCells[index].z)
-            elif isRootVisualization:
-                if index in outputIndices:
-                    c = [1.0, 1.0, 1.0]
-                else:
-                    rootFactor = crop.k_root[i] * crop.rootDensity[i][visualizedLayer] / soil.thickness[visualizedLayer]
-                    root = rootFactor / crop.maxRootFactor
-                    c = getRootColor(root, 0, 1)
-            elif isPointVisualization:
-                c = [0, 1, 0]
-                if index in outputIndices:
-                    c = [1, 0, 0]
-            else:
-                c = getSEColor(C3DCells[index].Se, degreeMinimum, degreeMaximum)
-
-        myColor = visual.vector(c[0], c[1], c[2])
-
-        if isFirst:
-            newRectangle = getNewRectangle(myColor, soilCanvas, rectangularMesh.C3DRM[i].v, True)
+        for i in range(C3DStructure.nrRectangles):
+            c = colors[i]
+            newRectangle = getNewRectangle(visual.vector(c[0], c[1], c[2]), soilCanvas,
+                                           rectangularMesh.C3DRM[i].v, True)
             subSurfaceRectangles.append(newRectangle)
-        else:
-            subSurfaceRectangles[i].v0.color = myColor
-            subSurfaceRectangles[i].v1.color = myColor
-            subSurfaceRectangles[i].v2.color = myColor
-            subSurfaceRectangles[i].v3.color = myColor
+
+    surfaceColors = updateColors(subSurfaceRectangles, colors, surfaceColors, isFirst)
 
     # label
     if visualizedLayer == 0:
@@ -441,6 +476,7 @@ def drawSurface(isFirst):
         elif isRootVisualization:
             layerLabel.text = "Root factor"
         else:
+            maxWaterLevel = np.max(getSurfaceWaterLevel())
             layerLabel.text = "Surface water level - max:" + format(maxWaterLevel * 1000, ".1f") + "mm"
     else:
         depth = soil.depth[visualizedLayer] * 100
@@ -471,7 +507,15 @@ def updateInterface():
     totalErrorLabel.text = "Total error: " + format(totalError * 1000, ".4f") + " [l]"
 
 
-def redraw():
+# isForced = False: skipped if the last redraw is more recent than 1 / frameRate
+# (the simulation redraws after each time step)
+def redraw(isForced=True):
+    global lastRedrawTime
+    currentTime = time.perf_counter()
+    if not isForced and (currentTime - lastRedrawTime) < 1. / frameRate:
+        return
+    lastRedrawTime = currentTime
+
     updateInterface()
     drawSlice(False)
     drawSurface(False)
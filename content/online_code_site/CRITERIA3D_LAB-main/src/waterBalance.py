@@ -5,8 +5,9 @@
 # ---------------------------------------------------------
 
 from math import fabs
+import numpy as np
 from dataStructures import *
-from soil import getVolumetricWaterContent
+import soil
 
 
 class C3DBalance:
@@ -24,10 +25,33 @@ maxCourant = 0.0
 bestMBR = NODATA
 nrMBRWrong = 0
 forceExit = False
+# solver statistics
+nrAcceptedSteps = 0
+nrRejectedSteps = 0
+nrApproximations = 0
+nrSurfaceSteps = 0              # substeps of the split surface flow
+controller = None
 currentStep = C3DBalance()
 previousStep = C3DBalance()
 allSimulation = C3DBalance()
 
+# -----------------------------------------------------------
+# water storage of the cells [m3] (see initializeCellStorage)
+# cellStorage:          current state
+# previousCellStorage:  last accepted step
+# cellMBE:              [m3] mass balance error of the cells in the last approximation:
+#                       storage - previous storage - (flow + link flows) * deltaT
+# surfaceCells, subSurfaceCells:  slices if the cells are contiguous
+# cellThetaR, cellThetaRange:     [m3 m-3] thetaR and thetaS - thetaR
+# -----------------------------------------------------------
+cellStorage = np.array([], np.float64)
+previousCellStorage = np.array([], np.float64)
+cellMBE = np.array([], np.float64)
+surfaceCells = np.array([], np.int64)
+subSurfaceCells = np.array([], np.int64)
+cellThetaR = np.array([], np.float64)
+cellThetaRange = np.array([], np.float64)
+
 
 def doubleTimeStep():
     global MBRMultiply
@@ -64,10 +88,17 @@ def decMBRThreshold():
 
 
 def initializeBalance():
-    global totalTime
+    global totalTime, nrAcceptedSteps, nrRejectedSteps, nrApproximations, nrSurfaceSteps, controller
 
     totalTime = 0.0
+    controller = getTimeStepController(C3DParameters.timeStepController)
+    nrAcceptedSteps = 0
+    nrRejectedSteps = 0
+    nrApproximations = 0
+    nrSurfaceSteps = 0
+    initializeCellStorage()
     storage = getWaterStorage()
+    previousCellStorage[:] = cellStorage
     currentStep.waterStorage = storage
     previousStep.waterStorage = storage
     allSimulation.waterStorage = storage
@@ -81,6 +112,7 @@ def initializeBalance():
 
 def updateStorage():
     storage = getWaterStorage()
+    previousCellStorage[:] = cellStorage
     currentStep.waterStorage = storage
     previousStep.waterStorage = storage
     allSimulation.waterStorage = storage
@@ -93,51 +125,84 @@ def updateBalance(deltaT):
     previousStep.waterFlow = currentStep.waterFlow
     allSimulation.waterFlow += currentStep.waterFlow
     allSimulation.MBE += currentStep.MBE
+    previousCellStorage[:] = cellStorage
+
+
+# the cell properties used by the storage are constant during the simulation
+def initializeCellStorage():
+    global cellStorage, previousCellStorage, cellMBE, surfaceCells, subSurfaceCells, cellThetaR, cellThetaRange
+    surfaceCells = getCellSlice(np.flatnonzero(C3DCells.isSurface))
+    subSurfaceCells = getCellSlice(np.flatnonzero(~C3DCells.isSurface))
+
+    horizonIndex = C3DCells.horizonIndex[subSurfaceCells]
+    thetaS = soil.horizonArrays.thetaS[horizonIndex]
+    if C3DParameters.waterRetentionCurve == IPPISCH_VG:
+        cellThetaR = soil.horizonArrays.VG_thetaR[horizonIndex]
+    else:
+        cellThetaR = np.zeros(len(thetaS), np.float64)
+    cellThetaRange = thetaS - cellThetaR
+
+    cellStorage = np.zeros(C3DStructure.nrCells, np.float64)
+    setCellStorage()
+    previousCellStorage = cellStorage.copy()
+    cellMBE = np.zeros(C3DStructure.nrCells, np.float64)
+
+
+# contiguous indices: slice (views instead of copies)
+def getCellSlice(indices):
+    if len(indices) > 0 and indices[-1] - indices[0] == len(indices) - 1:
+        return slice(int(indices[0]), int(indices[-1]) + 1)
+    return indices
+
+
+# [m3] water storage of the cells, from the current state (H, Se)
+def setCellStorage():
+    # surface water
+    surfaceWater = C3DCells.H[surfaceCells] - C3DCells.z[surfaceCells]
+    surfaceWater[np.abs(surfaceWater) <= EPSILON] = 0.0
+    cellStorage[surfaceCells] = surfaceWater * C3DCells.area[surfaceCells]
+
+    # soil water
+    theta = C3DCells.Se[subSurfaceCells] * cellThetaRange + cellThetaR
+    cellStorage[subSurfaceCells] = theta * C3DCells.volume[subSurfaceCells]
 
 
 def getWaterStorage():
-    waterStorage = 0.0
-    for i in range(C3DStructure.nrCells):
-        if C3DCells[i].isSurface:
-            if abs(C3DCells[i].H - C3DCells[i].z) > EPSILON:
-                waterStorage += (C3DCells[i].H - C3DCells[i].z) * C3DCells[i].area
-        else:
-            waterStorage += (getVolumetricWaterContent(i) * C3DCells[i].volume)
-    return waterStorage
+    if len(cellStorage) != C3DStructure.nrCells:
+        initializeCellStorage()
+    setCellStorage()
+    return float(np.sum(cellStorage[surfaceCells])) + float(np.sum(cellStorage[subSurfaceCells]))
 
 
 def sumBoundaryFlow(deltaT):
-    mySum = 0.0
-    for i in range(C3DStructure.nrCells):
-        if C3DCells[i].boundary.type != BOUNDARY_NONE:
-            if C3DCells[i].boundary.flow != NODATA:
-                mySum += C3DCells[i].boundary.flow * deltaT
-    return mySum
+    isBoundary = (C3DCells.boundaryType != BOUNDARY_NONE) & (C3DCells.boundaryFlow != NODATA)
+    return float(np.sum(C3DCells.boundaryFlow[isBoundary])) * deltaT
 
 
 def sumSinkSource(deltaT):
-    mySum = 0.0
-    for i in range(C3DStructure.nrCells):
-        if C3DCells[i].sinkSource != NODATA:
-            mySum += C3DCells[i].sinkSource * deltaT
-    return mySum
+    isValid = (C3DCells.sinkSource != NODATA)
+    return float(np.sum(C3DCells.sinkSource[isValid])) * deltaT
 
 
 # [m3]
 def sumWaterFlow(deltaT, isAbsoluteValue):
-    mySum = 0.0
-    for i in range(C3DStructure.nrCells):
-        if C3DCells[i].flow != NODATA:
-            if isAbsoluteValue:
-                mySum += abs(C3DCells[i].flow * deltaT)
-            else:
-                mySum += C3DCells[i].flow * deltaT
-    return mySum
+    flow = C3DCells.flow[C3DCells.flow != NODATA]
+    if isAbsoluteValue:
+        flow = np.abs(flow)
+    return float(np.sum(flow)) * deltaT
 
 
-def computeBalanceError(deltaT):
+# conductances:     [m2 s-1] conductances of the links (C3DLinks) used by the solver
+def computeBalanceError(deltaT, conductances):
     currentStep.waterStorage = getWaterStorage()
-    currentStep.waterFlow = sumWaterFlow(deltaT, False)
+    isValid = C3DCells.flow != NODATA
+    currentStep.waterFlow = float(np.sum(C3DCells.flow[isValid])) * deltaT
+
+    # flows exchanged with the other cells (the links of each cell i)
+    linkFlow = conductances * (C3DCells.H[C3DLinks.j] - C3DCells.H[C3DLinks.i])
+    cellFlow = np.bincount(C3DLinks.i, weights=linkFlow, minlength=C3DStructure.nrCells)
+    cellFlow += np.where(isValid, C3DCells.flow, 0.0)
+    cellMBE[:] = cellStorage - previousCellStorage - cellFlow * deltaT
     currentStep.MBE = currentStep.waterStorage - (previousStep.waterStorage + currentStep.waterFlow)
     if previousStep.waterStorage > 0:
         currentStep.MBR = fabs(currentStep.MBE) / previousStep.waterStorage
@@ -148,9 +213,10 @@ def computeBalanceError(deltaT):
     # print("Mass Balance Ratio:", format(currentStep.MBR, ".5f"))
 
 
-def waterBalance(deltaT, approximation):
-    global forceExit, bestMBR, nrMBRWrong
-    computeBalanceError(deltaT)
+def waterBalance(deltaT, approximation, conductances):
+    global forceExit, bestMBR, nrMBRWrong, nrApproximations
+    nrApproximations += 1
+    computeBalanceError(deltaT, conductances)
 
     if approximation == 1:
         bestMBR = currentStep.MBR
@@ -160,10 +226,7 @@ def waterBalance(deltaT, approximation):
     # case 1: step accepted
     if currentStep.MBR < C3DParameters.MBRThreshold:
         updateBalance(deltaT)
-        if approximation < 3 and maxCourant < 0.3 and currentStep.MBR < (C3DParameters.MBRThreshold * 0.5) \
-                and C3DParameters.currentDeltaT < C3DParameters.currentDeltaT_max:
-            # print("Good MBR!")
-            doubleTimeStep()
+        controller.acceptStep(deltaT, approximation)
         return True
 
     # case 2: continue with next approximation
@@ -175,7 +238,7 @@ def waterBalance(deltaT, approximation):
     # case 3: decrease time step (or increase threshold)
     isLastApprox = (approximation == C3DParameters.maxApproximationsNr)
     if isLastApprox or nrMBRWrong > 0:
-        if halveTimeStep():
+        if controller.rejectStep(deltaT):
             forceExit = True
         else:
             # accept error
@@ -183,3 +246,95 @@ def waterBalance(deltaT, approximation):
             return True
 
     return False
+
+
+# -----------------------------------------------------------
+# time step controllers (C3DParameters.timeStepController)
+# acceptStep:       next time step after an accepted step
+# rejectStep:       MBR too high, return False if the time step
+#                   cannot be decreased (the error is accepted)
+# reduceCourant:    Courant number > 1 (first approximation)
+# reduceNotConvergent:  the linear system is not convergent
+# setWaterEvent:    precipitation or irrigation in the current hour
+# -----------------------------------------------------------
+def getTimeStepController(controllerType):
+    if controllerType == PI_CONTROLLER:
+        return CPIController()
+    return CHeuristicController()
+
+
+# double/halve the time step, the MBR threshold is increased at deltaT_min
+class CHeuristicController:
+    def acceptStep(self, deltaT, approximation):
+        if approximation < 3 and maxCourant < 0.3 and currentStep.MBR < (C3DParameters.MBRThreshold * 0.5) \
+                and C3DParameters.currentDeltaT < C3DParameters.currentDeltaT_max:
+            # print("Good MBR!")
+            doubleTimeStep()
+
+    def rejectStep(self, deltaT):
+        return halveTimeStep()
+
+    def reduceCourant(self, deltaT, courant):
+        while courant > 1.0:
+            halveTimeStep()
+            courant *= 0.5
+
+    def reduceNotConvergent(self, deltaT):
+        halveTimeStep()
+
+    # max time step 300 s during water events
+    def setWaterEvent(self, isWaterEvent):
+        if isWaterEvent:
+            if C3DParameters.currentDeltaT_max > 300:
+                C3DParameters.currentDeltaT_max = 300
+                C3DParameters.currentDeltaT = min(C3DParameters.currentDeltaT, C3DParameters.currentDeltaT_max)
+        else:
+            C3DParameters.currentDeltaT_max = C3DParameters.deltaT_max
+
+
+# -----------------------------------------------------------
+# PI controller: continuous time steps from the error of the step
+#   error = max(MBR / MBRThreshold, Courant / PI_COURANT, approximations / PI_APPROXIMATIONS)
+#   factor = PI_SAFETY * error^(-PI_KI) * (previousError / error)^PI_KP
+# -----------------------------------------------------------
+class CPIController:
+    def __init__(self):
+        self.previousError = NODATA
+
+    def getError(self, MBR, courant, approximation):
+        error = max(MBR / C3DParameters.MBRThreshold, courant / PI_COURANT,
+                    approximation / PI_APPROXIMATIONS)
+        return max(error, PI_MIN_ERROR)
+
+    def setTimeStep(self, deltaT):
+        C3DParameters.currentDeltaT = min(max(deltaT, C3DParameters.deltaT_min), C3DParameters.currentDeltaT_max)
+
+    def acceptStep(self, deltaT, approximation):
+        error = self.getError(currentStep.MBR, maxCourant, approximation)
+        factor = PI_SAFETY * error ** (-PI_KI)
+        if self.previousError != NODATA:
+            factor *= (self.previousError / error) ** PI_KP
+        factor = min(max(factor, PI_MIN_FACTOR), PI_MAX_FACTOR)
+        self.previousError = error
+
+        # step shortened at the end of the hour: it is not increased
+        if deltaT < C3DParameters.currentDeltaT and factor >= 1.0:
+            return
+        self.setTimeStep(deltaT * factor)
+
+    def rejectStep(self, deltaT):
+        if deltaT <= C3DParameters.deltaT_min:
+            return False
+        error = self.getError(currentStep.MBR, maxCourant, 1)
+        factor = min(max(PI_SAFETY * error ** (-PI_KI), PI_MIN_FACTOR), 0.5)
+        self.setTimeStep(deltaT * factor)
+        return True
+
+    def reduceCourant(self, deltaT, courant):
+        self.setTimeStep(deltaT * PI_SAFETY / courant)
+
+    def reduceNotConvergent(self, deltaT):
+        self.setTimeStep(deltaT * 0.5)
+
+    def setWaterEvent(self, isWaterEvent):
+        C3DParameters.currentDeltaT_max = C3DParameters.deltaT_max
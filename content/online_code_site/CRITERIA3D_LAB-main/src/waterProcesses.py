@@ -5,8 +5,10 @@
 # ---------------------------------------------------------
 
 from math import fabs, sqrt
+import numpy as np
 from dataStructures import *
 import waterBalance
+import boundaryConditions
 import soil
 
 
@@ -16,56 +18,231 @@ else:
     from soil import meanK
 
 
+# -----------------------------------------------------------
+# link:  column of the link in the C3DCells link arrays
+# -----------------------------------------------------------
 def redistribution(i, link, isLateral):
-    j = link.index
-    k = meanK(C3DParameters.conductivityMean, C3DCells[i].k, C3DCells[j].k)
+    j = C3DCells.linkIndex[i, link]
+    k = meanK(C3DParameters.conductivityMean, C3DCells.k[i], C3DCells.k[j])
     if isLateral:
         k *= C3DParameters.conductivityHVRatio
 
-    return (k * link.area) / link.distance
+    return (k * C3DCells.linkArea[i, link]) / C3DCells.linkDistance[i, link]
 
 
-def infiltration(surf, sub, link, deltaT, isFirstApprox):
-    if C3DCells[surf].z > C3DCells[sub].H:
+def infiltration(surf, sub, i, link, deltaT, isFirstApprox):
+    area = C3DCells.linkArea[i, link]
+    distance = C3DCells.linkDistance[i, link]
+    if C3DCells.z[surf] > C3DCells.H[sub]:
         # unsaturated
-        avgH = (C3DCells[surf].H + C3DCells[surf].H0) * 0.5
-        psi = avgH - C3DCells[surf].z
+        avgH = (C3DCells.H[surf] + C3DCells.H0[surf]) * 0.5
+        psi = avgH - C3DCells.z[surf]
         if isFirstApprox:
-            rain = (C3DCells[surf].sinkSource / C3DCells[surf].area) * (deltaT * 0.5)
+            rain = (C3DCells.sinkSource[surf] / C3DCells.area[surf]) * (deltaT * 0.5)
             psi += rain
         if psi < EPSILON:
             return 0.0
         
-        interfaceK = meanK(C3DParameters.conductivityMean, C3DCells[sub].k, soil.horizons[0].Ks)
-        dH = C3DCells[surf].H - C3DCells[sub].H
-        maxK = (psi / deltaT) * (link.distance / dH)
+        interfaceK = meanK(C3DParameters.conductivityMean, C3DCells.k[sub], soil.horizons[0].Ks)
+        dH = C3DCells.H[surf] - C3DCells.H[sub]
+        maxK = (psi / deltaT) * (distance / dH)
         k = min(interfaceK, maxK)
     else:
         # saturated
         k = soil.horizons[0].Ks
     
-    return (k * link.area) / link.distance
+    return (k * area) / distance
 
 
 def runoff(i, link, deltaT, isFirstApprox):
-    j = link.index
-    dH = fabs(C3DCells[i].H - C3DCells[j].H)
+    j = C3DCells.linkIndex[i, link]
+    distance = C3DCells.linkDistance[i, link]
+    dH = fabs(C3DCells.H[i] - C3DCells.H[j])
     if dH < EPSILON_METER:
         return 0.
 
-    maxZ = max(C3DCells[i].z, C3DCells[j].z)
-    # maxH = max(C3DCells[i].H, C3DCells[j].H)
-    maxH = max((C3DCells[i].H + C3DCells[i].H0) * 0.5, (C3DCells[j].H + C3DCells[j].H0) * 0.5)
+    maxZ = max(C3DCells.z[i], C3DCells.z[j])
+    # maxH = max(C3DCells.H[i], C3DCells.H[j])
+    maxH = max((C3DCells.H[i] + C3DCells.H0[i]) * 0.5, (C3DCells.H[j] + C3DCells.H0[j]) * 0.5)
     Hs = maxH - (maxZ + C3DParameters.pond)
     if Hs <= EPSILON_METER:
         return 0.
     # pond
     Hs = min(Hs, dH)
     # [m/s] Manning equation
-    v = (pow(Hs, 2.0 / 3.0) * sqrt(dH/link.distance)) / C3DParameters.roughness
-    Courant = v * deltaT / link.distance
+    v = (pow(Hs, 2.0 / 3.0) * sqrt(dH/distance)) / C3DParameters.roughness
+    Courant = v * deltaT / distance
     waterBalance.maxCourant = max(waterBalance.maxCourant, Courant)
 
-    # link.area on surface = side length [m]
-    area = link.area * Hs 
+    # link area on surface = side length [m]
+    area = C3DCells.linkArea[i, link] * Hs
     return (v / dH) * area
+
+
+# -----------------------------------------------------------
+# conductances of all the links (C3DLinks edge arrays)
+# same values of redistribution, infiltration and runoff
+# isInfiltration:  compute surface/sub-surface links
+# -----------------------------------------------------------
+def linkConductances(deltaT, isFirstApprox, isInfiltration):
+    values = np.zeros(C3DLinks.nrLinks, np.float64)
+    values[C3DLinks.redistributionLinks] = redistributionArray(C3DLinks.redistributionLinks)
+    if isInfiltration:
+        values[C3DLinks.infiltrationLinks] = infiltrationArray(C3DLinks.infiltrationLinks, deltaT, isFirstApprox)
+    if C3DParameters.computeSurfaceFlow and C3DParameters.surfaceFlowSolver == COUPLED_SURFACE_FLOW:
+        values[C3DLinks.runoffLinks] = runoffArray(C3DLinks.runoffLinks, deltaT)
+    return values
+
+
+def redistributionArray(links):
+    k = soil.meanKArray(C3DParameters.conductivityMean,
+                        C3DCells.k[C3DLinks.i[links]], C3DCells.k[C3DLinks.j[links]])
+    k = np.where(C3DLinks.kind[links] == LINK_LATERAL, k * C3DParameters.conductivityHVRatio, k)
+    return (k * C3DLinks.area[links]) / C3DLinks.distance[links]
+
+
+def infiltrationArray(links, deltaT, isFirstApprox):
+    surf = C3DLinks.surfaceCell[links]
+    sub = C3DLinks.subSurfaceCell[links]
+    distance = C3DLinks.distance[links]
+    Ks = soil.horizons[0].Ks
+
+    # saturated
+    k = np.full(len(links), Ks)
+
+    # unsaturated
+    isUnsaturated = C3DCells.z[surf] > C3DCells.H[sub]
+    surf = surf[isUnsaturated]
+    sub = sub[isUnsaturated]
+    avgH = (C3DCells.H[surf] + C3DCells.H0[surf]) * 0.5
+    psi = avgH - C3DCells.z[surf]
+    if isFirstApprox:
+        rain = (C3DCells.sinkSource[surf] / C3DCells.area[surf]) * (deltaT * 0.5)
+        psi += rain
+
+    interfaceK = soil.meanKArray(C3DParameters.conductivityMean, C3DCells.k[sub], Ks)
+    dH = C3DCells.H[surf] - C3DCells.H[sub]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        maxK = (psi / deltaT) * (distance[isUnsaturated] / dH)
+    k[isUnsaturated] = np.where(psi < EPSILON, 0.0, np.minimum(interfaceK, maxK))
+
+    return (k * C3DLinks.area[links]) / distance
+
+
+def runoffArray(links, deltaT):
+    i = C3DLinks.i[links]
+    j = C3DLinks.j[links]
+    values = np.zeros(len(links), np.float64)
+
+    dH = np.fabs(C3DCells.H[i] - C3DCells.H[j])
+    maxZ = np.maximum(C3DCells.z[i], C3DCells.z[j])
+    maxH = np.maximum((C3DCells.H[i] + C3DCells.H0[i]) * 0.5, (C3DCells.H[j] + C3DCells.H0[j]) * 0.5)
+    Hs = maxH - (maxZ + C3DParameters.pond)
+    isFlow = (dH >= EPSILON_METER) & (Hs > EPSILON_METER)
+    if not np.any(isFlow):
+        return values
+
+    dH = dH[isFlow]
+    distance = C3DLinks.distance[links][isFlow]
+    # pond
+    Hs = np.minimum(Hs[isFlow], dH)
+    # [m/s] Manning equation
+    v = (Hs ** (2.0 / 3.0) * np.sqrt(dH / distance)) / C3DParameters.roughness
+    Courant = v * deltaT / distance
+    waterBalance.maxCourant = max(waterBalance.maxCourant, float(Courant.max()))
+
+    # link area on surface = side length [m]
+    area = C3DLinks.area[links][isFlow] * Hs
+    values[isFlow] = (v / dH) * area
+    return values
+
+
+# -----------------------------------------------------------
+# surface flow split from the 3D system (SPLIT_SURFACE_FLOW):
+# explicit Manning flows on the surface links and on the runoff boundary
+# (same flows of runoff and boundaryConditions), in substeps with Courant
+# number <= SURFACE_COURANT, the outflow of a cell is limited to the water
+# over the pond
+# the runoff is left in the cells and set in boundaryConditions.splitRunoffFlow:
+# it is removed by the 3D system, as the other boundary flows
+# return the number of substeps
+# -----------------------------------------------------------
+def routeSurfaceWater(deltaT):
+    links = C3DLinks.runoffLinks
+    # each edge once
+    links = links[C3DLinks.i[links] < C3DLinks.j[links]]
+
+    # surface cells: local indices
+    cells = np.flatnonzero(C3DCells.isSurface)
+    i = np.searchsorted(cells, C3DLinks.i[links])
+    j = np.searchsorted(cells, C3DLinks.j[links])
+    z = C3DCells.z[cells]
+    area = C3DCells.area[cells]
+    H = C3DCells.H[cells]
+    pondZ = z + C3DParameters.pond
+    maxZ = np.maximum(pondZ[i], pondZ[j])
+    distance = C3DLinks.distance[links]
+    # link area on surface = side length [m]
+    side = C3DLinks.area[links]
+
+    # runoff boundary
+    runoffCells = boundaryConditions.runoffCells
+    isRunoff = C3DCells.boundarySlope[runoffCells] > 0
+    boundary = np.searchsorted(cells, runoffCells[isRunoff])
+    boundarySide = C3DCells.boundaryArea[runoffCells[isRunoff]]
+    boundaryDistance = area[boundary] / boundarySide
+    sqrtSlope = np.sqrt(C3DCells.boundarySlope[runoffCells[isRunoff]])
+    runoff = np.zeros(len(boundary), np.float64)
+
+    currentTime = 0.0
+    nrSubsteps = 0
+    while currentTime < deltaT:
+        dH = H[i] - H[j]
+        upstream = np.where(dH > 0, i, j)
+        downstream = np.where(dH > 0, j, i)
+        dH = np.fabs(dH)
+        Hs = H[upstream] - maxZ
+        isFlow = (dH >= EPSILON_METER) & (Hs > EPSILON_METER)
+        boundaryHs = H[boundary] - pondZ[boundary]
+        isBoundaryFlow = boundaryHs > EPSILON_METER
+        if not (np.any(isFlow) or np.any(isBoundaryFlow)):
+            break
+
+        upstream = upstream[isFlow]
+        downstream = downstream[isFlow]
+        dH = dH[isFlow]
+        linkDistance = distance[isFlow]
+        # pond
+        Hs = np.minimum(Hs[isFlow], dH)
+        # [m s-1] Manning equation
+        v = (Hs ** (2.0 / 3.0) * np.sqrt(dH / linkDistance)) / C3DParameters.roughness
+        boundaryHs = np.where(isBoundaryFlow, boundaryHs, 0.0)
+        boundaryV = (boundaryHs ** (2.0 / 3.0) * sqrtSlope) / C3DParameters.roughness
+        maxCourant = max(float(np.max(v / linkDistance, initial=0.0)),
+                         float(np.max(boundaryV / boundaryDistance, initial=0.0)))
+        dt = min(deltaT - currentTime, SURFACE_COURANT / maxCourant)
+
+        # [m3]
+        flow = v * side[isFlow] * Hs * dt
+        boundaryFlow = boundaryV * boundarySide * boundaryHs * dt
+        outflow = np.bincount(upstream, flow, len(cells))
+        outflow[boundary] += boundaryFlow
+        water = np.maximum(H - pondZ, 0.0) * area
+        isLimited = outflow > water
+        if np.any(isLimited):
+            factor = np.ones(len(cells))
+            factor[isLimited] = water[isLimited] / outflow[isLimited]
+            flow *= factor[upstream]
+            boundaryFlow *= factor[boundary]
+
+        H += (np.bincount(downstream, flow, len(cells)) - np.bincount(upstream, flow, len(cells))) / area
+        H[boundary] -= boundaryFlow / area[boundary]
+        runoff += boundaryFlow
+        currentTime += dt
+        nrSubsteps += 1
+
+    H[boundary] += runoff / area[boundary]
+    C3DCells.H[cells] = np.maximum(H, z)
+    boundaryConditions.splitRunoffFlow.fill(0.0)
+    boundaryConditions.splitRunoffFlow[isRunoff] = -runoff / deltaT
+    return nrSubsteps
@@ -5,6 +5,7 @@ import PSP_soil as soil
 import PSP_balance as balance
 import PSP_tin as tin
 import PSP_criteria3D as Criteria3D
+import PSP_boundaryConditions as boundary
 import PSP_visual3D as visual3D
 from PSP_fileUtilities import loadState
 
@@ -122,6 +123,8 @@ def main():
             index = nrTriangles * layer + i 
             linkIndex = index + nrTriangles
             Criteria3D.SetCellLink(index, linkIndex, DOWN, exchangeArea)
+    
+    boundary.initializeBoundary()
             
     # LOAD INITIAL STATE - comment if you dont't have one
     if (not C3DParameters.computeOnlySurface): 